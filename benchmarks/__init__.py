@@ -0,0 +1,9 @@
+"""
+Benchmarks of the circuit breaker hot paths.
+
+The benchmarks are not part of the test suite, they are run manually
+to measure the overhead of the library, and compared between releases::
+
+    python -m benchmarks --json baseline.json
+    python -m benchmarks --compare baseline.json
+"""
@@ -0,0 +1,126 @@
+"""
+Run the benchmarks and write a json report.
+
+::
+
+    python -m benchmarks --json report.json
+    python -m benchmarks --compare report.json -k circuitbreaker
+
+The report is a json document, stable between releases, that can be
+compared to the current run in order to detect regressions::
+
+    {
+        "format": 1,
+        "purgatory": "3.0.1",
+        "python": "3.12.7",
+        "implementation": "CPython",
+        "platform": "Linux-6.8.0-x86_64-with-glibc2.39",
+        "results": {
+            "circuitbreaker.async_decorator": {"unit": "ns/call", "value": 1042.1}
+        }
+    }
+
+Every measure is a cost, a greater value is a regression.
+"""
+
+import argparse
+import json
+import platform
+import sys
+from typing import Any
+
+import purgatory
+
+from . import registry
+
+REPORT_FORMAT = 1
+
+
+def build_report(results: dict[str, tuple[str, float]]) -> dict[str, Any]:
+    return {
+        "format": REPORT_FORMAT,
+        "purgatory": purgatory.__version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "results": {
+            name: {"unit": unit, "value": round(value, 1)}
+            for name, (unit, value) in sorted(results.items())
+        },
+    }
+
+
+def compare(
+    report: dict[str, Any], baseline: dict[str, Any], max_regression: float
+) -> list[str]:
+    """Print the ratio with the baseline, return the regressions."""
+    if baseline.get("format") != REPORT_FORMAT:
+        raise ValueError(f"Unsupported report format {baseline.get('format')}")
+    regressions = []
+    print()
+    print(f"{'benchmark':<44} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for name, result in report["results"].items():
+        base = baseline["results"].get(name)
+        if base is None or base["unit"] != result["unit"] or not base["value"]:
+            continue
+        ratio = result["value"] / base["value"]
+        flag = ""
+        if ratio > 1 + max_regression:
+            regressions.append(name)
+            flag = " !"
+        print(
+            f"{name:<44} {base['value']:>12.1f} {result['value']:>12.1f} "
+            f"{ratio:>7.2f}{flag}"
+        )
+    return regressions
+
+
+def main(argv: Any = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("-k", dest="keyword", help="only run matching benchmarks")
+    parser.add_argument("--json", dest="json_path", help="write the json report")
+    parser.add_argument("--compare", help="json report to compare with")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.1,
+        help="ratio above the baseline considered as a regression",
+    )
+    parser.add_argument(
+        "--module",
+        action="append",
+        default=[],
+        help="import a module that registers more benchmarks",
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="run less iterations, less accurate"
+    )
+    args = parser.parse_args(argv)
+    if args.quick:
+        registry.SCALE = 0.05
+
+    benchmarks = registry.load_benchmarks(args.module)
+    results: dict[str, tuple[str, float]] = {}
+    for name, bench in sorted(benchmarks.items()):
+        if args.keyword and args.keyword not in name:
+            continue
+        value = bench.func()
+        results[name] = (bench.unit, value)
+        print(f"{name:<44} {value:>12.1f} {bench.unit:<13} {bench.description}")
+
+    report = build_report(results)
+    if args.json_path:
+        with open(args.json_path, "w") as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
+            report_file.write("\n")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(report, baseline, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
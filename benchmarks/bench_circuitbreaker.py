@@ -0,0 +1,107 @@
+"""
+Overhead of the circuit breaker on successful calls of a closed circuit.
+
+The decorated functions are compared to a bare ``try/except`` wrapper.
+"""
+
+import threading
+import time
+
+from purgatory import AsyncCircuitBreakerFactory, Bulkhead, SyncCircuitBreakerFactory
+
+from .registry import ameasure, benchmark, iterations, measure
+
+ITERATIONS = 200_000
+THREADS = 8
+
+
+async def anoop() -> None:
+    pass
+
+
+def noop() -> None:
+    pass
+
+
+@benchmark("circuitbreaker.async_baseline", "ns/call")
+def async_baseline() -> float:
+    """Await a coroutine in a try/except block."""
+
+    async def abare() -> None:
+        try:
+            return await anoop()
+        except Exception:
+            raise
+
+    return ameasure(abare, ITERATIONS)
+
+
+@benchmark("circuitbreaker.async_decorator", "ns/call")
+def async_decorator() -> float:
+    """Await a coroutine decorated by the async factory."""
+    abreaker = AsyncCircuitBreakerFactory()
+    return ameasure(abreaker("bench")(anoop), ITERATIONS)
+
+
+@benchmark("circuitbreaker.async_bulkhead", "ns/call")
+def async_bulkhead() -> float:
+    """Await a coroutine decorated by the async factory, with a bulkhead."""
+    abreaker = AsyncCircuitBreakerFactory(default_bulkhead=Bulkhead(100))
+    return ameasure(abreaker("bench")(anoop), ITERATIONS)
+
+
+@benchmark("circuitbreaker.async_timeout", "ns/call")
+def async_timeout() -> float:
+    """Await a coroutine decorated by the async factory, with a timeout."""
+    abreaker = AsyncCircuitBreakerFactory(default_timeout=60)
+    return ameasure(abreaker("bench")(anoop), ITERATIONS)
+
+
+@benchmark("circuitbreaker.sync_baseline", "ns/call")
+def sync_baseline() -> float:
+    """Call a function in a try/except block."""
+
+    def bare() -> None:
+        try:
+            return noop()
+        except Exception:
+            raise
+
+    return measure(bare, ITERATIONS)
+
+
+@benchmark("circuitbreaker.sync_decorator", "ns/call")
+def sync_decorator() -> float:
+    """Call a function decorated by the sync factory."""
+    breaker = SyncCircuitBreakerFactory()
+    return measure(breaker("bench")(noop), ITERATIONS)
+
+
+@benchmark("circuitbreaker.sync_bulkhead", "ns/call")
+def sync_bulkhead() -> float:
+    """Call a function decorated by the sync factory, with a bulkhead."""
+    breaker = SyncCircuitBreakerFactory(default_bulkhead=Bulkhead(100))
+    return measure(breaker("bench")(noop), ITERATIONS)
+
+
+@benchmark("circuitbreaker.threaded_decorator", "ns/call")
+def threaded_decorator() -> float:
+    """Call a function decorated by a thread safe factory from 8 threads."""
+    breaker = SyncCircuitBreakerFactory(thread_safe=True)
+    decorated = breaker("bench")(noop)
+    count = iterations(ITERATIONS // THREADS)
+    barrier = threading.Barrier(THREADS + 1)
+
+    def run() -> None:
+        barrier.wait()
+        for _ in range(count):
+            decorated()
+
+    threads = [threading.Thread(target=run) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return (time.perf_counter() - start) / (count * THREADS) * 1e9
@@ -0,0 +1,107 @@
+"""
+Cost of a request going through the context, per state of the circuit.
+
+Transitions are measured on fresh contexts created before the measure.
+"""
+
+import time
+from typing import Callable
+
+from purgatory.domain.model import Context, CountWindow, OpenedState
+
+from .registry import benchmark, iterations, measure
+
+ITERATIONS = 500_000
+
+
+class Failure(Exception):
+    pass
+
+
+def measure_contexts(contexts: list[Context], func: Callable[[Context], None]) -> float:
+    """Return the duration of one call per context in nanoseconds."""
+    count = len(contexts)
+    start = time.perf_counter()
+    for context in contexts:
+        func(context)
+    return (time.perf_counter() - start) / count * 1e9
+
+
+@benchmark("context.closed_success", "ns/request")
+def closed_success() -> float:
+    """Successful request on a closed circuit."""
+    context = Context("bench", 5, 30)
+
+    def request() -> None:
+        with context:
+            pass
+
+    return measure(request, ITERATIONS)
+
+
+@benchmark("context.closed_failure", "ns/request")
+def closed_failure() -> float:
+    """Failed request on a closed circuit under its threshold."""
+    context = Context("bench", ITERATIONS * 2, 30)
+    exc = Failure()
+
+    def request() -> None:
+        try:
+            with context:
+                raise exc
+        except Failure:
+            pass
+        context.pop_messages()
+
+    return measure(request, ITERATIONS)
+
+
+@benchmark("context.closed_failure_rate", "ns/request")
+def closed_failure_rate() -> float:
+    """Requests on a closed circuit with a failure rate window, half failed."""
+    context = Context("bench", 5, 30)
+    context.window = CountWindow(100, failure_rate=1, minimum_calls=100)
+    exc = Failure()
+
+    def request() -> None:
+        try:
+            with context:
+                raise exc
+        except Failure:
+            pass
+        with context:
+            pass
+        context.pop_messages()
+
+    return measure(request, ITERATIONS) / 2
+
+
+@benchmark("context.half_opened_success", "ns/request")
+def half_opened_success() -> float:
+    """Successful request that closes a half opened circuit."""
+    contexts = [
+        Context("bench", 5, 30, state="half-opened")
+        for _ in range(iterations(ITERATIONS // 5))
+    ]
+
+    def request(context: Context) -> None:
+        with context:
+            pass
+        context.pop_messages()
+
+    return measure_contexts(contexts, request)
+
+
+@benchmark("context.opened_rejection", "ns/request")
+def opened_rejection() -> float:
+    """Request rejected by an opened circuit."""
+    context = Context("bench", 5, 3600, state="opened", opened_at=time.time())
+
+    def request() -> None:
+        try:
+            with context:
+                pass
+        except OpenedState:
+            pass
+
+    return measure(request, ITERATIONS)
@@ -0,0 +1,33 @@
+"""
+Import time of the package, measured in a fresh interpreter.
+"""
+
+import subprocess
+import sys
+
+from .registry import benchmark, iterations
+
+RUNS = 20
+
+
+def import_time(module: str) -> float:
+    """Return the cumulative import time of the module in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        _, _, fields = line.partition("import time:")
+        _, cumulative, name = (field.strip() for field in fields.split("|"))
+        if name == module:
+            return float(cumulative)
+    raise ValueError(f"{module} not found in the import time report")
+
+
+@benchmark("import.purgatory", "us")
+def import_purgatory() -> float:
+    """Import purgatory in a fresh interpreter, best of the runs."""
+    return min(import_time("purgatory") for _ in range(iterations(RUNS)))
@@ -0,0 +1,34 @@
+"""
+Memory footprint of the circuits stored in the in memory repository.
+"""
+
+import gc
+import tracemalloc
+
+from purgatory.domain.model import Context
+from purgatory.service._sync.repository import SyncInMemoryRepository
+
+from .registry import benchmark, iterations
+
+CIRCUITS = 100_000
+
+
+@benchmark("memory.closed_circuit", "bytes/circuit")
+def bytes_per_circuit() -> float:
+    """
+    Memory allocated per closed circuit in the in memory repository.
+
+    Circuit names are created before the measure, they are owned by the
+    application, not by the repository.
+    """
+    circuits = iterations(CIRCUITS)
+    names = [f"circuit-{i}" for i in range(circuits)]
+    repository = SyncInMemoryRepository()
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    for name in names:
+        repository.register(Context(name, 5, 30))
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (end - start) / circuits
@@ -0,0 +1,70 @@
+"""
+Dispatch cost of the message bus versus the number of queued events.
+
+A command handler raises ``n`` events, every event is handled by a listener
+that does nothing.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+
+from purgatory.domain.messages import Command, Event
+from purgatory.service._async.messagebus import AsyncMessageRegistry
+from purgatory.service._async.unit_of_work import (
+    AsyncAbstractUnitOfWork,
+    AsyncInMemoryUnitOfWork,
+)
+
+from .registry import benchmark, iterations
+
+QUEUE_SIZES = (1, 10, 100, 1_000, 10_000)
+
+
+@dataclass(frozen=True)
+class Burst(Command):
+    size: int
+
+
+@dataclass(frozen=True)
+class Noise(Event):
+    pass
+
+
+async def raise_events(cmd: Burst, uow: AsyncAbstractUnitOfWork) -> None:
+    uow.contexts.messages.extend(Noise() for _ in range(cmd.size))
+
+
+async def ignore_event(evt: Noise, uow: AsyncAbstractUnitOfWork) -> None:
+    pass
+
+
+def dispatch_cost(size: int) -> float:
+    """Return the cost of the dispatch, per event, in nanoseconds."""
+    messagebus = AsyncMessageRegistry()
+    messagebus.add_listener(Burst, raise_events)
+    messagebus.add_listener(Noise, ignore_event)
+    uow = AsyncInMemoryUnitOfWork()
+    count = max(10, iterations(100_000) // size)
+
+    async def run() -> float:
+        start = time.perf_counter()
+        for _ in range(count):
+            await messagebus.handle(Burst(size), uow)
+        return time.perf_counter() - start
+
+    return asyncio.run(run()) / count / size * 1e9
+
+
+def register_benchmarks(size: int) -> None:
+    @benchmark(
+        f"messagebus.handle[{size}]",
+        "ns/event",
+        f"Dispatch a command that raises {size} events.",
+    )
+    def handle() -> float:
+        return dispatch_cost(size)
+
+
+for size in QUEUE_SIZES:
+    register_benchmarks(size)
@@ -0,0 +1,125 @@
+"""
+Cost of the repository operations used on every request.
+
+The redis repository runs against the in process redis of the tests,
+so the measure is the cost of the client side: serialization, pipelines
+and scripts, without the network.
+"""
+
+import os
+import tempfile
+from typing import Callable
+
+from purgatory.domain.model import Context
+from purgatory.service._sync.repository import (
+    SyncAbstractRepository,
+    SyncInMemoryRepository,
+    SyncRedisRepository,
+    SyncSharedMemoryRepository,
+    SyncSqliteRepository,
+)
+from tests.unittests._sync.fake_redis import FakeRedis
+
+from .registry import benchmark, measure
+
+ITERATIONS = 50_000
+
+
+def inmemory_repository() -> SyncAbstractRepository:
+    return SyncInMemoryRepository()
+
+
+def bounded_inmemory_repository() -> SyncAbstractRepository:
+    return SyncInMemoryRepository(max_size=10_000, idle_ttl=3600)
+
+
+def redis_repository(
+    atomic: bool = False, write_behind: bool = False
+) -> SyncAbstractRepository:
+    repository = SyncRedisRepository(
+        "redis://localhost", atomic=atomic, write_behind=write_behind
+    )
+    repository.redis = FakeRedis()  # type: ignore
+    repository.initialize()
+    return repository
+
+
+def atomic_redis_repository() -> SyncAbstractRepository:
+    return redis_repository(atomic=True)
+
+
+def write_behind_redis_repository() -> SyncAbstractRepository:
+    return redis_repository(write_behind=True)
+
+
+def shm_repository() -> SyncAbstractRepository:
+    fd, path = tempfile.mkstemp(prefix="purgatory-bench-")
+    os.close(fd)
+    repository = SyncSharedMemoryRepository(path, capacity=16)
+    # the mapping outlives the file
+    os.unlink(path)
+    return repository
+
+
+# removed at exit
+DATABASES = tempfile.TemporaryDirectory(prefix="purgatory-bench-")
+
+
+def sqlite_repository() -> SyncAbstractRepository:
+    fd, path = tempfile.mkstemp(suffix=".sqlite", dir=DATABASES.name)
+    os.close(fd)
+    return SyncSqliteRepository(path)
+
+
+REPOSITORIES: dict[str, Callable[[], SyncAbstractRepository]] = {
+    "inmemory": inmemory_repository,
+    "inmemory_bounded": bounded_inmemory_repository,
+    "redis": redis_repository,
+    "redis_atomic": atomic_redis_repository,
+    "redis_write_behind": write_behind_redis_repository,
+    "shm": shm_repository,
+    "sqlite": sqlite_repository,
+}
+
+
+def register_benchmarks(
+    kind: str, factory: Callable[[], SyncAbstractRepository]
+) -> None:
+    @benchmark(f"repository.{kind}.get", description=f"Get a circuit ({kind}).")
+    def get() -> float:
+        repository = factory()
+        repository.register(Context("bench", 5, 30))
+        return measure(lambda: repository.get("bench"), ITERATIONS)
+
+    @benchmark(
+        f"repository.{kind}.register",
+        description=f"Register a new circuit ({kind}).",
+    )
+    def register() -> float:
+        repository = factory()
+        context = Context("bench", 5, 30)
+        return measure(lambda: repository.register(context), ITERATIONS)
+
+    @benchmark(
+        f"repository.{kind}.inc_failures",
+        description=f"Count a failure of a closed circuit ({kind}).",
+    )
+    def inc_failures() -> float:
+        repository = factory()
+        repository.register(Context("bench", 5, 30))
+        return measure(lambda: repository.inc_failures("bench", 1), ITERATIONS)
+
+    @benchmark(
+        f"repository.{kind}.update_state",
+        description=f"Close a circuit ({kind}).",
+    )
+    def update_state() -> float:
+        repository = factory()
+        repository.register(Context("bench", 5, 30))
+        return measure(
+            lambda: repository.update_state("bench", "closed", None), ITERATIONS
+        )
+
+
+for kind, factory in REPOSITORIES.items():
+    register_benchmarks(kind, factory)
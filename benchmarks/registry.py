@@ -0,0 +1,90 @@
+"""
+Registry of the benchmarks.
+
+A benchmark is a function that returns a measure, registered using the
+:func:`benchmark` decorator. Modules named ``bench_*`` in this package are
+loaded by the runner, other modules can be loaded using ``--module``.
+"""
+
+import asyncio
+import importlib
+import pkgutil
+import time
+from collections.abc import Awaitable, Iterable
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+# Multiply the number of iterations, the runner lower it in quick mode.
+SCALE = 1.0
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    name: str
+    unit: str
+    func: Callable[[], float]
+    description: str
+
+
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+def benchmark(
+    name: str, unit: str = "ns/op", description: Optional[str] = None
+) -> Callable[[Callable[[], float]], Callable[[], float]]:
+    """
+    Register a function that returns the measure of the benchmark.
+
+    The description defaults to the first line of the function docstring.
+    """
+
+    def decorator(func: Callable[[], float]) -> Callable[[], float]:
+        if name in BENCHMARKS:
+            raise ValueError(f"Benchmark {name} registered twice")
+        desc = description
+        if desc is None:
+            doc = (func.__doc__ or "").strip().splitlines()
+            desc = doc[0] if doc else ""
+        BENCHMARKS[name] = Benchmark(name, unit, func, desc)
+        return func
+
+    return decorator
+
+
+def load_benchmarks(modules: Iterable[str] = ()) -> dict[str, Benchmark]:
+    """Import the bench_* modules of this package and the given modules."""
+    package = importlib.import_module(__package__ or "benchmarks")
+    for module in pkgutil.iter_modules(package.__path__):
+        if module.name.startswith("bench_"):
+            importlib.import_module(f"{package.__name__}.{module.name}")
+    for module_name in modules:
+        importlib.import_module(module_name)
+    return BENCHMARKS
+
+
+def iterations(count: int) -> int:
+    return max(1, int(count * SCALE))
+
+
+def measure(func: Callable[[], Any], count: int) -> float:
+    """Return the duration of one call in nanoseconds."""
+    func()
+    count = iterations(count)
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count * 1e9
+
+
+def ameasure(func: Callable[[], Awaitable[Any]], count: int) -> float:
+    """Return the duration of one awaited call in nanoseconds."""
+    count = iterations(count)
+
+    async def run() -> float:
+        await func()
+        start = time.perf_counter()
+        for _ in range(count):
+            await func()
+        return (time.perf_counter() - start) / count * 1e9
+
+    return asyncio.run(run())
@@ -10,6 +10,10 @@ unasync.unasync_files(
             "src/purgatory/service/_sync",
             additional_replacements={
                 "_async": "_sync",
+                "asyncio": "threading",
+                "create_async_client": "create_sync_client",
+                "create_async_deadlines": "create_sync_deadlines",
+                "current_task": "get_ident",
             },
         ),
     ],
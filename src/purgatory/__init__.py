@@ -5,36 +5,62 @@ __version__ = metadata.version("purgatory")
 
 from purgatory.domain.messages import Event
 from purgatory.domain.messages.events import (
+    BulkheadFull,
     CircuitBreakerCreated,
     CircuitBreakerFailed,
     CircuitBreakerRecovered,
     ContextChanged,
 )
+from purgatory.domain.model import (
+    Backoff,
+    Bulkhead,
+    BulkheadFullError,
+    CallTimeoutError,
+    FailureRatePolicy,
+)
 from purgatory.service._async.circuitbreaker import AsyncCircuitBreakerFactory
 from purgatory.service._async.unit_of_work import (
     AsyncAbstractUnitOfWork,
+    AsyncCachedUnitOfWork,
     AsyncInMemoryUnitOfWork,
     AsyncRedisUnitOfWork,
+    AsyncSharedMemoryUnitOfWork,
+    AsyncSqliteUnitOfWork,
 )
 from purgatory.service._sync.circuitbreaker import SyncCircuitBreakerFactory
 from purgatory.service._sync.unit_of_work import (
     SyncAbstractUnitOfWork,
+    SyncCachedUnitOfWork,
     SyncInMemoryUnitOfWork,
     SyncRedisUnitOfWork,
+    SyncSharedMemoryUnitOfWork,
+    SyncSqliteUnitOfWork,
 )
 
 __all__ = [
     "AsyncAbstractUnitOfWork",
+    "AsyncCachedUnitOfWork",
     "AsyncCircuitBreakerFactory",
     "AsyncInMemoryUnitOfWork",
     "AsyncRedisUnitOfWork",
+    "AsyncSharedMemoryUnitOfWork",
+    "AsyncSqliteUnitOfWork",
+    "Backoff",
+    "Bulkhead",
+    "BulkheadFull",
+    "BulkheadFullError",
+    "CallTimeoutError",
     "CircuitBreakerCreated",
     "CircuitBreakerFailed",
     "CircuitBreakerRecovered",
     "ContextChanged",
     "Event",
+    "FailureRatePolicy",
     "SyncCircuitBreakerFactory",
     "SyncAbstractUnitOfWork",
+    "SyncCachedUnitOfWork",
     "SyncInMemoryUnitOfWork",
     "SyncRedisUnitOfWork",
+    "SyncSharedMemoryUnitOfWork",
+    "SyncSqliteUnitOfWork",
 ]
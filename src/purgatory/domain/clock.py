@@ -0,0 +1,26 @@
+"""
+Clocks of the circuits.
+
+The circuits measure time using a monotonic clock, that is not affected by
+the updates of the system time. The wall clock is only used for the opening
+time of the circuits, that is shared by processes using the repository.
+"""
+
+import sys
+import time
+from functools import partial
+
+from purgatory.typing import Clock
+
+monotonic: Clock = time.monotonic
+wall_clock: Clock = time.time
+
+# The coarse clock is refreshed by the kernel on every tick, every few
+# milliseconds, and is cheaper to read. It is not exposed by the time module.
+CLOCK_MONOTONIC_COARSE = 6
+
+coarse_monotonic: Clock = (
+    partial(time.clock_gettime, CLOCK_MONOTONIC_COARSE)
+    if sys.platform == "linux"
+    else time.monotonic
+)
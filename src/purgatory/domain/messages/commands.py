@@ -10,3 +10,10 @@ class CreateCircuitBreaker(Command):
     name: str
     threshold: Threshold
     ttl: TTL
+
+
+@dataclass(frozen=True)
+class CreateCircuitBreakers(Command):
+    names: tuple[str, ...]
+    threshold: Threshold
+    ttl: TTL
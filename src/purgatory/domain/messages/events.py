@@ -29,3 +29,9 @@ class CircuitBreakerFailed(Event):
 @dataclass(frozen=True)
 class CircuitBreakerRecovered(Event):
     name: str
+
+
+@dataclass(frozen=True)
+class BulkheadFull(Event):
+    name: str
+    max_calls: int
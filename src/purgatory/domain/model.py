@@ -5,18 +5,19 @@ The state model is implemented using the State pattern from the Gang Of Four.
 """
 
 import abc
-import time
-from dataclasses import dataclass
+import random
+from collections.abc import Sequence
 from types import TracebackType
-from typing import Callable, Optional, Union, cast
+from typing import Any, Callable, Optional, Union, cast
 
+from purgatory.domain.clock import monotonic, wall_clock
 from purgatory.domain.messages.base import Event
 from purgatory.domain.messages.events import (
     CircuitBreakerFailed,
     CircuitBreakerRecovered,
     ContextChanged,
 )
-from purgatory.typing import TTL, CircuitName, StateName, Threshold
+from purgatory.typing import TTL, CircuitName, Clock, StateName, Threshold
 
 ExcludeExcType = type[BaseException]
 ExcludeTypeFunc = tuple[ExcludeExcType, Callable[..., bool]]
@@ -32,12 +33,381 @@ OPENED: StateName = "opened"
 HALF_OPENED: StateName = "half-opened"
 
 
+class ExceptionClassifier:
+    """
+    Exclude list compiled to decide if an exception is a failure.
+
+    The decision is cached per exception type, the first matching exception
+    type of the exclude list wins, as ``isinstance`` would do.
+    Predicates are only called for the exception types they are registered to.
+    """
+
+    __slots__ = ("decisions", "exclude_list", "rules")
+
+    def __init__(self, exclude: Optional[ExcludeType] = None) -> None:
+        self.exclude_list: ExcludeType = exclude or []
+        self.rules: tuple[
+            tuple[ExcludeExcType, Optional[Callable[[BaseException], bool]]], ...
+        ] = tuple(
+            (
+                cast(ExcludeTypeFunc, exctype_func)
+                if isinstance(exctype_func, tuple)
+                else (exctype_func, None)
+            )
+            for exctype_func in self.exclude_list
+        )
+        # True for failure, False for excluded, otherwise the predicate to call
+        self.decisions: dict[
+            type[BaseException], Union[bool, Callable[[BaseException], bool]]
+        ] = {}
+
+    def _decide(
+        self, exc_type: type[BaseException]
+    ) -> Union[bool, Callable[[BaseException], bool]]:
+        for exctype, func in self.rules:
+            if issubclass(exc_type, exctype):
+                return False if func is None else func
+        return True
+
+    def is_failure(self, exc: BaseException) -> bool:
+        exc_type = type(exc)
+        try:
+            decision = self.decisions[exc_type]
+        except KeyError:
+            decision = self.decisions[exc_type] = self._decide(exc_type)
+        if decision is True or decision is False:
+            return decision
+        return not decision(exc)
+
+
+NO_EXCLUDE = ExceptionClassifier()
+
+
+class Backoff:
+    """
+    Grow the TTL of a circuit that is reopened without being closed.
+
+    The n-th consecutive opening lasts ``ttl * factor ** (n - 1)`` seconds, up
+    to ``max_ttl``. Every duration is extended by a ratio drawn once per
+    process, up to ``jitter``, so the processes do not probe at the same time.
+    """
+
+    __slots__ = ("factor", "jitter", "max_ttl", "spread")
+
+    def __init__(
+        self, factor: float = 2.0, max_ttl: float = 600.0, jitter: float = 0.1
+    ) -> None:
+        if factor < 1:
+            raise ValueError("factor must be >= 1")
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be in [0, 1]")
+        self.factor = factor
+        self.max_ttl = max_ttl
+        self.jitter = jitter
+        self.spread = 1 + random.uniform(0, jitter)
+
+    def __repr__(self) -> str:
+        return (
+            f"Backoff(factor={self.factor}, max_ttl={self.max_ttl}, "
+            f"jitter={self.jitter})"
+        )
+
+    def duration(self, ttl: TTL, open_count: int) -> float:
+        """Return the duration of the opening, in seconds."""
+        max_ttl = max(ttl, self.max_ttl)
+        # the exponent is bounded, the duration is capped anyway
+        ttl *= self.factor ** min(max(open_count - 1, 0), 64)
+        return min(ttl, max_ttl) * self.spread
+
+
+class Bulkhead:
+    """
+    Limit the number of calls in flight of a circuit, in a process.
+
+    When ``max_calls`` calls are in flight, up to ``max_queued`` calls wait
+    for a slot, at most ``max_wait`` seconds, other calls are rejected.
+    """
+
+    __slots__ = ("max_calls", "max_queued", "max_wait")
+
+    def __init__(
+        self, max_calls: int, max_queued: int = 0, max_wait: Optional[float] = None
+    ) -> None:
+        if max_calls < 1:
+            raise ValueError("max_calls must be > 0")
+        if max_queued < 0:
+            raise ValueError("max_queued must be >= 0")
+        if max_wait is not None and max_wait < 0:
+            raise ValueError("max_wait must be >= 0")
+        self.max_calls = max_calls
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+
+    def __repr__(self) -> str:
+        return (
+            f"Bulkhead(max_calls={self.max_calls}, max_queued={self.max_queued}, "
+            f"max_wait={self.max_wait})"
+        )
+
+
+class BulkheadFullError(Exception):
+    """A call rejected because too many calls of the circuit are in flight."""
+
+    def __init__(self, circuit_name: CircuitName, max_calls: int) -> None:
+        super().__init__(
+            f"Circuit {circuit_name} has reached its {max_calls} calls in flight"
+        )
+        self.circuit_name = circuit_name
+        self.max_calls = max_calls
+
+
+class SlowCallError(Exception):
+    """A call that succeeded, but slower than the slow call duration."""
+
+    def __init__(self, circuit_name: CircuitName, duration: float) -> None:
+        super().__init__(f"Call of circuit {circuit_name} took {duration:.3f}s")
+        self.circuit_name = circuit_name
+        self.duration = duration
+
+
+class CallTimeoutError(TimeoutError):
+    """A call that did not complete before the timeout of its circuit."""
+
+    def __init__(self, circuit_name: CircuitName, timeout: float) -> None:
+        super().__init__(f"Call of circuit {circuit_name} timed out after {timeout}s")
+        self.circuit_name = circuit_name
+        self.timeout = timeout
+
+
+class FailureRateWindow(abc.ABC):
+    """
+    Outcomes of the last calls of a circuit, to compute its failure rate.
+
+    Recording an outcome is O(1), and the memory of a window is bounded,
+    whatever the traffic is.
+    """
+
+    __slots__ = ("calls", "failure_rate", "failures", "minimum_calls")
+
+    calls: int
+    failures: int
+
+    def __init__(self, failure_rate: float, minimum_calls: int) -> None:
+        self.failure_rate = failure_rate
+        self.minimum_calls = minimum_calls
+        self.calls = 0
+        self.failures = 0
+
+    @abc.abstractmethod
+    def record(self, failure: bool) -> None:
+        """Record the outcome of a call."""
+
+    @abc.abstractmethod
+    def reset(self) -> None:
+        """Forget the recorded outcomes."""
+
+    def record_failure(self) -> bool:
+        """Record a failure, return True if the circuit has to be opened."""
+        self.record(True)
+        calls = self.calls
+        return calls >= self.minimum_calls and (
+            self.failures >= self.failure_rate * calls
+        )
+
+    def record_success(self) -> None:
+        self.record(False)
+
+
+class CountWindow(FailureRateWindow):
+    """Outcomes of the last ``size`` calls, stored in a ring buffer."""
+
+    __slots__ = ("outcomes", "position", "size")
+
+    def __init__(self, size: int, failure_rate: float, minimum_calls: int) -> None:
+        super().__init__(failure_rate, minimum_calls)
+        self.size = size
+        self.outcomes = bytearray(size)
+        self.position = 0
+
+    def record(self, failure: bool) -> None:
+        position = self.position
+        if self.calls == self.size:
+            self.failures -= self.outcomes[position]
+        else:
+            self.calls += 1
+        self.outcomes[position] = failure
+        self.failures += failure
+        position += 1
+        self.position = 0 if position == self.size else position
+
+    def reset(self) -> None:
+        self.outcomes = bytearray(self.size)
+        self.position = self.calls = self.failures = 0
+
+
+class TimeWindow(FailureRateWindow):
+    """
+    Outcomes of the calls of the last ``duration`` seconds.
+
+    The duration is split in buckets of counters, the oldest bucket is
+    dropped at once, so the window slides by steps of ``duration / buckets``.
+    """
+
+    __slots__ = (
+        "bucket_calls",
+        "bucket_failures",
+        "bucket_width",
+        "buckets",
+        "clock",
+        "duration",
+        "epoch",
+    )
+
+    def __init__(
+        self,
+        duration: float,
+        failure_rate: float,
+        minimum_calls: int,
+        buckets: int = 10,
+        clock: Clock = monotonic,
+    ) -> None:
+        super().__init__(failure_rate, minimum_calls)
+        self.duration = duration
+        self.buckets = buckets
+        self.bucket_width = duration / buckets
+        self.clock = clock
+        self.bucket_calls = [0] * buckets
+        self.bucket_failures = [0] * buckets
+        self.epoch = int(clock() / self.bucket_width)
+
+    def advance(self, epoch: int) -> None:
+        """Drop the buckets that are older than the duration of the window."""
+        buckets = self.buckets
+        for bucket_epoch in range(max(self.epoch, epoch - buckets) + 1, epoch + 1):
+            bucket = bucket_epoch % buckets
+            self.calls -= self.bucket_calls[bucket]
+            self.failures -= self.bucket_failures[bucket]
+            self.bucket_calls[bucket] = 0
+            self.bucket_failures[bucket] = 0
+        self.epoch = epoch
+
+    def record(self, failure: bool) -> None:
+        epoch = int(self.clock() / self.bucket_width)
+        if epoch > self.epoch:
+            self.advance(epoch)
+        bucket = epoch % self.buckets
+        self.bucket_calls[bucket] += 1
+        self.bucket_failures[bucket] += failure
+        self.calls += 1
+        self.failures += failure
+
+    def reset(self) -> None:
+        self.bucket_calls = [0] * self.buckets
+        self.bucket_failures = [0] * self.buckets
+        self.calls = self.failures = 0
+
+
+class FailureRatePolicy:
+    """
+    Open the circuit on the failure rate of the last calls.
+
+    The calls are counted in a window of the last ``window_size`` calls,
+    or of the last ``window_duration`` seconds if it is set.
+    The circuit is not opened before ``minimum_calls`` are recorded, so they
+    can not exceed the ``window_size`` of a count window.
+
+    The threshold of consecutive failures is not used by circuits that
+    have a failure rate policy. A policy cannot be used with the atomic
+    mode of the redis repository, that opens the circuits on the threshold.
+    """
+
+    __slots__ = (
+        "buckets",
+        "failure_rate",
+        "minimum_calls",
+        "window_duration",
+        "window_size",
+    )
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        minimum_calls: int = 10,
+        window_size: int = 100,
+        window_duration: Optional[float] = None,
+        buckets: int = 10,
+    ) -> None:
+        if not 0 < failure_rate <= 1:
+            raise ValueError("failure_rate must be in ]0, 1]")
+        if minimum_calls < 1 or window_size < 1 or buckets < 1:
+            raise ValueError("minimum_calls, window_size and buckets must be > 0")
+        if window_duration is not None and window_duration <= 0:
+            raise ValueError("window_duration must be > 0")
+        if window_duration is None and minimum_calls > window_size:
+            # the count window never holds more than window_size calls
+            raise ValueError("minimum_calls must be <= window_size")
+        self.failure_rate = failure_rate
+        self.minimum_calls = minimum_calls
+        self.window_size = window_size
+        self.window_duration = window_duration
+        self.buckets = buckets
+
+    def __repr__(self) -> str:
+        window = (
+            f"window_size={self.window_size}"
+            if self.window_duration is None
+            else f"window_duration={self.window_duration}"
+        )
+        return (
+            f"FailureRatePolicy(failure_rate={self.failure_rate}, "
+            f"minimum_calls={self.minimum_calls}, {window})"
+        )
+
+    def create_window(self, clock: Clock = monotonic) -> FailureRateWindow:
+        if self.window_duration is None:
+            return CountWindow(self.window_size, self.failure_rate, self.minimum_calls)
+        return TimeWindow(
+            self.window_duration,
+            self.failure_rate,
+            self.minimum_calls,
+            self.buckets,
+            clock,
+        )
+
+
 class Context:
+    __slots__ = (
+        "_messages",
+        "_state",
+        "backoff",
+        "classifier",
+        "clock",
+        "max_probes",
+        "name",
+        "open_count",
+        "slow_call_duration",
+        "threshold",
+        "ttl",
+        "wall_clock",
+        "window",
+    )
+
     name: CircuitName
     threshold: Threshold
     ttl: TTL
-    messages: list[Event]
-    exclude_list: ExcludeType
+    classifier: ExceptionClassifier
+    # set by the factory for circuits that have a failure rate policy
+    window: Optional[FailureRateWindow]
+    # calls slower than this duration, in seconds, are failures
+    slow_call_duration: Optional[float]
+    # maximum number of concurrent calls of the half opened circuit
+    max_probes: Optional[int]
+    # grow the TTL of the circuit on consecutive openings
+    backoff: Optional[Backoff]
+    # number of consecutive openings, reset when the circuit is closed
+    open_count: int
+    clock: Clock
+    wall_clock: Clock
 
     def __init__(
         self,
@@ -48,29 +418,60 @@ class Context:
         failure_count: int = 0,
         opened_at: Optional[float] = None,
         exclude: Optional[ExcludeType] = None,
+        clock: Clock = monotonic,
+        wall_clock: Clock = wall_clock,
+        open_count: int = 0,
     ) -> None:
         self.name = name
         self.ttl = ttl
         self.threshold = threshold
+        self.open_count = open_count
+        self.clock = clock
+        self.wall_clock = wall_clock
 
         self._state: State
-        if state == OpenedState.name:
-            self._state = OpenedState(name)
-        elif state == HalfOpenedState.name:
-            self._state = HalfOpenedState()
+        if state == OPENED:
+            self._state = OpenedState(name, opened_at, failure_count)
+        elif state == HALF_OPENED:
+            self._state = HALF_OPENED_STATE
         else:
-            self._state = ClosedState()
+            self._state = ClosedState(failure_count)
 
-        if opened_at is not None:
-            self._state.opened_at = opened_at
-        self._state.failure_count = failure_count
-        self.messages = []
-        self.exclude_list = exclude or []
+        # allocated on the first message
+        self._messages: Optional[list[Event]] = None
+        self.classifier = ExceptionClassifier(exclude) if exclude else NO_EXCLUDE
+        self.window = None
+        self.slow_call_duration = None
+        self.max_probes = None
+        self.backoff = None
 
     @property
     def state(self) -> StateName:
         return cast(StateName, self._state.name)
 
+    @property
+    def messages(self) -> list[Event]:
+        messages = self._messages
+        if messages is None:
+            messages = self._messages = []
+        return messages
+
+    def pop_messages(self) -> Sequence[Event]:
+        """Return the messages to dispatch, and release them from the context."""
+        messages = self._messages
+        if messages is None:
+            return ()
+        self._messages = None
+        return messages
+
+    @property
+    def exclude_list(self) -> ExcludeType:
+        return self.classifier.exclude_list
+
+    @exclude_list.setter
+    def exclude_list(self, exclude: ExcludeType) -> None:
+        self.classifier = ExceptionClassifier(exclude) if exclude else NO_EXCLUDE
+
     @property
     def opened_at(self) -> Optional[float]:
         return self._state.opened_at
@@ -89,6 +490,24 @@ class Context:
             )
         )
 
+    def open_duration(self) -> float:
+        """Return the number of seconds the circuit stays opened."""
+        backoff = self.backoff
+        if backoff is None:
+            return self.ttl
+        return backoff.duration(self.ttl, self.open_count)
+
+    def open(self) -> None:
+        """Open the circuit, from now."""
+        self.open_count += 1
+        self.set_state(
+            OpenedState(
+                self.name,
+                self.wall_clock(),
+                closed_at=self.clock() + self.open_duration(),
+            )
+        )
+
     def mark_failure(self, failure_count: int) -> None:
         self.messages.append(
             CircuitBreakerFailed(
@@ -108,29 +527,67 @@ class Context:
         self._state.handle_new_request(self)
 
     def handle_exception(self, exc: BaseException) -> None:
-        failed = True
-        for exctype_func in self.exclude_list:
-            if isinstance(exctype_func, tuple):
-                exctype, func = cast(ExcludeTypeFunc, exctype_func)
-            else:
-                exctype, func = (
-                    cast(ExcludeExcType, exctype_func),
-                    cast(
-                        Callable[[BaseException], bool],
-                        lambda exc: True,  # type: ignore
-                    ),
-                )
-
-            if isinstance(exc, exctype):
-                failed = not func(exc)
-                break
-        if failed:
+        if self.classifier.is_failure(exc):
             self._state.handle_exception(self, exc)
         else:
             self._state.handle_end_request(self)
 
-    def handle_end_request(self) -> None:
-        self._state.handle_end_request(self)
+    def handle_end_request(self, duration: Optional[float] = None) -> None:
+        """
+        Handle the end of a successful call.
+
+        If the duration of the call is given, and the call is slower than the
+        slow call duration, the call is handled as a failure.
+        """
+        slow_call_duration = self.slow_call_duration
+        if (
+            slow_call_duration is not None
+            and duration is not None
+            and duration > slow_call_duration
+        ):
+            self._state.handle_exception(self, SlowCallError(self.name, duration))
+        else:
+            self._state.handle_end_request(self)
+
+    def new_call(self) -> Sequence[Event]:
+        """
+        Handle a new call, and return the events it produced.
+
+        The events are collected in a buffer of the call, not in the messages
+        of the context, so concurrent calls never dispatch the events of
+        another call. Raise :class:`OpenedState` if the call is rejected.
+        """
+        if self._messages is not None:
+            return self.isolated(self.new_call)
+        self._state.handle_new_request(self)
+        return self.pop_messages()
+
+    def end_call(
+        self, exc: Optional[BaseException] = None, duration: Optional[float] = None
+    ) -> Sequence[Event]:
+        """Handle the end of a call, and return the events it produced."""
+        if self._messages is not None:
+            return self.isolated(self.end_call, exc, duration)
+        if exc is None:
+            self.handle_end_request(duration)
+        else:
+            self.handle_exception(exc)
+        messages = self._messages
+        if messages is None:
+            return ()
+        self._messages = None
+        return messages
+
+    def isolated(
+        self, call: Callable[..., Sequence[Event]], *args: Any
+    ) -> Sequence[Event]:
+        """Run a call while the messages of the context are set aside."""
+        pending = self._messages
+        self._messages = None
+        try:
+            return call(*args)
+        finally:
+            self._messages = pending
 
     def __enter__(self) -> "Context":
         self.handle_new_request()
@@ -165,6 +622,8 @@ class Context:
 
 
 class State(abc.ABC):
+    __slots__ = ()
+
     failure_count: Optional[int] = None
     opened_at: Optional[float] = None
     name: str = ""
@@ -182,15 +641,24 @@ class State(abc.ABC):
         """Handle proper execution after the code block"""
 
 
-@dataclass
 class ClosedState(State):
     """In closed state, track for failure."""
 
+    __slots__ = ("failure_count",)
+
     failure_count: int
     name: StateName = CLOSED
 
-    def __init__(self) -> None:
-        self.failure_count = 0
+    def __init__(self, failure_count: int = 0) -> None:
+        self.failure_count = failure_count
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, ClosedState) and self.failure_count == other.failure_count
+        )
+
+    def __repr__(self) -> str:
+        return f"ClosedState(failure_count={self.failure_count})"
 
     def handle_new_request(self, context: Context) -> None:
         """When the circuit is closed, the new request has no incidence"""
@@ -198,33 +666,69 @@ class ClosedState(State):
     def handle_exception(self, context: Context, exc: BaseException) -> None:
         self.failure_count += 1
         context.mark_failure(self.failure_count)
-        if self.failure_count >= context.threshold:
-            opened = OpenedState(context.name)
-            context.set_state(opened)
+        window = context.window
+        if window is None:
+            tripped = self.failure_count >= context.threshold
+        else:
+            tripped = window.record_failure()
+        if tripped:
+            if window is not None:
+                window.reset()
+            context.open()
 
     def handle_end_request(self, context: Context) -> None:
         """Reset in case the request is ok"""
+        if context.window is not None:
+            context.window.record_success()
         if self.failure_count > 0:
             context.recover_failure()
         self.failure_count = 0
 
 
-@dataclass
 class OpenedState(State, Exception):
-    """In open state, reopen after a TTL."""
+    """
+    In open state, reopen after a TTL.
+
+    The opening time is a wall clock time, shared by the processes, it is
+    converted once to the monotonic clock of the context to compute the
+    closing time.
+    """
+
+    __slots__ = ("circuit_name", "closed_at", "failure_count", "opened_at")
 
     opened_at: float
     name: StateName = OPENED
 
-    def __init__(self, circuit_name: CircuitName) -> None:
+    def __init__(
+        self,
+        circuit_name: CircuitName,
+        opened_at: Optional[float] = None,
+        failure_count: Optional[int] = None,
+        closed_at: Optional[float] = None,
+    ) -> None:
         Exception.__init__(self, f"Circuit {circuit_name} is open")
-        self.opened_at = time.time()
+        self.opened_at = wall_clock() if opened_at is None else opened_at
         self.circuit_name = circuit_name
+        self.failure_count = failure_count
+        self.closed_at = closed_at
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, OpenedState) and self.opened_at == other.opened_at
+
+    def __repr__(self) -> str:
+        return f"OpenedState(opened_at={self.opened_at})"
 
     def handle_new_request(self, context: Context) -> None:
-        closed_at = self.opened_at + context.ttl
-        if time.time() > closed_at:
-            context.set_state(HalfOpenedState())
+        closed_at = self.closed_at
+        if closed_at is None:
+            closed_at = self.closed_at = (
+                self.opened_at
+                + context.open_duration()
+                - context.wall_clock()
+                + context.clock()
+            )
+        if context.clock() > closed_at:
+            context.set_state(HALF_OPENED_STATE)
             return context.handle_new_request()
         raise self
 
@@ -243,21 +747,40 @@ class OpenedState(State, Exception):
         """
 
 
-@dataclass
 class HalfOpenedState(State):
-    """In half open state, decide to reopen or to close."""
+    """
+    In half open state, decide to reopen or to close.
+
+    This state is stateless, the instance ``HALF_OPENED_STATE`` is shared
+    by every contexts.
+    """
 
+    __slots__ = ()
+
+    failure_count: int = 0
     name: StateName = HALF_OPENED
 
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, HalfOpenedState)
+
+    def __hash__(self) -> int:
+        return hash(HalfOpenedState)
+
+    def __repr__(self) -> str:
+        return "HalfOpenedState()"
+
     def handle_new_request(self, context: Context) -> None:
         """In half open state, we reset the failure counter to restart 0."""
 
     def handle_exception(self, context: Context, exc: BaseException) -> None:
         """If an exception happens, then the circuit is reopen directly."""
-        opened = OpenedState(context.name)
-        context.set_state(opened)
+        context.open()
 
     def handle_end_request(self, context: Context) -> None:
         """Otherwise, the circuit is closed, back to normal."""
         context.recover_failure()
+        context.open_count = 0
         context.set_state(ClosedState())
+
+
+HALF_OPENED_STATE = HalfOpenedState()
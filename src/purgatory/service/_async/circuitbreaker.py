@@ -1,18 +1,41 @@
+import threading
+from asyncio import current_task
+from collections.abc import Sequence
+from contextlib import AbstractContextManager
 from functools import wraps
 from types import TracebackType
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Optional, Union, cast
 
-from purgatory.domain.messages.commands import CreateCircuitBreaker
+from purgatory.domain.clock import monotonic, wall_clock
+from purgatory.domain.messages.base import Message
+from purgatory.domain.messages.commands import (
+    CreateCircuitBreaker,
+    CreateCircuitBreakers,
+)
 from purgatory.domain.messages.events import (
+    BulkheadFull,
     CircuitBreakerCreated,
     CircuitBreakerFailed,
     CircuitBreakerRecovered,
     ContextChanged,
 )
-from purgatory.domain.model import Context, ExcludeType
+from purgatory.domain.model import (
+    HALF_OPENED,
+    Backoff,
+    Bulkhead,
+    BulkheadFullError,
+    CallTimeoutError,
+    Context,
+    ExceptionClassifier,
+    ExcludeType,
+    FailureRatePolicy,
+    FailureRateWindow,
+    OpenedState,
+)
 from purgatory.service._async.message_handlers import (
     inc_circuit_breaker_failure,
     register_circuit_breaker,
+    register_circuit_breakers,
     reset_failure,
     save_circuit_breaker_state,
 )
@@ -21,7 +44,13 @@ from purgatory.service._async.unit_of_work import (
     AsyncAbstractUnitOfWork,
     AsyncInMemoryUnitOfWork,
 )
-from purgatory.typing import TTL, CircuitName, Hook, Threshold
+from purgatory.service._bulkhead import AsyncBulkhead
+from purgatory.service._deadline import AsyncDeadlines, create_async_deadlines
+from purgatory.service._redis import ConfigurationError
+from purgatory.typing import TTL, CircuitName, Clock, Hook, Threshold
+
+# starting time, probe and deadline of a call that has none
+NO_CALL: tuple[Optional[float], bool, Optional[Any]] = (None, False, None)
 
 
 class AsyncCircuitBreaker:
@@ -30,13 +59,51 @@ class AsyncCircuitBreaker:
         context: Context,
         uow: AsyncAbstractUnitOfWork,
         messagebus: AsyncMessageRegistry,
+        lock: Optional[AbstractContextManager[Any]] = None,
+        bulkhead: Optional[AsyncBulkhead] = None,
+        deadlines: Optional[AsyncDeadlines] = None,
     ) -> None:
         self.context = context
         self.uow = uow
         self.messagebus = messagebus
+        # in thread safe mode, the context is updated while holding the lock,
+        # every call dispatches the events it produced, after the update.
+        self.lock = lock
+        self.bulkhead = bulkhead
+        self.deadlines = deadlines
+        # starting time, probe and deadline of the calls in flight, a breaker
+        # may be reused concurrently
+        self.calls: dict[Any, tuple[Optional[float], bool, Optional[Any]]] = {}
 
     async def __aenter__(self) -> "AsyncCircuitBreaker":
-        self.context.__enter__()
+        lock = self.lock
+        if lock is None:
+            messages = self.context.new_call()
+        else:
+            with lock:
+                messages = self.context.new_call()
+        if messages:
+            await self.handle_messages(messages)
+        bulkhead = self.bulkhead
+        if bulkhead is not None:
+            await self.acquire_bulkhead(bulkhead)
+        try:
+            probe = False
+            context = self.context
+            if context.max_probes is not None and context.state == HALF_OPENED:
+                await self.acquire_probe()
+                probe = True
+            started_at = None
+            if context.slow_call_duration is not None:
+                started_at = context.clock()
+            call = None if self.deadlines is None else self.deadlines.start()
+            if probe or started_at is not None or call is not None:
+                self.calls[current_task()] = (started_at, probe, call)
+        except BaseException:
+            # the call is rejected, or failed to start, it is not exited
+            if bulkhead is not None:
+                bulkhead.release()
+            raise
         return self
 
     async def __aexit__(
@@ -45,12 +112,56 @@ class AsyncCircuitBreaker:
         exc: Optional[BaseException],
         tb: Optional[TracebackType],
     ) -> None:
-        self.context.__exit__(exc_type, exc, tb)
-        while self.context.messages:
-            await self.messagebus.handle(
-                self.context.messages.pop(0),
-                self.uow,
+        context = self.context
+        calls = self.calls
+        state = calls.pop(current_task(), NO_CALL) if calls else NO_CALL
+        started_at, probe, call = state
+        duration = None if started_at is None else context.clock() - started_at
+        error = exc
+        interrupted = False
+        deadlines = self.deadlines
+        if call is not None and deadlines is not None and deadlines.stop(call):
+            error = CallTimeoutError(context.name, deadlines.timeout)
+            interrupted = deadlines.interrupts
+        lock = self.lock
+        if lock is None:
+            messages = context.end_call(error, duration)
+        else:
+            with lock:
+                messages = context.end_call(error, duration)
+        if self.bulkhead is not None:
+            self.bulkhead.release()
+        if probe:
+            await self.release_probe()
+        if messages:
+            await self.handle_messages(messages)
+        if interrupted:
+            raise cast(CallTimeoutError, error) from exc
+
+    async def acquire_bulkhead(self, bulkhead: AsyncBulkhead) -> None:
+        """Acquire a slot of the bulkhead, or reject the call."""
+        if not await bulkhead.acquire():
+            name = self.context.name
+            await self.handle_messages([BulkheadFull(name, bulkhead.max_calls)])
+            raise BulkheadFullError(name, bulkhead.max_calls)
+
+    async def acquire_probe(self) -> None:
+        """Reserve a call of the half opened circuit, or reject it as opened."""
+        context = self.context
+        async with self.uow as uow:
+            acquired = await uow.contexts.acquire_probe(
+                context.name, cast(int, context.max_probes), context.ttl
             )
+        if not acquired:
+            raise OpenedState(context.name, context.wall_clock())
+
+    async def release_probe(self) -> None:
+        async with self.uow as uow:
+            await uow.contexts.release_probe(self.context.name)
+
+    async def handle_messages(self, messages: Sequence[Message]) -> None:
+        """Dispatch the messages produced by the context."""
+        await self.messagebus.handle_batch(messages, self.uow)
 
 
 class PublicEvent:
@@ -59,6 +170,7 @@ class PublicEvent:
         messagebus.add_listener(ContextChanged, self.cb_state_changed)
         messagebus.add_listener(CircuitBreakerFailed, self.cb_failed)
         messagebus.add_listener(CircuitBreakerRecovered, self.cb_recovered)
+        messagebus.add_listener(BulkheadFull, self.cb_bulkhead_full)
         self.hook = hook
 
     def remove_listeners(self, messagebus: AsyncMessageRegistry) -> None:
@@ -66,6 +178,7 @@ class PublicEvent:
         messagebus.remove_listener(ContextChanged, self.cb_state_changed)
         messagebus.remove_listener(CircuitBreakerFailed, self.cb_failed)
         messagebus.remove_listener(CircuitBreakerRecovered, self.cb_recovered)
+        messagebus.remove_listener(BulkheadFull, self.cb_bulkhead_full)
 
     async def cb_created(
         self, event: CircuitBreakerCreated, uow: AsyncAbstractUnitOfWork
@@ -87,6 +200,11 @@ class PublicEvent:
     ) -> None:
         self.hook(event.name, "recovered", event)
 
+    async def cb_bulkhead_full(
+        self, event: BulkheadFull, uow: AsyncAbstractUnitOfWork
+    ) -> None:
+        self.hook(event.name, "bulkhead_full", event)
+
 
 class AsyncCircuitBreakerFactory:
     def __init__(
@@ -95,20 +213,88 @@ class AsyncCircuitBreakerFactory:
         default_ttl: TTL = 30,
         exclude: Optional[ExcludeType] = None,
         uow: Optional[AsyncAbstractUnitOfWork] = None,
+        default_slow_call_duration: Optional[float] = None,
+        default_max_probes: Optional[int] = None,
+        default_backoff: Optional[Backoff] = None,
+        default_bulkhead: Optional[Bulkhead] = None,
+        default_timeout: Optional[float] = None,
+        clock: Clock = monotonic,
+        wall_clock: Clock = wall_clock,
+        thread_safe: bool = False,
+        lock_stripes: int = 64,
     ):
         self.default_threshold = default_threshold
         self.default_ttl = default_ttl
+        self.default_slow_call_duration = default_slow_call_duration
+        self.default_max_probes = default_max_probes
+        self.default_backoff = default_backoff
+        self.default_bulkhead = default_bulkhead
+        self.default_timeout = default_timeout
+        self.clock = clock
+        self.wall_clock = wall_clock
         self.global_exclude = exclude or []
+        self.global_classifier = ExceptionClassifier(self.global_exclude)
         self.uow = uow or AsyncInMemoryUnitOfWork()
         self.messagebus = AsyncMessageRegistry()
         self.messagebus.add_listener(CreateCircuitBreaker, register_circuit_breaker)
+        self.messagebus.add_listener(CreateCircuitBreakers, register_circuit_breakers)
         self.messagebus.add_listener(ContextChanged, save_circuit_breaker_state)
         self.messagebus.add_listener(CircuitBreakerFailed, inc_circuit_breaker_failure)
         self.messagebus.add_listener(CircuitBreakerRecovered, reset_failure)
         self.listeners: dict[Hook, PublicEvent] = {}
+        # the exclude list of a circuit is compiled once, while it is the same
+        self.classifiers: dict[
+            CircuitName, tuple[ExcludeType, ExceptionClassifier]
+        ] = {}
+        # failure rate windows are kept in memory, per circuit
+        self.windows: dict[CircuitName, FailureRateWindow] = {}
+        # the calls in flight are limited per process, per circuit
+        self.bulkheads: dict[CircuitName, AsyncBulkhead] = {}
+        # the calls that share a timeout share their deadlines
+        self.deadlines: dict[float, AsyncDeadlines] = {}
+        # the circuits share a fixed number of reentrant locks, by hash of
+        # their names, the hooks may get the breaker of their circuit.
+        self.locks: Optional[tuple[threading.RLock, ...]] = (
+            tuple(threading.RLock() for _ in range(lock_stripes))
+            if thread_safe
+            else None
+        )
 
-    async def initialize(self) -> None:
+    async def initialize(
+        self, preload: Union[bool, Sequence[CircuitName]] = False
+    ) -> None:
+        """
+        Initialize the unit of work, and preload the given circuits, or every
+        stored circuits if ``preload`` is True.
+        """
         await self.uow.initialize()
+        if preload is True:
+            await self.preload()
+        elif preload:
+            await self.preload(preload)
+
+    async def preload(
+        self, circuits: Optional[Sequence[CircuitName]] = None
+    ) -> dict[CircuitName, Context]:
+        """
+        Load the contexts of the circuits at once, registering the missing ones,
+        or load every stored circuits if ``circuits`` is None.
+        """
+        if circuits is not None:
+            return await self.get_contexts(circuits)
+        async with self.uow as uow:
+            contexts = await uow.contexts.get_all()
+        for context in contexts.values():
+            context.clock = self.clock
+            context.wall_clock = self.wall_clock
+        return contexts
+
+    def get_lock(self, circuit: CircuitName) -> Optional[AbstractContextManager[Any]]:
+        """Return the lock of the circuit in thread safe mode, otherwise None."""
+        locks = self.locks
+        if locks is None:
+            return None
+        return locks[hash(circuit) % len(locks)]
 
     def add_listener(self, listener: Hook) -> None:
         self.listeners[listener] = PublicEvent(self.messagebus, listener)
@@ -120,25 +306,244 @@ class AsyncCircuitBreakerFactory:
         except KeyError as exc:
             raise RuntimeError(f"{listener} is not listening {self}") from exc
 
-    async def get_breaker(
+    async def get_context(
         self,
         circuit: CircuitName,
         threshold: Optional[Threshold] = None,
         ttl: Optional[TTL] = None,
-        exclude: Optional[ExcludeType] = None,
-    ) -> AsyncCircuitBreaker:
+    ) -> Context:
+        """Load the context of the circuit, register it if it does not exists."""
         async with self.uow as uow:
             brk = await uow.contexts.get(circuit)
-        if brk is None:
-            async with self.uow as uow:
-                bkr_threshold = threshold or self.default_threshold
-                bkr_ttl = ttl or self.default_ttl
-                brk = await self.messagebus.handle(
-                    CreateCircuitBreaker(circuit, bkr_threshold, bkr_ttl),
-                    self.uow,
+            if brk is None:
+                lock = self.get_lock(circuit)
+                if lock is None:
+                    brk = await self.create_context(circuit, threshold, ttl)
+                else:
+                    with lock:
+                        # another thread may have registered the circuit
+                        brk = await uow.contexts.get(circuit)
+                        if brk is None:
+                            brk = await self.create_context(circuit, threshold, ttl)
+        brk.clock = self.clock
+        brk.wall_clock = self.wall_clock
+        return brk
+
+    async def create_context(
+        self,
+        circuit: CircuitName,
+        threshold: Optional[Threshold] = None,
+        ttl: Optional[TTL] = None,
+    ) -> Context:
+        """Register the circuit."""
+        threshold = threshold or self.default_threshold
+        ttl = ttl or self.default_ttl
+        # the event is dispatched by the caller, not collected from the messages
+        # of the repository that are shared by the threads of the factory
+        return await self.messagebus.handle_batch(
+            (
+                CreateCircuitBreaker(circuit, threshold, ttl),
+                CircuitBreakerCreated(circuit, threshold, ttl),
+            ),
+            self.uow,
+        )
+
+    async def get_contexts(
+        self,
+        circuits: Sequence[CircuitName],
+        threshold: Optional[Threshold] = None,
+        ttl: Optional[TTL] = None,
+    ) -> dict[CircuitName, Context]:
+        """Load the contexts of many circuits at once, register the missing ones."""
+        async with self.uow as uow:
+            contexts = await uow.contexts.get_many(circuits)
+            missing = tuple(
+                circuit
+                for circuit in dict.fromkeys(circuits)
+                if circuit not in contexts
+            )
+            if missing:
+                threshold = threshold or self.default_threshold
+                ttl = ttl or self.default_ttl
+                contexts.update(
+                    await self.messagebus.handle_batch(
+                        (
+                            CreateCircuitBreakers(missing, threshold, ttl),
+                            *(
+                                CircuitBreakerCreated(circuit, threshold, ttl)
+                                for circuit in missing
+                            ),
+                        ),
+                        uow,
+                    )
                 )
-        brk.exclude_list = (exclude or []) + self.global_exclude
-        return AsyncCircuitBreaker(brk, self.uow, self.messagebus)
+        for context in contexts.values():
+            context.clock = self.clock
+            context.wall_clock = self.wall_clock
+        return contexts
+
+    def get_classifier(
+        self, circuit: CircuitName, exclude: Optional[ExcludeType] = None
+    ) -> ExceptionClassifier:
+        """Return the classifier of the exclude list of the circuit."""
+        if not exclude:
+            return self.global_classifier
+        cached = self.classifiers.get(circuit)
+        if cached is not None and cached[0] == exclude:
+            return cached[1]
+        classifier = ExceptionClassifier(exclude + self.global_exclude)
+        self.classifiers[circuit] = (list(exclude), classifier)
+        return classifier
+
+    def get_window(
+        self, circuit: CircuitName, policy: Optional[FailureRatePolicy] = None
+    ) -> Optional[FailureRateWindow]:
+        """Return the failure rate window of the circuit, if it has a policy."""
+        if policy is None:
+            return None
+        if not self.uow.contexts.supports_policies:
+            raise ConfigurationError(
+                "The failure rate policies cannot be used with a repository "
+                "that decides the state transitions, such as the atomic mode."
+            )
+        window = self.windows.get(circuit)
+        if window is None:
+            # the window of another thread is kept
+            window = self.windows.setdefault(circuit, policy.create_window(self.clock))
+        return window
+
+    def get_bulkhead(
+        self, circuit: CircuitName, bulkhead: Optional[Bulkhead] = None
+    ) -> Optional[AsyncBulkhead]:
+        """
+        Return the limiter of the calls in flight of the circuit, if it has a
+        bulkhead. The limiter is created by the first call of the circuit.
+        """
+        if bulkhead is None:
+            bulkhead = self.default_bulkhead
+            if bulkhead is None:
+                return None
+        limiter = self.bulkheads.get(circuit)
+        if limiter is None:
+            limiter = self.bulkheads.setdefault(circuit, AsyncBulkhead(bulkhead))
+        return limiter
+
+    def get_deadlines(
+        self, timeout: Optional[float] = None
+    ) -> Optional[AsyncDeadlines]:
+        """Return the deadlines of the calls of the timeout, if there is one."""
+        if timeout is None:
+            timeout = self.default_timeout
+            if timeout is None:
+                return None
+        deadlines = self.deadlines.get(timeout)
+        if deadlines is None:
+            deadlines = self.deadlines.setdefault(
+                timeout, create_async_deadlines(timeout, self.clock)
+            )
+        return deadlines
+
+    async def get_breaker(
+        self,
+        circuit: CircuitName,
+        threshold: Optional[Threshold] = None,
+        ttl: Optional[TTL] = None,
+        exclude: Optional[ExcludeType] = None,
+        policy: Optional[FailureRatePolicy] = None,
+        slow_call_duration: Optional[float] = None,
+        max_probes: Optional[int] = None,
+        backoff: Optional[Backoff] = None,
+        bulkhead: Optional[Bulkhead] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncCircuitBreaker:
+        brk = await self.get_context(circuit, threshold, ttl)
+        self.configure(brk, exclude, policy, slow_call_duration, max_probes, backoff)
+        return AsyncCircuitBreaker(
+            brk,
+            self.uow,
+            self.messagebus,
+            self.get_lock(circuit),
+            self.get_bulkhead(circuit, bulkhead),
+            self.get_deadlines(timeout),
+        )
+
+    async def get_breakers(
+        self,
+        circuits: Sequence[CircuitName],
+        threshold: Optional[Threshold] = None,
+        ttl: Optional[TTL] = None,
+        exclude: Optional[ExcludeType] = None,
+        policy: Optional[FailureRatePolicy] = None,
+        slow_call_duration: Optional[float] = None,
+        max_probes: Optional[int] = None,
+        backoff: Optional[Backoff] = None,
+        bulkhead: Optional[Bulkhead] = None,
+        timeout: Optional[float] = None,
+    ) -> dict[CircuitName, AsyncCircuitBreaker]:
+        """Get the breakers of many circuits, their contexts are loaded at once."""
+        contexts = await self.get_contexts(circuits, threshold, ttl)
+        breakers = {}
+        for circuit, brk in contexts.items():
+            self.configure(
+                brk, exclude, policy, slow_call_duration, max_probes, backoff
+            )
+            breakers[circuit] = AsyncCircuitBreaker(
+                brk,
+                self.uow,
+                self.messagebus,
+                self.get_lock(circuit),
+                self.get_bulkhead(circuit, bulkhead),
+                self.get_deadlines(timeout),
+            )
+        return breakers
+
+    def configure(
+        self,
+        brk: Context,
+        exclude: Optional[ExcludeType] = None,
+        policy: Optional[FailureRatePolicy] = None,
+        slow_call_duration: Optional[float] = None,
+        max_probes: Optional[int] = None,
+        backoff: Optional[Backoff] = None,
+    ) -> None:
+        """Set the options of the circuit on its context, or the default ones."""
+        brk.classifier = self.get_classifier(brk.name, exclude)
+        brk.window = self.get_window(brk.name, policy)
+        brk.slow_call_duration = (
+            self.default_slow_call_duration
+            if slow_call_duration is None
+            else slow_call_duration
+        )
+        brk.max_probes = self.default_max_probes if max_probes is None else max_probes
+        brk.backoff = self.default_backoff if backoff is None else backoff
+
+    def get_handle(
+        self,
+        circuit: CircuitName,
+        threshold: Optional[Threshold] = None,
+        ttl: Optional[TTL] = None,
+        exclude: Optional[ExcludeType] = None,
+        policy: Optional[FailureRatePolicy] = None,
+        slow_call_duration: Optional[float] = None,
+        max_probes: Optional[int] = None,
+        backoff: Optional[Backoff] = None,
+        bulkhead: Optional[Bulkhead] = None,
+        timeout: Optional[float] = None,
+    ) -> "AsyncCircuitBreakerHandle":
+        """Bind a circuit with its configuration, in order to reuse it."""
+        return AsyncCircuitBreakerHandle(
+            self,
+            circuit,
+            threshold,
+            ttl,
+            exclude,
+            policy,
+            slow_call_duration,
+            max_probes,
+            backoff,
+            bulkhead,
+            timeout,
+        )
 
     def __call__(
         self,
@@ -146,14 +551,193 @@ class AsyncCircuitBreakerFactory:
         threshold: Optional[Threshold] = None,
         ttl: Optional[TTL] = None,
         exclude: Optional[ExcludeType] = None,
+        policy: Optional[FailureRatePolicy] = None,
+        slow_call_duration: Optional[float] = None,
+        max_probes: Optional[int] = None,
+        backoff: Optional[Backoff] = None,
+        bulkhead: Optional[Bulkhead] = None,
+        timeout: Optional[float] = None,
     ) -> Any:
+        handle = self.get_handle(
+            circuit,
+            threshold,
+            ttl,
+            exclude,
+            policy,
+            slow_call_duration,
+            max_probes,
+            backoff,
+            bulkhead,
+            timeout,
+        )
+
         def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
             @wraps(func)
             async def inner_coro(*args: Any, **kwargs: Any) -> Any:
-                brk = await self.get_breaker(circuit, threshold, ttl, exclude)
-                async with brk:
-                    return await func(*args, **kwargs)
+                # inlined version of the circuit breaker context manager, the
+                # messagebus is never reached by successful calls on closed circuit.
+                context = handle.context
+                if context is None:
+                    context = await handle.get_context()
+                else:
+                    context.classifier = handle.classifier
+                    context.window = handle.window
+                    context.slow_call_duration = handle.slow_call_duration
+                    context.max_probes = handle.max_probes
+                    context.backoff = handle.backoff
+                lock = handle.lock
+                if lock is None:
+                    messages = context.new_call()
+                else:
+                    with lock:
+                        messages = context.new_call()
+                if messages:
+                    await handle.handle_messages(messages)
+                bulkhead = handle.bulkhead
+                if bulkhead is not None:
+                    await handle.acquire_bulkhead(bulkhead)
+                try:
+                    probe = None
+                    if context.max_probes is not None and context.state == HALF_OPENED:
+                        probe = handle.get_probe(context)
+                        await probe.acquire_probe()
+                    started_at = (
+                        None if context.slow_call_duration is None else context.clock()
+                    )
+                    deadlines = handle.deadlines
+                    call = 0 if deadlines is None else deadlines.start()
+                    interrupted = False
+                    try:
+                        ret = await func(*args, **kwargs)
+                    except BaseException as exc:
+                        error: Optional[BaseException] = exc
+                        if deadlines is not None and deadlines.stop(call):
+                            error = CallTimeoutError(context.name, deadlines.timeout)
+                            interrupted = deadlines.interrupts
+                        if lock is None:
+                            messages = context.end_call(error)
+                        else:
+                            with lock:
+                                messages = context.end_call(error)
+                        if probe is not None:
+                            await probe.release_probe()
+                        if messages:
+                            await handle.handle_messages(messages)
+                        if interrupted:
+                            raise cast(CallTimeoutError, error) from exc
+                        raise
+                    error = None
+                    if deadlines is not None and deadlines.stop(call):
+                        # the call returned after the timeout, it is a failure
+                        error = CallTimeoutError(context.name, deadlines.timeout)
+                        interrupted = deadlines.interrupts
+                    duration = (
+                        None if started_at is None else context.clock() - started_at
+                    )
+                    if lock is None:
+                        messages = context.end_call(error, duration)
+                    else:
+                        with lock:
+                            messages = context.end_call(error, duration)
+                    if probe is not None:
+                        await probe.release_probe()
+                    if messages:
+                        await handle.handle_messages(messages)
+                    if interrupted:
+                        raise cast(CallTimeoutError, error)
+                    return ret
+                finally:
+                    if bulkhead is not None:
+                        bulkhead.release()
 
             return inner_coro
 
         return decorator
+
+
+class AsyncCircuitBreakerHandle:
+    """
+    A circuit bound to its configuration.
+
+    The threshold, the ttl, the exclude list, the failure rate window, the
+    slow call duration, the maximum number of probes, the backoff, the
+    bulkhead and the timeout are resolved once, and the context is kept if
+    the repository returns live contexts, otherwise it is loaded from the
+    repository on every call.
+    """
+
+    def __init__(
+        self,
+        factory: AsyncCircuitBreakerFactory,
+        circuit: CircuitName,
+        threshold: Optional[Threshold] = None,
+        ttl: Optional[TTL] = None,
+        exclude: Optional[ExcludeType] = None,
+        policy: Optional[FailureRatePolicy] = None,
+        slow_call_duration: Optional[float] = None,
+        max_probes: Optional[int] = None,
+        backoff: Optional[Backoff] = None,
+        bulkhead: Optional[Bulkhead] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        self.factory = factory
+        self.circuit = circuit
+        self.threshold = threshold or factory.default_threshold
+        self.ttl = ttl or factory.default_ttl
+        self.classifier = factory.get_classifier(circuit, exclude)
+        self.window = factory.get_window(circuit, policy)
+        self.slow_call_duration = (
+            factory.default_slow_call_duration
+            if slow_call_duration is None
+            else slow_call_duration
+        )
+        self.max_probes = (
+            factory.default_max_probes if max_probes is None else max_probes
+        )
+        self.backoff = factory.default_backoff if backoff is None else backoff
+        self.lock = factory.get_lock(circuit)
+        self.bulkhead = factory.get_bulkhead(circuit, bulkhead)
+        self.timeout = factory.default_timeout if timeout is None else timeout
+        self.deadlines = factory.get_deadlines(self.timeout)
+        self.context: Optional[Context] = None
+
+    async def get_context(self) -> Context:
+        context = self.context
+        if context is None:
+            context = await self.factory.get_context(
+                self.circuit, self.threshold, self.ttl
+            )
+            if self.factory.uow.contexts.live_contexts:
+                self.context = context
+        context.classifier = self.classifier
+        context.window = self.window
+        context.slow_call_duration = self.slow_call_duration
+        context.max_probes = self.max_probes
+        context.backoff = self.backoff
+        return context
+
+    async def get_breaker(self) -> AsyncCircuitBreaker:
+        return AsyncCircuitBreaker(
+            await self.get_context(),
+            self.factory.uow,
+            self.factory.messagebus,
+            self.lock,
+            self.bulkhead,
+            self.deadlines,
+        )
+
+    def get_probe(self, context: Context) -> AsyncCircuitBreaker:
+        """Breaker of a call of the half opened circuit, to count the probes."""
+        return AsyncCircuitBreaker(
+            context, self.factory.uow, self.factory.messagebus, self.lock
+        )
+
+    async def acquire_bulkhead(self, bulkhead: AsyncBulkhead) -> None:
+        """Acquire a slot of the bulkhead, or reject the call."""
+        if not await bulkhead.acquire():
+            await self.handle_messages([BulkheadFull(self.circuit, bulkhead.max_calls)])
+            raise BulkheadFullError(self.circuit, bulkhead.max_calls)
+
+    async def handle_messages(self, messages: Sequence[Message]) -> None:
+        """Dispatch the messages produced by the context."""
+        await self.factory.messagebus.handle_batch(messages, self.factory.uow)
@@ -1,6 +1,8 @@
-from purgatory.domain.messages.commands import CreateCircuitBreaker
+from purgatory.domain.messages.commands import (
+    CreateCircuitBreaker,
+    CreateCircuitBreakers,
+)
 from purgatory.domain.messages.events import (
-    CircuitBreakerCreated,
     CircuitBreakerFailed,
     CircuitBreakerRecovered,
     ContextChanged,
@@ -16,15 +18,27 @@ async def register_circuit_breaker(
     Register circuit breaker in the repository
 
     when receiving the CreateCircuitBreaker command.
+    The CircuitBreakerCreated event is dispatched by the caller.
     """
     ret = Context(cmd.name, cmd.threshold, cmd.ttl)
     await uow.contexts.register(ret)
-    uow.contexts.messages.append(
-        CircuitBreakerCreated(cmd.name, cmd.threshold, cmd.ttl)
-    )
     return ret
 
 
+async def register_circuit_breakers(
+    cmd: CreateCircuitBreakers, uow: AsyncAbstractUnitOfWork
+) -> dict[str, Context]:
+    """
+    Register many circuit breakers in the repository at once
+
+    when receiving the CreateCircuitBreakers command.
+    The CircuitBreakerCreated events are dispatched by the caller.
+    """
+    contexts = {name: Context(name, cmd.threshold, cmd.ttl) for name in cmd.names}
+    await uow.contexts.register_many(list(contexts.values()))
+    return contexts
+
+
 async def save_circuit_breaker_state(
     evt: ContextChanged, uow: AsyncAbstractUnitOfWork
 ) -> None:
@@ -1,19 +1,60 @@
 import abc
 import json
-from typing import Any, Optional
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Any, Optional, cast
 
+from purgatory.domain.clock import monotonic
 from purgatory.domain.messages.base import Message
-from purgatory.domain.model import Context
-from purgatory.service._redis import AsyncRedis
-from purgatory.typing import CircuitName
-
-
-class ConfigurationError(RuntimeError):
-    pass
+from purgatory.domain.model import CLOSED, HALF_OPENED, OPENED, Context
+from purgatory.service._redis import (
+    ACQUIRE_PROBE_SCRIPT,
+    OPEN_SCRIPT,
+    RECORD_FAILURE_SCRIPT,
+    RECORD_SUCCESS_SCRIPT,
+    RELEASE_PROBE_SCRIPT,
+    TRY_HALF_OPEN_SCRIPT,
+    AsyncRedisClient,
+    ConfigurationError,
+    HashMapping,
+    PendingFailures,
+    create_async_client,
+    decode,
+    dump_context,
+    dump_opened_at,
+    load_context,
+)
+from purgatory.service._shm import Record, SharedMemoryTable
+from purgatory.service._shm import load_context as load_record
+from purgatory.service._sqlite import (
+    ACQUIRE_PROBE,
+    INC_FAILURES,
+    REGISTER,
+    RELEASE_PROBE,
+    SELECT,
+    SELECT_ALL,
+    SELECT_MANY_SIZE,
+    SET_FAILURES,
+    UPDATE_STATE,
+    connect,
+    select_many,
+)
+from purgatory.service._sqlite import load_context as load_row
+from purgatory.service._timer import AsyncFlushTimer
+from purgatory.typing import CircuitName, Clock, StateName
 
 
 class AsyncAbstractRepository(abc.ABC):
     messages: list[Message]
+    # True if the get method always return the same context object,
+    # updated by the model itself, so it can be kept by the caller.
+    live_contexts: bool = False
+    # False if the state transitions are decided by the repository, on the
+    # threshold, so the failure rate policies can not be applied.
+    supports_policies: bool = True
 
     async def initialize(self) -> None:  # noqa B027
         """Override to initialize the repository asynchronously"""
@@ -22,10 +63,35 @@ class AsyncAbstractRepository(abc.ABC):
     async def get(self, name: CircuitName) -> Optional[Context]:
         """Load breakers from the repository."""
 
+    async def get_many(
+        self, names: Sequence[CircuitName]
+    ) -> dict[CircuitName, Context]:
+        """Load many breakers from the repository, the unknown ones are omitted."""
+        contexts = {}
+        for name in names:
+            context = await self.get(name)
+            if context is not None:
+                contexts[name] = context
+        return contexts
+
+    async def get_all(self) -> dict[CircuitName, Context]:
+        """
+        Load every breakers stored in the repository.
+
+        Override it to support ``preload=True``, the repositories that cannot
+        list their breakers return none, they are loaded on their first call.
+        """
+        return {}
+
     @abc.abstractmethod
     async def register(self, context: Context) -> None:
         """Add a circuit breaker into the repository."""
 
+    async def register_many(self, contexts: Sequence[Context]) -> None:
+        """Add many circuit breakers into the repository."""
+        for context in contexts:
+            await self.register(context)
+
     @abc.abstractmethod
     async def update_state(
         self,
@@ -43,19 +109,121 @@ class AsyncAbstractRepository(abc.ABC):
     async def reset_failure(self, name: str) -> None:
         """Reset the number of failure in the repository."""
 
+    @abc.abstractmethod
+    async def acquire_probe(self, name: str, max_probes: int, lease: float) -> bool:
+        """
+        Reserve a call of the half opened circuit, return False if all the
+        ``max_probes`` calls are in flight.
+        """
+
+    @abc.abstractmethod
+    async def release_probe(self, name: str) -> None:
+        """Release a call reserved by acquire_probe."""
+
 
 class AsyncInMemoryRepository(AsyncAbstractRepository):
-    def __init__(self) -> None:
+    """
+    Store the circuits in the process memory.
+
+    The repository is unbounded unless ``max_size`` is set, to evict the least
+    recently used circuits, or ``idle_ttl`` is set, to evict the circuits unused
+    for that number of seconds. Opened and half opened circuits are never
+    evicted. The contexts of a bounded repository are not kept by the handles,
+    because an evicted context would not be shared anymore.
+    """
+
+    live_contexts = True
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        clock: Clock = monotonic,
+    ) -> None:
+        if max_size is not None and max_size < 1:
+            raise ValueError("max_size must be a positive integer")
         self.breakers: dict[CircuitName, Context] = {}
         self.messages: list[Message] = []
+        self.probes: dict[CircuitName, int] = {}
+        # time of the last probe of the circuits, to expire their lease
+        self.probed_at: dict[CircuitName, float] = {}
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self.bounded = max_size is not None or idle_ttl is not None
+        if self.bounded:
+            self.live_contexts = False
+        # last access time of the circuits, least recently used first
+        self.accessed: OrderedDict[CircuitName, float] = OrderedDict()
+        self.evictions = 0
+        # guard the probes and the eviction of the thread safe factories
+        self.lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Number of circuits in the repository."""
+        return len(self.breakers)
+
+    def touch(self, name: CircuitName) -> None:
+        """Mark the circuit as the most recently used."""
+        with self.lock:
+            self.accessed[name] = self.clock()
+            self.accessed.move_to_end(name)
+
+    def evict(self, room: int = 0) -> None:
+        """
+        Evict the idle circuits, then the least recently used ones to make room
+        for ``room`` new circuits. Only the closed circuits are evicted.
+        """
+        now = self.clock()
+        with self.lock:
+            excess = (
+                0
+                if self.max_size is None
+                else len(self.breakers) + room - self.max_size
+            )
+            evicted: list[CircuitName] = []
+            for name, accessed_at in self.accessed.items():
+                idle = self.idle_ttl is not None and now - accessed_at >= self.idle_ttl
+                if not idle and len(evicted) >= excess:
+                    break
+                if self.breakers[name].state == CLOSED:
+                    evicted.append(name)
+            for name in evicted:
+                del self.breakers[name]
+                del self.accessed[name]
+            self.evictions += len(evicted)
 
     async def get(self, name: CircuitName) -> Optional[Context]:
         """Add a circuit breaker into the repository."""
-        return self.breakers.get(name)
+        context = self.breakers.get(name)
+        if context is not None and self.bounded:
+            self.touch(name)
+        return context
+
+    async def get_many(
+        self, names: Sequence[CircuitName]
+    ) -> dict[CircuitName, Context]:
+        """Load many breakers from the repository, the unknown ones are omitted."""
+        breakers = self.breakers
+        contexts = {name: breakers[name] for name in names if name in breakers}
+        if self.bounded:
+            for name in contexts:
+                self.touch(name)
+        return contexts
+
+    async def get_all(self) -> dict[CircuitName, Context]:
+        """Load every breakers stored in the repository."""
+        return dict(self.breakers)
 
     async def register(self, context: Context) -> None:
         """Add a circuit breaker into the repository."""
-        self.breakers[context.name] = context
+        if self.bounded:
+            self.evict(0 if context.name in self.breakers else 1)
+            self.breakers[context.name] = context
+            self.touch(context.name)
+        else:
+            self.breakers[context.name] = context
 
     async def update_state(
         self,
@@ -71,48 +239,197 @@ class AsyncInMemoryRepository(AsyncAbstractRepository):
     async def reset_failure(self, name: str) -> None:
         """Reset the number of failure in the repository."""
 
+    async def acquire_probe(self, name: str, max_probes: int, lease: float) -> bool:
+        """
+        Count the calls in flight, in the process.
+
+        Calls that are not released after the lease are not counted anymore.
+        """
+        now = self.clock()
+        with self.lock:
+            probes = self.probes.get(name, 0)
+            if probes >= max_probes:
+                if now < self.probed_at[name] + lease:
+                    return False
+                probes = 0
+            self.probes[name] = probes + 1
+            self.probed_at[name] = now
+        return True
+
+    async def release_probe(self, name: str) -> None:
+        """Release a call reserved by acquire_probe."""
+        with self.lock:
+            probes = self.probes.get(name, 0) - 1
+            if probes > 0:
+                self.probes[name] = probes
+            else:
+                self.probes.pop(name, None)
+                self.probed_at.pop(name, None)
+
 
 class AsyncRedisRepository(AsyncAbstractRepository):
-    def __init__(self, url: str) -> None:
-        try:
-            from redis import asyncio as aioredis
-        except ImportError as exc:
-            raise ConfigurationError(  # coverage: ignore
-                "redis extra dependencies not installed."
-            ) from exc
-        self.redis: AsyncRedis = aioredis.from_url(url)  # type: ignore
+    """
+    Store the circuits in redis, a hash per circuit.
+
+    Contexts stored by purgatory 3.0 and lower, using the legacy layout, a json
+    document and a failure counter, are loaded and migrated to the hash layout
+    on their first read. Set ``legacy_prefix`` to None to disable it.
+
+    In ``atomic`` mode, the state transitions are decided by redis, using
+    a lua script per transition, instead of storing the state of the local
+    context, in order to share the failures of every instances without races.
+    The circuits can not have a failure rate policy in this mode.
+
+    In ``write_behind`` mode, the failure counters are updated in memory, and
+    written in a pipeline by a timer, ``flush_interval`` seconds after the
+    first pending update, after ``flush_size`` updates, or with the next state
+    transition, that is written immediately. The counters are also flushed by
+    :meth:`flush`, on commit of the unit of work.
+
+    The repository uses the given ``client``, or a client of the given
+    ``connection_pool``, otherwise a client of a connection pool shared by every
+    repository of the process using the same ``url`` and ``max_connections``.
+    The client is created on first use, and connects lazily.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        legacy_prefix: Optional[str] = "cbr::",
+        atomic: bool = False,
+        write_behind: bool = False,
+        flush_interval: float = 0.1,
+        flush_size: int = 100,
+        client: Optional[AsyncRedisClient] = None,
+        connection_pool: Any = None,
+        max_connections: Optional[int] = None,
+    ) -> None:
+        if atomic and write_behind:
+            raise ConfigurationError(
+                "The atomic mode and the write behind mode are exclusive."
+            )
+        if url is None and client is None and connection_pool is None:
+            raise ConfigurationError(
+                "A redis url, client or connection pool is required."
+            )
+        self.url = url
+        self.connection_pool = connection_pool
+        self.max_connections = max_connections
+        self._redis = client
         self.messages = []
-        self.prefix = "cbr::"
+        self.prefix = "cbrh::"
+        self.legacy_prefix = legacy_prefix
+        self.atomic = atomic
+        self.supports_policies = not atomic
+        self.scripts: dict[str, Any] = {}
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.pending: dict[CircuitName, PendingFailures] = {}
+        self.pending_updates = 0
+        self.timer = AsyncFlushTimer(flush_interval, self.flush)
+        # the timer may flush the pending updates concurrently
+        self.lock = threading.Lock()
+
+    @property
+    def redis(self) -> AsyncRedisClient:
+        client = self._redis
+        if client is None:
+            client = create_async_client(
+                self.url, self.connection_pool, self.max_connections
+            )
+            # the shared client of the url is looked up on every use,
+            # the asyncio clients are shared per event loop
+            if self.connection_pool is not None:
+                self._redis = client
+        return client
+
+    @redis.setter
+    def redis(self, client: AsyncRedisClient) -> None:
+        self._redis = client
 
     async def initialize(self) -> None:
-        await self.redis.initialize()  # type: ignore
+        """Do nothing, the connections are opened on first use."""
 
     async def get(self, name: CircuitName) -> Optional[Context]:
-        """Add a circuit breaker into the repository."""
-        data: Any = await self.redis.get(f"{self.prefix}{name}")
+        """Load breakers from the repository."""
+        data: Any = await self.redis.hgetall(f"{self.prefix}{name}")
         if not data:
-            return None
-        breaker = json.loads(data or "{}")
-        failure_count: int = (
-            await self.redis.get(f"{self.prefix}{name}::failure_count") or 0
-        )
-        if failure_count:
-            breaker["failure_count"] = int(failure_count)
-        cbreaker = Context(**breaker)
-        return cbreaker
+            return await self.migrate_legacy(name)
+        return load_context(data, self.pending.get(name))
+
+    async def get_many(
+        self, names: Sequence[CircuitName]
+    ) -> dict[CircuitName, Context]:
+        """Load many breakers in a single round trip, the unknown ones are omitted."""
+        if not names:
+            return {}
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for name in names:
+                pipe.hgetall(f"{self.prefix}{name}")
+            results = await pipe.execute()
+        contexts = {}
+        missing = []
+        for name, data in zip(names, results):
+            if data:
+                contexts[name] = load_context(data, self.pending.get(name))
+            else:
+                missing.append(name)
+        if missing:
+            contexts.update(await self.migrate_legacy_many(missing))
+        return contexts
+
+    async def get_all(self) -> dict[CircuitName, Context]:
+        """
+        Load every breakers stored using the hash layout, the keys are listed
+        using SCAN, then loaded in a single round trip.
+        """
+        names = []
+        async for key in self.redis.scan_iter(match=f"{self.prefix}*", count=1000):
+            names.append(decode(key)[len(self.prefix) :])
+        return await self.get_many(names)
+
+    async def migrate_legacy(self, name: CircuitName) -> Optional[Context]:
+        """Load a circuit stored using the legacy layout and store it as a hash."""
+        return (await self.migrate_legacy_many([name])).get(name)
+
+    async def migrate_legacy_many(
+        self, names: Sequence[CircuitName]
+    ) -> dict[CircuitName, Context]:
+        """
+        Load many circuits stored using the legacy layout in a single round
+        trip, and store them as hashes, the unknown ones are omitted.
+        """
+        if self.legacy_prefix is None or not names:
+            return {}
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for name in names:
+                key = f"{self.legacy_prefix}{name}"
+                pipe.get(key)
+                pipe.get(f"{key}::failure_count")
+            results = await pipe.execute()
+        contexts = {}
+        for name, data, failure_count in zip(names, results[::2], results[1::2]):
+            if data:
+                breaker = json.loads(data)
+                breaker["failure_count"] = int(failure_count or 0)
+                contexts[name] = Context(**breaker)
+        if contexts:
+            await self.register_many(list(contexts.values()))
+        return contexts
 
     async def register(self, context: Context) -> None:
         """Add a circuit breaker into the repository."""
-        data = json.dumps(
-            {
-                "name": context.name,
-                "threshold": context.threshold,
-                "ttl": context.ttl,
-                "state": context.state,
-                "opened_at": context.opened_at,
-            }
+        await self.redis.hset(
+            f"{self.prefix}{context.name}", mapping=dump_context(context)
         )
-        await self.redis.set(f"{self.prefix}{context.name}", data)
+
+    async def register_many(self, contexts: Sequence[Context]) -> None:
+        """Add many circuit breakers into the repository in a single round trip."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for context in contexts:
+                pipe.hset(f"{self.prefix}{context.name}", mapping=dump_context(context))
+            await pipe.execute()
 
     async def update_state(
         self,
@@ -121,16 +438,523 @@ class AsyncRedisRepository(AsyncAbstractRepository):
         opened_at: Optional[float],
     ) -> None:
         """Store the new state in the repository."""
-        data: str = await self.redis.get(f"{self.prefix}{name}") or "{}"
-        breaker = json.loads(data)
-        breaker["state"] = state
-        breaker["opened_at"] = opened_at
-        await self.redis.set(f"{self.prefix}{name}", json.dumps(breaker))
+        if self.atomic:
+            if state == OPENED:
+                await self.open(name, opened_at or time.time())
+            elif state == HALF_OPENED:
+                await self.try_half_open(name)
+            else:
+                await self.record_success(name)
+            return
+        key = f"{self.prefix}{name}"
+        mapping: HashMapping = {"state": state, "opened_at": dump_opened_at(opened_at)}
+        if state == CLOSED:
+            mapping["open_count"] = 0
+        if state != OPENED and not self.pending:
+            await self.redis.hset(key, mapping=mapping)
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            # the pending updates are written with the state
+            self.queue_pending(pipe)
+            pipe.hset(key, mapping=mapping)
+            if state == OPENED:
+                # the consecutive openings are counted for the backoff
+                pipe.hincrby(key, "open_count", 1)
+            await pipe.execute()
 
     async def inc_failures(self, name: str, failure_count: int) -> None:
         """Store the new state in the repository."""
-        await self.redis.incr(f"{self.prefix}{name}::failure_count")
+        if self.atomic:
+            await self.record_failure(name)
+            return
+        if self.write_behind:
+            with self.lock:
+                reset, increment = self.pending.get(name, (False, 0))
+                self.pending[name] = (reset, increment + 1)
+            await self.updated()
+            return
+        await self.redis.hincrby(f"{self.prefix}{name}", "failure_count", 1)
 
     async def reset_failure(self, name: str) -> None:
         """Reset the number of failure in the repository."""
-        await self.redis.set(f"{self.prefix}{name}::failure_count", "0")
+        if self.atomic:
+            await self.record_success(name)
+            return
+        if self.write_behind:
+            with self.lock:
+                self.pending[name] = (True, 0)
+            await self.updated()
+            return
+        await self.redis.hset(f"{self.prefix}{name}", "failure_count", 0)
+
+    async def updated(self) -> None:
+        """Flush the pending updates if there are too many, or arm the timer."""
+        with self.lock:
+            self.pending_updates += 1
+            full = self.pending_updates >= self.flush_size
+        if full:
+            await self.flush()
+        else:
+            self.timer.start()
+
+    def queue_pending(self, pipe: Any) -> None:
+        """Queue the pending updates in the pipeline, and forget them."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.pending_updates = 0
+        self.timer.cancel()
+        for name, (reset, increment) in pending.items():
+            key = f"{self.prefix}{name}"
+            if reset:
+                pipe.hset(key, "failure_count", increment)
+            else:
+                pipe.hincrby(key, "failure_count", increment)
+
+    async def flush(self) -> None:
+        """Write the pending updates of the failure counters."""
+        if not self.pending:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            self.queue_pending(pipe)
+            await pipe.execute()
+
+    async def eval_script(self, script: str, name: str, *args: Any) -> Any:
+        """Run the script on the circuit hash."""
+        client = self.redis
+        if script not in self.scripts:
+            self.scripts[script] = client.register_script(script)
+        return await self.scripts[script](
+            keys=[f"{self.prefix}{name}"], args=args, client=client
+        )
+
+    async def run_script(self, script: str, name: str, *args: Any) -> Optional[str]:
+        """Run the script on the circuit hash, and return the new state."""
+        state = await self.eval_script(script, name, *args)
+        return decode(state) if state else None
+
+    async def record_failure(self, name: str) -> Optional[str]:
+        """Increment the failure counter, and open the circuit on threshold."""
+        return await self.run_script(RECORD_FAILURE_SCRIPT, name, time.time())
+
+    async def record_success(self, name: str) -> Optional[str]:
+        """Close the circuit and reset the failure counter, if not opened."""
+        return await self.run_script(RECORD_SUCCESS_SCRIPT, name)
+
+    async def try_half_open(self, name: str) -> Optional[str]:
+        """Half open the circuit if it is opened for more than its ttl."""
+        return await self.run_script(TRY_HALF_OPEN_SCRIPT, name, time.time())
+
+    async def open(self, name: str, opened_at: float) -> Optional[str]:
+        """Open the circuit if half opened, or if the threshold is reached."""
+        return await self.run_script(OPEN_SCRIPT, name, opened_at)
+
+    async def acquire_probe(self, name: str, max_probes: int, lease: float) -> bool:
+        """
+        Count the calls in flight of every processes, using a lua script.
+
+        Calls that are not released after the lease are not counted anymore.
+        """
+        acquired = await self.eval_script(
+            ACQUIRE_PROBE_SCRIPT, name, max_probes, time.time(), lease
+        )
+        return bool(acquired)
+
+    async def release_probe(self, name: str) -> None:
+        """Release a call reserved by acquire_probe."""
+        await self.eval_script(RELEASE_PROBE_SCRIPT, name)
+
+
+class AsyncCachedRepository(AsyncAbstractRepository):
+    """
+    Read-through cache of contexts in front of another repository.
+
+    A context is served from the process memory for at most ``max_age`` seconds
+    before being loaded again from the wrapped repository, measured by the
+    given ``clock``. Local state changes drop the cached context in order to
+    reload the shared state.
+    """
+
+    def __init__(
+        self,
+        repository: AsyncAbstractRepository,
+        max_age: float = 1.0,
+        clock: Clock = monotonic,
+    ) -> None:
+        self.repository = repository
+        self.supports_policies = repository.supports_policies
+        self.max_age = max_age
+        self.clock = clock
+        self.cache: dict[CircuitName, tuple[float, Context]] = {}
+        self.messages = []
+
+    async def initialize(self) -> None:
+        await self.repository.initialize()
+
+    def invalidate(self, name: Optional[CircuitName] = None) -> None:
+        """Drop the cached context, or every cached contexts if name is None."""
+        if name is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(name, None)
+
+    async def get(self, name: CircuitName) -> Optional[Context]:
+        """Load breakers from the cache, or from the repository if expired."""
+        now = self.clock()
+        cached = self.cache.get(name)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        context = await self.repository.get(name)
+        if context is None:
+            self.cache.pop(name, None)
+        else:
+            self.cache[name] = (now + self.max_age, context)
+        return context
+
+    async def get_many(
+        self, names: Sequence[CircuitName]
+    ) -> dict[CircuitName, Context]:
+        """Load many breakers from the cache, and the expired ones at once."""
+        now = self.clock()
+        contexts = {}
+        missing = []
+        for name in names:
+            cached = self.cache.get(name)
+            if cached is not None and cached[0] > now:
+                contexts[name] = cached[1]
+            else:
+                missing.append(name)
+        if missing:
+            loaded = await self.repository.get_many(missing)
+            for name in missing:
+                if name in loaded:
+                    self.cache[name] = (now + self.max_age, loaded[name])
+                else:
+                    self.cache.pop(name, None)
+            contexts.update(loaded)
+        return contexts
+
+    async def get_all(self) -> dict[CircuitName, Context]:
+        """Load every breakers from the repository, and cache them."""
+        contexts = await self.repository.get_all()
+        expires_at = self.clock() + self.max_age
+        for name, context in contexts.items():
+            self.cache[name] = (expires_at, context)
+        return contexts
+
+    async def register(self, context: Context) -> None:
+        """Add a circuit breaker into the repository."""
+        await self.repository.register(context)
+        self.cache[context.name] = (self.clock() + self.max_age, context)
+
+    async def register_many(self, contexts: Sequence[Context]) -> None:
+        """Add many circuit breakers into the repository."""
+        await self.repository.register_many(contexts)
+        expires_at = self.clock() + self.max_age
+        for context in contexts:
+            self.cache[context.name] = (expires_at, context)
+
+    async def update_state(
+        self,
+        name: str,
+        state: str,
+        opened_at: Optional[float],
+    ) -> None:
+        """Store the new state in the repository and invalidate the cache."""
+        await self.repository.update_state(name, state, opened_at)
+        self.invalidate(name)
+
+    async def inc_failures(self, name: str, failure_count: int) -> None:
+        """Increment the number of failure in the repository."""
+        await self.repository.inc_failures(name, failure_count)
+
+    async def reset_failure(self, name: str) -> None:
+        """Reset the number of failure in the repository."""
+        await self.repository.reset_failure(name)
+
+    async def acquire_probe(self, name: str, max_probes: int, lease: float) -> bool:
+        """Reserve a call of the half opened circuit in the repository."""
+        return await self.repository.acquire_probe(name, max_probes, lease)
+
+    async def release_probe(self, name: str) -> None:
+        """Release a call reserved by acquire_probe."""
+        await self.repository.release_probe(name)
+
+
+class AsyncSharedMemoryRepository(AsyncAbstractRepository):
+    """
+    Store the circuits in a memory mapped file, shared by the processes of
+    a host, such as ``/dev/shm/purgatory``.
+
+    The file holds at most ``capacity`` circuits, set when the file is created,
+    and the name of a circuit is limited to 208 bytes. Circuits are read without
+    locks, updates lock the record of the circuit.
+    """
+
+    def __init__(self, path: str, capacity: int = 4096) -> None:
+        self.table = SharedMemoryTable(path, capacity)
+        self.messages = []
+
+    async def get(self, name: CircuitName) -> Optional[Context]:
+        """Load breakers from the repository."""
+        record = self.table.get(name)
+        if record is None:
+            return None
+        return load_record(name, record)
+
+    async def get_all(self) -> dict[CircuitName, Context]:
+        """Load every breakers stored in the repository."""
+        return {name: load_record(name, record) for name, record in self.table}
+
+    async def register(self, context: Context) -> None:
+        """Add a circuit breaker into the repository."""
+        record = Record(
+            state=context.state,
+            threshold=context.threshold,
+            ttl=context.ttl,
+            opened_at=context.opened_at,
+            failure_count=context.failure_count or 0,
+            open_count=context.open_count,
+        )
+        if not self.table.put(context.name, record):
+            raise ConfigurationError(
+                f"The shared memory of {self.table.path} is full, "
+                f"{self.table.capacity} circuits are stored."
+            )
+
+    async def update_state(
+        self,
+        name: str,
+        state: str,
+        opened_at: Optional[float],
+    ) -> None:
+        """Store the new state in the repository."""
+
+        def update(record: Record) -> Record:
+            open_count = record.open_count
+            if state == OPENED:
+                # the consecutive openings are counted for the backoff
+                open_count += 1
+            elif state == CLOSED:
+                open_count = 0
+            return record._replace(
+                state=cast(StateName, state),
+                opened_at=opened_at,
+                open_count=open_count,
+            )
+
+        self.table.update(name, update)
+
+    async def inc_failures(self, name: str, failure_count: int) -> None:
+        """Increment the number of failure in the repository."""
+        self.table.update(
+            name, lambda record: record._replace(failure_count=record.failure_count + 1)
+        )
+
+    async def reset_failure(self, name: str) -> None:
+        """Reset the number of failure in the repository."""
+        self.table.update(name, lambda record: record._replace(failure_count=0))
+
+    async def acquire_probe(self, name: str, max_probes: int, lease: float) -> bool:
+        """
+        Count the calls in flight of every processes.
+
+        Calls that are not released after the lease are not counted anymore.
+        """
+        now = time.time()
+        acquired = False
+
+        def acquire(record: Record) -> Record:
+            nonlocal acquired
+            probes = record.probes
+            if probes >= max_probes:
+                if now < record.probed_at + lease:
+                    return record
+                probes = 0
+            acquired = True
+            return record._replace(probes=probes + 1, probed_at=now)
+
+        self.table.update(name, acquire)
+        return acquired
+
+    async def release_probe(self, name: str) -> None:
+        """Release a call reserved by acquire_probe."""
+        self.table.update(
+            name, lambda record: record._replace(probes=max(record.probes - 1, 0))
+        )
+
+
+class AsyncSqliteRepository(AsyncAbstractRepository):
+    """
+    Store the circuits in a sqlite database, shared by the processes of a host,
+    and kept across restarts. The database uses the write ahead log.
+
+    The failure counters are updated in memory, and written in a single
+    transaction by a timer, ``flush_interval`` seconds after the first pending
+    update, after ``flush_size`` updates, or with the next state transition,
+    that is written immediately. The counters are also flushed by
+    :meth:`flush`, on commit of the unit of work.
+
+    The connection is shared by the threads, its writes are serialized.
+
+    The sqlite3 module is synchronous, the queries of the asynchronous
+    repository block the event loop, for the duration of a local file access.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 0.1,
+        flush_size: int = 100,
+        timeout: float = 5.0,
+    ) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.timeout = timeout
+        self._connection: Optional[sqlite3.Connection] = None
+        self.messages = []
+        self.pending: dict[CircuitName, PendingFailures] = {}
+        self.pending_updates = 0
+        self.timer = AsyncFlushTimer(flush_interval, self.flush)
+        # a transaction of the connection is written by a thread at a time
+        self.lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = connect(self.path, self.timeout)
+        return self._connection
+
+    async def initialize(self) -> None:
+        """Open the database, and create its table."""
+        self.connection  # noqa: B018
+
+    async def get(self, name: CircuitName) -> Optional[Context]:
+        """Load breakers from the repository."""
+        row = self.connection.execute(SELECT, (name,)).fetchone()
+        if row is None:
+            return None
+        return load_row(row, self.pending.get(name))
+
+    async def get_many(
+        self, names: Sequence[CircuitName]
+    ) -> dict[CircuitName, Context]:
+        """Load many breakers in a query, the unknown ones are omitted."""
+        contexts = {}
+        for i in range(0, len(names), SELECT_MANY_SIZE):
+            chunk = names[i : i + SELECT_MANY_SIZE]
+            for row in self.connection.execute(select_many(len(chunk)), chunk):
+                contexts[row[0]] = load_row(row, self.pending.get(row[0]))
+        return contexts
+
+    async def get_all(self) -> dict[CircuitName, Context]:
+        """Load every breakers stored in the repository."""
+        return {
+            row[0]: load_row(row, self.pending.get(row[0]))
+            for row in self.connection.execute(SELECT_ALL)
+        }
+
+    async def register(self, context: Context) -> None:
+        """Add a circuit breaker into the repository."""
+        with self.lock:
+            self.pending.pop(context.name, None)
+            self.connection.execute(
+                REGISTER,
+                (
+                    context.name,
+                    context.threshold,
+                    context.ttl,
+                    context.state,
+                    context.opened_at,
+                    context.failure_count or 0,
+                    context.open_count,
+                ),
+            )
+
+    async def update_state(
+        self,
+        name: str,
+        state: str,
+        opened_at: Optional[float],
+    ) -> None:
+        """Store the new state in the repository, with the pending updates."""
+        self.write((UPDATE_STATE, (state, opened_at, state, name)))
+
+    async def inc_failures(self, name: str, failure_count: int) -> None:
+        """Increment the number of failure in the repository."""
+        with self.lock:
+            reset, increment = self.pending.get(name, (False, 0))
+            self.pending[name] = (reset, increment + 1)
+        await self.updated()
+
+    async def reset_failure(self, name: str) -> None:
+        """Reset the number of failure in the repository."""
+        with self.lock:
+            self.pending[name] = (True, 0)
+        await self.updated()
+
+    async def updated(self) -> None:
+        """Flush the pending updates if there are too many, or arm the timer."""
+        with self.lock:
+            self.pending_updates += 1
+            full = self.pending_updates >= self.flush_size
+        if full:
+            await self.flush()
+        else:
+            self.timer.start()
+
+    async def flush(self) -> None:
+        """Write the pending updates of the failure counters."""
+        if self.pending:
+            self.write()
+
+    def write(self, *statements: tuple[str, tuple[Any, ...]]) -> None:
+        """Write the pending updates and the statements in a transaction."""
+        self.timer.cancel()
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.pending_updates = 0
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    INC_FAILURES,
+                    [
+                        (inc, name)
+                        for name, (reset, inc) in pending.items()
+                        if not reset
+                    ],
+                )
+                connection.executemany(
+                    SET_FAILURES,
+                    [(inc, name) for name, (reset, inc) in pending.items() if reset],
+                )
+                for sql, params in statements:
+                    connection.execute(sql, params)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    async def acquire_probe(self, name: str, max_probes: int, lease: float) -> bool:
+        """
+        Count the calls in flight of every processes.
+
+        Calls that are not released after the lease are not counted anymore.
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                ACQUIRE_PROBE,
+                {
+                    "name": name,
+                    "max_probes": max_probes,
+                    "now": time.time(),
+                    "lease": lease,
+                },
+            )
+            return cursor.rowcount == 1
+
+    async def release_probe(self, name: str) -> None:
+        """Release a call reserved by acquire_probe."""
+        with self.lock:
+            self.connection.execute(RELEASE_PROBE, (name,))
@@ -5,14 +5,20 @@ from __future__ import annotations
 import abc
 from collections.abc import Generator
 from types import TracebackType
-from typing import Optional
+from typing import Any, Optional
 
+from purgatory.domain.clock import monotonic
 from purgatory.domain.messages import Message
 from purgatory.service._async.repository import (
     AsyncAbstractRepository,
+    AsyncCachedRepository,
     AsyncInMemoryRepository,
     AsyncRedisRepository,
+    AsyncSharedMemoryRepository,
+    AsyncSqliteRepository,
 )
+from purgatory.service._redis import AsyncRedisClient
+from purgatory.typing import Clock
 
 
 class AsyncAbstractUnitOfWork(abc.ABC):
@@ -20,7 +26,8 @@ class AsyncAbstractUnitOfWork(abc.ABC):
 
     def collect_new_events(self) -> Generator[Message, None, None]:
         while self.contexts.messages:
-            yield self.contexts.messages.pop(0)
+            messages, self.contexts.messages = self.contexts.messages, []
+            yield from messages
 
     async def initialize(self) -> None:  # noqa B027
         """Override to initialize  repositories."""
@@ -48,8 +55,15 @@ class AsyncAbstractUnitOfWork(abc.ABC):
 
 
 class AsyncInMemoryUnitOfWork(AsyncAbstractUnitOfWork):
-    def __init__(self) -> None:
-        self.contexts = AsyncInMemoryRepository()
+    contexts: AsyncInMemoryRepository
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        clock: Clock = monotonic,
+    ) -> None:
+        self.contexts = AsyncInMemoryRepository(max_size, idle_ttl, clock)
 
     async def commit(self) -> None:
         """Do nothing."""
@@ -59,14 +73,128 @@ class AsyncInMemoryUnitOfWork(AsyncAbstractUnitOfWork):
 
 
 class AsyncRedisUnitOfWork(AsyncAbstractUnitOfWork):
-    def __init__(self, url: str) -> None:
-        self.contexts = AsyncRedisRepository(url)
+    contexts: AsyncRedisRepository
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        atomic: bool = False,
+        write_behind: bool = False,
+        flush_interval: float = 0.1,
+        flush_size: int = 100,
+        client: Optional[AsyncRedisClient] = None,
+        connection_pool: Any = None,
+        max_connections: Optional[int] = None,
+    ) -> None:
+        self.contexts = AsyncRedisRepository(
+            url,
+            atomic=atomic,
+            write_behind=write_behind,
+            flush_interval=flush_interval,
+            flush_size=flush_size,
+            client=client,
+            connection_pool=connection_pool,
+            max_connections=max_connections,
+        )
 
     async def initialize(self) -> None:
         await self.contexts.initialize()
 
     async def commit(self) -> None:
+        """Write the pending updates of the write behind mode."""
+        await self.contexts.flush()
+
+    async def rollback(self) -> None:
         """Do nothing."""
 
+
+class AsyncSharedMemoryUnitOfWork(AsyncAbstractUnitOfWork):
+    """
+    Unit of work that share the circuits of the processes of a host, using a
+    memory mapped file.
+
+    :param path: path of the file, created if it does not exists.
+    :param capacity: maximum number of circuits of a new file.
+    """
+
+    contexts: AsyncSharedMemoryRepository
+
+    def __init__(self, path: str, capacity: int = 4096) -> None:
+        self.contexts = AsyncSharedMemoryRepository(path, capacity)
+
+    async def commit(self) -> None:
+        """Do nothing, the updates are written in place."""
+
     async def rollback(self) -> None:
         """Do nothing."""
+
+
+class AsyncSqliteUnitOfWork(AsyncAbstractUnitOfWork):
+    """
+    Unit of work that store the circuits in a sqlite database, in order to
+    share them between the processes of a host and keep them across restarts.
+
+    :param path: path of the database, created if it does not exists.
+    :param flush_interval: maximum delay, in seconds, of the failure counters.
+    :param flush_size: maximum number of updates of the failure counters.
+    :param max_age: if set, the contexts are cached in the process memory
+        for that number of seconds.
+    :param timeout: number of seconds to wait for the lock of another process.
+    """
+
+    contexts: AsyncAbstractRepository
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 0.1,
+        flush_size: int = 100,
+        max_age: Optional[float] = None,
+        timeout: float = 5.0,
+    ) -> None:
+        self.repository = AsyncSqliteRepository(
+            path, flush_interval, flush_size, timeout
+        )
+        self.contexts = (
+            self.repository
+            if max_age is None
+            else AsyncCachedRepository(self.repository, max_age)
+        )
+
+    async def initialize(self) -> None:
+        await self.contexts.initialize()
+
+    async def commit(self) -> None:
+        """Write the pending updates of the failure counters."""
+        await self.repository.flush()
+
+    async def rollback(self) -> None:
+        """Do nothing."""
+
+
+class AsyncCachedUnitOfWork(AsyncAbstractUnitOfWork):
+    """
+    Unit of work that keep contexts of another unit of work in memory.
+
+    :param uow: the unit of work that store the shared state.
+    :param max_age: number of seconds a context is kept before being reloaded.
+    :param clock: clock that measures the age of the contexts.
+    """
+
+    def __init__(
+        self,
+        uow: AsyncAbstractUnitOfWork,
+        max_age: float = 1.0,
+        clock: Clock = monotonic,
+    ) -> None:
+        self.uow = uow
+        self.contexts = AsyncCachedRepository(uow.contexts, max_age, clock)
+
+    async def initialize(self) -> None:
+        await self.uow.initialize()
+
+    async def commit(self) -> None:
+        await self.uow.commit()
+
+    async def rollback(self) -> None:
+        await self.uow.rollback()
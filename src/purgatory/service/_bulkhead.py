@@ -0,0 +1,104 @@
+"""
+Limits of the calls in flight of a circuit, kept in the memory of a process.
+
+The async limiter is used by the coroutines of an event loop, the sync one is
+a counter protected by a lock, shared by the threads of a process. Both give
+the slot of a finished call to the oldest waiting call, if any.
+"""
+
+import asyncio
+import threading
+from collections import deque
+
+from purgatory.domain.model import Bulkhead
+
+
+class AsyncBulkhead:
+    """Semaphore of a circuit, with a bounded queue of waiting coroutines."""
+
+    def __init__(self, config: Bulkhead) -> None:
+        self.max_calls = config.max_calls
+        self.max_queued = config.max_queued
+        self.max_wait = config.max_wait
+        self.in_flight = 0
+        self.waiters: deque[asyncio.Future[None]] = deque()
+
+    async def acquire(self) -> bool:
+        """Acquire a slot, return False if the call is rejected."""
+        if self.in_flight < self.max_calls and not self.waiters:
+            self.in_flight += 1
+            return True
+        if len(self.waiters) >= self.max_queued:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except asyncio.TimeoutError:
+            # the slot may have been given in the loop iteration of the timeout
+            if waiter.done() and not waiter.cancelled():
+                return True
+            return False
+        except BaseException:
+            # the slot may have been given while the call was cancelled
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self.waiters.remove(waiter)
+                except ValueError:
+                    pass
+        return True
+
+    def release(self) -> None:
+        """Release the slot of a finished call, or give it to a waiting call."""
+        waiters = self.waiters
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+class SyncBulkhead:
+    """Counter of a circuit, with a bounded number of waiting threads."""
+
+    def __init__(self, config: Bulkhead) -> None:
+        self.max_calls = config.max_calls
+        self.max_queued = config.max_queued
+        self.max_wait = config.max_wait
+        self.in_flight = 0
+        self.queued = 0
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+
+    def acquire(self) -> bool:
+        """Acquire a slot, return False if the call is rejected."""
+        # the lock of the condition is faster to enter than the condition
+        with self.lock:
+            if self.in_flight < self.max_calls and not self.queued:
+                self.in_flight += 1
+                return True
+            if self.queued >= self.max_queued:
+                return False
+            self.queued += 1
+            try:
+                if not self.condition.wait_for(self.has_slot, self.max_wait):
+                    return False
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+            return True
+
+    def has_slot(self) -> bool:
+        return self.in_flight < self.max_calls
+
+    def release(self) -> None:
+        """Release the slot of a finished call, and wake up a waiting call."""
+        with self.lock:
+            self.in_flight -= 1
+            if self.queued:
+                self.condition.notify()
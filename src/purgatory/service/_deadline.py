@@ -0,0 +1,144 @@
+"""
+Timeouts of the calls of the circuits.
+
+The calls that share a timeout are registered in the order of their
+deadlines, a single timer of the event loop cancels the tasks of the expired
+calls, and is armed again for the next deadline. A call only adds an entry
+to a dict, no timer, task or future is created per call.
+
+A thread can not be interrupted, so the sync deadlines only detect the calls
+that returned late, they are counted as failures, their result is kept.
+"""
+
+import asyncio
+from typing import Any, Optional
+
+from purgatory.typing import Clock
+
+
+class LoopDeadlines:
+    """Cancel the tasks of the calls of an event loop that reach the timeout."""
+
+    def __init__(self, timeout: float, loop: asyncio.AbstractEventLoop) -> None:
+        self.timeout = timeout
+        self.loop = loop
+        # calls in flight, by increasing deadline, as the timeout is constant
+        self.calls: dict[int, tuple[float, asyncio.Task[Any]]] = {}
+        # calls cancelled by the timer, that have not been stopped yet
+        self.expired: set[int] = set()
+        self.seq = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def start(self) -> int:
+        """Register a call of the current task, return its identifier."""
+        loop = self.loop
+        task = asyncio.current_task(loop)
+        if task is None:  # coverage: ignore
+            raise RuntimeError("A timeout requires a running task")
+        self.seq = call = self.seq + 1
+        deadline = loop.time() + self.timeout
+        self.calls[call] = (deadline, task)
+        if self.timer is None:
+            self.timer = loop.call_at(deadline, self.expire)
+        return call
+
+    def stop(self, call: int) -> bool:
+        """Unregister the call, return True, once, if it has been cancelled."""
+        if self.calls.pop(call, None) is not None:
+            return False
+        if call not in self.expired:
+            return False
+        self.expired.discard(call)
+        # the cancellation is consumed, python >= 3.11 counts them
+        task = asyncio.current_task(self.loop)
+        uncancel = getattr(task, "uncancel", None)
+        if uncancel is not None:
+            uncancel()
+        return True
+
+    def expire(self) -> None:
+        """Cancel the expired calls, and arm the timer for the next one."""
+        self.timer = None
+        loop = self.loop
+        now = loop.time()
+        calls = self.calls
+        while calls:
+            call = next(iter(calls))
+            deadline, task = calls[call]
+            if deadline > now:
+                self.timer = loop.call_at(deadline, self.expire)
+                return
+            del calls[call]
+            self.expired.add(call)
+            task.cancel()
+
+
+class AsyncDeadlines:
+    """
+    Deadlines of the calls of a timeout.
+
+    The calls of every event loop are registered apart, the deadlines may be
+    shared by threads running their own loop.
+    """
+
+    # the expired calls are cancelled, the timeout error is raised instead
+    interrupts = True
+
+    def __init__(self, timeout: float) -> None:
+        self.timeout = timeout
+        self.loops: dict[asyncio.AbstractEventLoop, LoopDeadlines] = {}
+        # deadlines of the last loop, most processes run a single loop
+        self.last: Optional[LoopDeadlines] = None
+
+    def current(self) -> LoopDeadlines:
+        """Return the deadlines of the running loop."""
+        loop = asyncio.get_running_loop()
+        last = self.last
+        if last is not None and last.loop is loop:
+            return last
+        deadlines = self.loops.get(loop)
+        if deadlines is None:
+            # the deadlines of the closed loops are dropped
+            for other in list(self.loops):
+                if other.is_closed():
+                    self.loops.pop(other, None)
+            deadlines = self.loops.setdefault(loop, LoopDeadlines(self.timeout, loop))
+        self.last = deadlines
+        return deadlines
+
+    def start(self) -> int:
+        """Register a call of the current task, return its identifier."""
+        return self.current().start()
+
+    def stop(self, call: int) -> bool:
+        """Unregister the call, return True, once, if it has been cancelled."""
+        return self.current().stop(call)
+
+
+class SyncDeadlines:
+    """Detect the calls that returned after the timeout."""
+
+    # the late calls are counted as failures, their outcome is kept
+    interrupts = False
+
+    def __init__(self, timeout: float, clock: Clock) -> None:
+        self.timeout = timeout
+        self.clock = clock
+
+    def start(self) -> float:
+        """Return the starting time of the call, as its identifier."""
+        return self.clock()
+
+    def stop(self, call: float) -> bool:
+        """Return True if the call has reached the timeout."""
+        return self.clock() - call > self.timeout
+
+
+def create_async_deadlines(timeout: float, clock: Clock) -> AsyncDeadlines:
+    """Create the deadlines of a timeout, measured by the event loops."""
+    return AsyncDeadlines(timeout)
+
+
+def create_sync_deadlines(timeout: float, clock: Clock) -> SyncDeadlines:
+    """Create the deadlines of a timeout, measured by the clock of the factory."""
+    return SyncDeadlines(timeout, clock)
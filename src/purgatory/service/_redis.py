@@ -1,4 +1,9 @@
-from typing import Any
+import asyncio
+from collections.abc import Mapping
+from typing import TYPE_CHECKING, Any, Optional, Union, cast
+
+from purgatory.domain.model import Context
+from purgatory.typing import StateName
 
 try:
     from redis.asyncio import Redis as AioRedis
@@ -13,3 +18,243 @@ try:
     SyncRedis = Redis
 except ImportError:
     SyncRedis = Any  # type: ignore
+
+# The clients are generic in the stubs only.
+if TYPE_CHECKING:
+    AsyncRedisClient = AsyncRedis[Any]
+    SyncRedisClient = SyncRedis[Any]
+else:
+    AsyncRedisClient = AsyncRedis
+    SyncRedisClient = SyncRedis
+
+
+class ConfigurationError(RuntimeError):
+    pass
+
+
+# Clients of the connection pools shared by the repositories of the process,
+# per url and pool size. The connections of an asyncio pool belong to the
+# event loop that opened them, so the asyncio clients are shared per loop.
+SYNC_CLIENTS: dict[tuple[str, Optional[int]], Any] = {}
+ASYNC_CLIENTS: dict[
+    tuple[Optional[asyncio.AbstractEventLoop], str, Optional[int]], Any
+] = {}
+
+
+def get_async_client(
+    client_class: Any, url: str, max_connections: Optional[int]
+) -> Any:
+    """Return the client of the url for the running loop, created once."""
+    try:
+        loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    key = (loop, url, max_connections)
+    client = ASYNC_CLIENTS.get(key)
+    if client is None:
+        # the clients of the closed loops are dropped
+        for other in list(ASYNC_CLIENTS):
+            if other[0] is not None and other[0].is_closed():
+                ASYNC_CLIENTS.pop(other, None)
+        client = ASYNC_CLIENTS.setdefault(
+            key, client_class.from_url(url, max_connections=max_connections)
+        )
+    return client
+
+
+def get_sync_client(client_class: Any, url: str, max_connections: Optional[int]) -> Any:
+    """Return the client of the url, created on the first call."""
+    key = (url, max_connections)
+    client = SYNC_CLIENTS.get(key)
+    if client is None:
+        client = SYNC_CLIENTS.setdefault(
+            key, client_class.from_url(url, max_connections=max_connections)
+        )
+    return client
+
+
+def create_async_client(
+    url: Optional[str],
+    connection_pool: Any = None,
+    max_connections: Optional[int] = None,
+) -> AsyncRedisClient:
+    """
+    Create an asyncio client using the given pool, or return the shared client
+    of the url for the running event loop.
+
+    Creating the client does not connect, connections are opened on first use.
+    """
+    try:
+        from redis import asyncio as aioredis
+    except ImportError as exc:
+        raise ConfigurationError(  # coverage: ignore
+            "redis extra dependencies not installed."
+        ) from exc
+    if connection_pool is None:
+        return cast(
+            AsyncRedisClient,
+            get_async_client(aioredis.Redis, cast(str, url), max_connections),
+        )
+    return aioredis.Redis(connection_pool=connection_pool)
+
+
+def create_sync_client(
+    url: Optional[str],
+    connection_pool: Any = None,
+    max_connections: Optional[int] = None,
+) -> SyncRedisClient:
+    """
+    Create a client using the given pool, or return the shared client of the url.
+
+    Creating the client does not connect, connections are opened on first use.
+    """
+    try:
+        import redis
+    except ImportError as exc:
+        raise ConfigurationError(  # coverage: ignore
+            "redis extra dependencies not installed."
+        ) from exc
+    if connection_pool is None:
+        return cast(
+            SyncRedisClient,
+            get_sync_client(redis.Redis, cast(str, url), max_connections),
+        )
+    return redis.Redis(connection_pool=connection_pool)
+
+
+HashMapping = dict[Union[bytes, str], Union[bytes, float, int, str]]
+
+
+def decode(value: Union[bytes, str]) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def dump_opened_at(opened_at: Optional[float]) -> Union[float, str]:
+    """Hash fields cannot be null, the empty string is used instead."""
+    return "" if opened_at is None else opened_at
+
+
+def dump_context(context: Context) -> HashMapping:
+    """Build the redis hash of the context."""
+    return {
+        "name": context.name,
+        "threshold": context.threshold,
+        "ttl": context.ttl,
+        "state": context.state,
+        "opened_at": dump_opened_at(context.opened_at),
+        "failure_count": context.failure_count or 0,
+        "open_count": context.open_count,
+    }
+
+
+# Failure counter updates that are not written yet, per circuit, coalesced as
+# (reset, increment): the counter is reset before being incremented if reset.
+PendingFailures = tuple[bool, int]
+
+
+def load_context(
+    data: Mapping[Union[bytes, str], Union[bytes, str]],
+    pending: Optional[PendingFailures] = None,
+) -> Context:
+    """Build the context from a redis hash, and its pending failures."""
+    breaker = {decode(key): decode(val) for key, val in data.items()}
+    opened_at = breaker.get("opened_at")
+    failure_count = int(breaker.get("failure_count") or 0)
+    if pending is not None:
+        reset, increment = pending
+        failure_count = increment if reset else failure_count + increment
+    return Context(
+        breaker["name"],
+        threshold=int(breaker["threshold"]),
+        ttl=float(breaker["ttl"]),
+        state=cast(StateName, breaker["state"]),
+        failure_count=failure_count,
+        opened_at=float(opened_at) if opened_at else None,
+        open_count=int(breaker.get("open_count") or 0),
+    )
+
+
+# Lua scripts of the atomic mode, KEYS[1] is the key of the circuit hash.
+# They return the state of the circuit after the transition.
+
+RECORD_FAILURE_SCRIPT = """
+local state = redis.call("HGET", KEYS[1], "state")
+if not state then
+    return false
+end
+local failure_count = redis.call("HINCRBY", KEYS[1], "failure_count", 1)
+if state == "closed" then
+    local threshold = tonumber(redis.call("HGET", KEYS[1], "threshold"))
+    if failure_count >= threshold then
+        redis.call("HSET", KEYS[1], "state", "opened", "opened_at", ARGV[1])
+        redis.call("HINCRBY", KEYS[1], "open_count", 1)
+        return "opened"
+    end
+end
+return state
+"""
+
+OPEN_SCRIPT = """
+local state = redis.call("HGET", KEYS[1], "state")
+if state == "closed" then
+    local failure_count = tonumber(redis.call("HGET", KEYS[1], "failure_count"))
+    local threshold = tonumber(redis.call("HGET", KEYS[1], "threshold"))
+    if (failure_count or 0) < threshold then
+        return state
+    end
+elseif state ~= "half-opened" then
+    return state
+end
+redis.call("HSET", KEYS[1], "state", "opened", "opened_at", ARGV[1])
+redis.call("HINCRBY", KEYS[1], "open_count", 1)
+return "opened"
+"""
+
+TRY_HALF_OPEN_SCRIPT = """
+local state = redis.call("HGET", KEYS[1], "state")
+if state == "opened" then
+    local opened_at = tonumber(redis.call("HGET", KEYS[1], "opened_at")) or 0
+    local ttl = tonumber(redis.call("HGET", KEYS[1], "ttl"))
+    if tonumber(ARGV[1]) >= opened_at + ttl then
+        redis.call("HSET", KEYS[1], "state", "half-opened", "opened_at", "")
+        return "half-opened"
+    end
+end
+return state
+"""
+
+# KEYS[1] is the key of the circuit hash, ARGV[1] the maximum number of probes,
+# ARGV[2] the current time and ARGV[3] the lease of the probes, in seconds, in
+# order to forget the probes of processes that died before releasing them.
+ACQUIRE_PROBE_SCRIPT = """
+local probes = tonumber(redis.call("HGET", KEYS[1], "probes")) or 0
+if probes >= tonumber(ARGV[1]) then
+    local probed_at = tonumber(redis.call("HGET", KEYS[1], "probed_at")) or 0
+    if tonumber(ARGV[2]) < probed_at + tonumber(ARGV[3]) then
+        return 0
+    end
+    probes = 0
+end
+redis.call("HSET", KEYS[1], "probes", probes + 1, "probed_at", ARGV[2])
+return 1
+"""
+
+RELEASE_PROBE_SCRIPT = """
+local probes = tonumber(redis.call("HGET", KEYS[1], "probes")) or 0
+if probes > 0 then
+    redis.call("HSET", KEYS[1], "probes", probes - 1)
+end
+return probes
+"""
+
+RECORD_SUCCESS_SCRIPT = """
+local state = redis.call("HGET", KEYS[1], "state")
+if state == "closed" or state == "half-opened" then
+    redis.call(
+        "HSET", KEYS[1], "state", "closed", "opened_at", "", "failure_count", 0,
+        "open_count", 0
+    )
+    return "closed"
+end
+return state
+"""
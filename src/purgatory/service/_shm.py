@@ -0,0 +1,314 @@
+"""
+Table of circuits stored in a memory mapped file, shared by the processes
+of a host.
+
+The file starts with a header, followed by fixed size records, indexed by
+the hash of the circuit name using linear probing. Records are never moved
+nor deleted, so the slot of a circuit is cached by every process.
+
+Records are read without locks, using a sequence number incremented before
+and after every write: a read is retried while a write is in progress.
+Writes lock the record, using a byte range lock of the file, in order to
+serialize the processes, and a lock of the process, in order to serialize
+its threads. Inserting a new record locks the header.
+
+The record is packed before the write starts, so an invalid record never
+leaves a write in progress. A reader that sees the same write in progress
+for too long takes the lock of the record, released by a writer that died,
+and completes the sequence number of the stale write.
+"""
+
+import math
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections.abc import Iterator
+from typing import Callable, NamedTuple, Optional, cast
+
+from purgatory.domain.model import CLOSED, HALF_OPENED, OPENED, Context
+from purgatory.typing import CircuitName, StateName
+
+try:
+    import fcntl
+except ImportError:  # coverage: ignore
+    fcntl = None  # type: ignore
+
+MAGIC = b"PGTY"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI")
+HEADER_SIZE = 256
+
+# seq, used, state, name length, threshold, ttl, opened_at, failure_count,
+# open_count, probes, probed_at
+RECORD = struct.Struct("<IBBHiddiiid")
+RECORD_SIZE = 256
+NAME_SIZE = RECORD_SIZE - RECORD.size
+SEQ = struct.Struct("<I")
+# range of the threshold and the counters, stored as signed 32 bits integers
+INT32 = range(-(2**31), 2**31)
+# reads of a write in progress before the record is locked
+MAX_SPINS = 1000
+
+STATES: tuple[StateName, ...] = (CLOSED, OPENED, HALF_OPENED)
+
+
+class Record(NamedTuple):
+    state: StateName
+    threshold: int
+    ttl: float
+    opened_at: Optional[float]
+    failure_count: int
+    open_count: int = 0
+    probes: int = 0
+    probed_at: float = 0.0
+
+
+def load_context(name: CircuitName, record: Record) -> Context:
+    """Build the context from its record."""
+    return Context(
+        name,
+        record.threshold,
+        record.ttl,
+        record.state,
+        record.failure_count,
+        record.opened_at,
+        open_count=record.open_count,
+    )
+
+
+def encode_name(name: CircuitName) -> bytes:
+    data = name.encode("utf-8")
+    if len(data) > NAME_SIZE:
+        raise ValueError(f"Circuit name longer than {NAME_SIZE} bytes: {name}")
+    return data
+
+
+class SharedMemoryTable:
+    """
+    Fixed size table of circuits in a memory mapped file.
+
+    The file is created with ``capacity`` records if it does not exist,
+    otherwise the capacity of the existing file is used.
+    """
+
+    def __init__(self, path: str, capacity: int = 4096) -> None:
+        if fcntl is None:  # coverage: ignore
+            raise RuntimeError("The shared memory table requires fcntl locks")
+        if capacity < 1:
+            raise ValueError("capacity must be a positive integer")
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size == 0:
+                os.ftruncate(self.fd, HEADER_SIZE + capacity * RECORD_SIZE)
+                os.pwrite(
+                    self.fd, HEADER.pack(MAGIC, VERSION, RECORD_SIZE, capacity), 0
+                )
+            magic, version, record_size, capacity = HEADER.unpack(
+                os.pread(self.fd, HEADER.size, 0)
+            )
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        if (magic, version, record_size) != (MAGIC, VERSION, RECORD_SIZE):
+            os.close(self.fd)
+            raise ValueError(f"{path} is not a circuit table of this version")
+        self.capacity: int = capacity
+        self.mmap = mmap.mmap(self.fd, HEADER_SIZE + capacity * RECORD_SIZE)
+        # exported once, exporting the buffer of the mmap on every read is slow
+        self.buf = memoryview(self.mmap)
+        # reentrant, a stale write may be repaired while the header is locked
+        self.lock = threading.RLock()
+        # slot of the circuits, records are never moved
+        self.slots: dict[CircuitName, int] = {}
+
+    def close(self) -> None:
+        self.buf.release()
+        self.mmap.close()
+        os.close(self.fd)
+
+    def offset(self, slot: int) -> int:
+        return HEADER_SIZE + slot * RECORD_SIZE
+
+    def read_slot(self, slot: int, locked: bool = False) -> tuple[int, ...]:
+        """
+        Read the record fields of the slot, retried during writes.
+
+        Set ``locked`` if the slot is locked by the caller, a write in progress
+        is then a stale write, repaired immediately.
+        """
+        offset = self.offset(slot)
+        buf = self.buf
+        spins = 0
+        while True:
+            fields = RECORD.unpack_from(buf, offset)
+            seq = fields[0]
+            if seq % 2 == 0:
+                if SEQ.unpack_from(buf, offset)[0] == seq:
+                    return fields
+            elif locked:
+                self.repair_slot(slot)
+            else:
+                spins += 1
+                if spins == MAX_SPINS:
+                    # wait for a live writer, or repair the write of a dead one
+                    self.locked(offset, lambda: self.repair_slot(slot))
+                    spins = 0
+
+    def repair_slot(self, slot: int) -> None:
+        """Complete a write interrupted by the death of its writer, if any."""
+        offset = self.offset(slot)
+        seq = SEQ.unpack_from(self.buf, offset)[0]
+        if seq % 2:
+            SEQ.pack_into(self.buf, offset, (seq + 1) & 0xFFFFFFFF)
+
+    def read_name(self, slot: int, length: int) -> bytes:
+        offset = self.offset(slot) + RECORD.size
+        return bytes(self.buf[offset : offset + length])
+
+    def find(self, name: CircuitName) -> Optional[int]:
+        """Return the slot of the circuit, None if it is not in the table."""
+        slot = self.slots.get(name)
+        if slot is not None:
+            return slot
+        data = encode_name(name)
+        start = zlib.crc32(data) % self.capacity
+        for i in range(self.capacity):
+            slot = (start + i) % self.capacity
+            fields = self.read_slot(slot)
+            if not fields[1]:
+                return None
+            if fields[3] == len(data) and self.read_name(slot, fields[3]) == data:
+                self.slots[name] = slot
+                return slot
+        return None
+
+    def load(self, fields: tuple[int, ...]) -> Record:
+        opened_at = fields[6]
+        return Record(
+            STATES[fields[2]],
+            fields[4],
+            fields[5],
+            None if opened_at != opened_at else opened_at,  # NaN is null
+            fields[7],
+            fields[8],
+            fields[9],
+            fields[10],
+        )
+
+    def get(self, name: CircuitName) -> Optional[Record]:
+        slot = self.find(name)
+        if slot is None:
+            return None
+        return self.load(self.read_slot(slot))
+
+    def __iter__(self) -> Iterator[tuple[CircuitName, Record]]:
+        for slot in range(self.capacity):
+            fields = self.read_slot(slot)
+            if fields[1]:
+                name = self.read_name(slot, fields[3]).decode("utf-8")
+                yield name, self.load(fields)
+
+    def write_slot(self, slot: int, record: Record, name: bytes) -> None:
+        """Write the record, the slot must be locked."""
+        if not (
+            record.threshold in INT32
+            and record.failure_count in INT32
+            and record.open_count in INT32
+            and record.probes in INT32
+        ):
+            raise ValueError(
+                f"The threshold and the counters of {name.decode('utf-8')} "
+                "must be 32 bits integers"
+            )
+        offset = self.offset(slot)
+        buf = self.buf
+        seq = SEQ.unpack_from(buf, offset)[0]
+        if seq % 2:
+            # the stale write of a dead writer, completed by this one
+            seq += 1
+        # packed before the write starts, in order to never leave it in progress
+        data = (
+            RECORD.pack(
+                (seq + 1) & 0xFFFFFFFF,
+                1,
+                STATES.index(record.state),
+                len(name),
+                record.threshold,
+                record.ttl,
+                math.nan if record.opened_at is None else record.opened_at,
+                record.failure_count,
+                record.open_count,
+                record.probes,
+                record.probed_at,
+            )
+            + name
+        )
+        SEQ.pack_into(buf, offset, (seq + 1) & 0xFFFFFFFF)
+        buf[offset + SEQ.size : offset + len(data)] = data[SEQ.size :]
+        SEQ.pack_into(buf, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def locked(self, offset: int, func: Callable[[], object]) -> object:
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, offset)
+            try:
+                return func()
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, offset)
+
+    def insert(self, data: bytes, record: Record) -> Optional[tuple[int, bool]]:
+        """
+        Write the record in a free slot, the header must be locked.
+
+        Return the slot, and False if the circuit has been inserted by another
+        process in the meantime, or None if the table is full.
+        """
+        start = zlib.crc32(data) % self.capacity
+        for i in range(self.capacity):
+            slot = (start + i) % self.capacity
+            fields = self.read_slot(slot)
+            if not fields[1]:
+                self.write_slot(slot, record, data)
+                return slot, True
+            if fields[3] == len(data) and self.read_name(slot, fields[3]) == data:
+                return slot, False
+        return None
+
+    def put(self, name: CircuitName, record: Record) -> bool:
+        """Insert or replace the record, return False if the table is full."""
+        data = encode_name(name)
+        slot = self.find(name)
+        if slot is None:
+            claimed = cast(
+                Optional[tuple[int, bool]],
+                self.locked(0, lambda: self.insert(data, record)),
+            )
+            if claimed is None:
+                return False
+            slot, inserted = claimed
+            self.slots[name] = slot
+            if inserted:
+                return True
+        self.locked(self.offset(slot), lambda: self.write_slot(slot, record, data))
+        return True
+
+    def update(
+        self, name: CircuitName, func: Callable[[Record], Record]
+    ) -> Optional[Record]:
+        """
+        Replace the record of the circuit by ``func(record)`` while locked,
+        and return it, or None if the circuit is not in the table.
+        """
+        slot = self.find(name)
+        if slot is None:
+            return None
+        data = encode_name(name)
+
+        def update() -> Record:
+            record = func(self.load(self.read_slot(slot, locked=True)))
+            self.write_slot(slot, record, data)
+            return record
+
+        return cast(Record, self.locked(self.offset(slot), update))
@@ -0,0 +1,103 @@
+"""
+Storage of the circuits in a sqlite database, a row per circuit.
+
+The statements are constants, the sqlite3 module keeps them prepared
+in the statement cache of the connection.
+"""
+
+import sqlite3
+from collections.abc import Sequence
+from typing import Any, Optional, cast
+
+from purgatory.domain.model import Context
+from purgatory.service._redis import PendingFailures
+from purgatory.typing import StateName
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS purgatory_circuits (
+    name TEXT PRIMARY KEY,
+    threshold INTEGER NOT NULL,
+    ttl REAL NOT NULL,
+    state TEXT NOT NULL,
+    opened_at REAL,
+    failure_count INTEGER NOT NULL DEFAULT 0,
+    open_count INTEGER NOT NULL DEFAULT 0,
+    probes INTEGER NOT NULL DEFAULT 0,
+    probed_at REAL NOT NULL DEFAULT 0
+)
+"""
+
+COLUMNS = "name, threshold, ttl, state, opened_at, failure_count, open_count"
+
+SELECT = f"SELECT {COLUMNS} FROM purgatory_circuits WHERE name = ?"
+
+SELECT_ALL = f"SELECT {COLUMNS} FROM purgatory_circuits"
+
+REGISTER = (
+    f"INSERT OR REPLACE INTO purgatory_circuits ({COLUMNS}) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+UPDATE_STATE = """
+UPDATE purgatory_circuits SET state = ?, opened_at = ?,
+    open_count = CASE ? WHEN 'opened' THEN open_count + 1
+        WHEN 'closed' THEN 0 ELSE open_count END
+WHERE name = ?
+"""
+
+INC_FAILURES = """
+UPDATE purgatory_circuits SET failure_count = failure_count + ? WHERE name = ?
+"""
+
+SET_FAILURES = "UPDATE purgatory_circuits SET failure_count = ? WHERE name = ?"
+
+ACQUIRE_PROBE = """
+UPDATE purgatory_circuits SET
+    probes = CASE WHEN probes < :max_probes THEN probes + 1 ELSE 1 END,
+    probed_at = :now
+WHERE name = :name AND (probes < :max_probes OR :now >= probed_at + :lease)
+"""
+
+RELEASE_PROBE = """
+UPDATE purgatory_circuits SET probes = probes - 1 WHERE name = ? AND probes > 0
+"""
+
+# maximum number of names of a single select, sqlite limits the parameters
+SELECT_MANY_SIZE = 500
+
+
+def select_many(count: int) -> str:
+    return f"{SELECT_ALL} WHERE name IN ({', '.join('?' * count)})"
+
+
+def connect(path: str, timeout: float) -> sqlite3.Connection:
+    """
+    Open the database in autocommit mode, the batches of writes are explicit
+    transactions. The write ahead log let readers run during writes.
+    """
+    connection = sqlite3.connect(
+        path, timeout=timeout, isolation_level=None, check_same_thread=False
+    )
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(CREATE_TABLE)
+    return connection
+
+
+def load_context(
+    row: Sequence[Any], pending: Optional[PendingFailures] = None
+) -> Context:
+    """Build the context from a row, and its pending failures."""
+    name, threshold, ttl, state, opened_at, failure_count, open_count = row
+    if pending is not None:
+        reset, increment = pending
+        failure_count = increment if reset else failure_count + increment
+    return Context(
+        name,
+        threshold=threshold,
+        ttl=ttl,
+        state=cast(StateName, state),
+        failure_count=failure_count,
+        opened_at=opened_at,
+        open_count=open_count,
+    )
@@ -4,7 +4,8 @@ Propagate commands and events to every registered handles.
 """
 
 import logging
-from collections import defaultdict
+from collections import defaultdict, deque
+from collections.abc import Iterable
 from typing import Any, TypeVar, cast
 
 from purgatory.domain.messages.base import Command, Event, Message
@@ -22,18 +23,56 @@ class ConfigurationError(RuntimeError):
     """Prevents bad usage of the add_listener."""
 
 
+DispatchPlan = tuple[bool, tuple[SyncMessageHandler[Any, Any], ...]]
+
+
 class SyncMessageRegistry:
-    """Store all the handlers for commands an events."""
+    """
+    Store all the handlers for commands an events.
+
+    The handlers of a message type are resolved on its first dispatch, and
+    kept in a dispatch plan until a listener is added or removed.
+    Listeners of an event type also receive the events of its subclasses.
+    """
 
     def __init__(self) -> None:
         self.commands_registry: dict[type[Command], SyncCommandHandler[Command]] = {}
         self.events_registry: dict[type[Event], list[SyncEventHandler[Event]]] = (
             defaultdict(list)
         )
+        self.dispatch_plans: dict[type[Message], DispatchPlan] = {}
+
+    def get_dispatch_plan(self, msg_type: type[Message]) -> DispatchPlan:
+        """
+        Return a tuple (is_command, handlers) for the given message type.
+
+        Events handlers are ordered using the method resolution order of the type.
+        """
+        if issubclass(msg_type, Command):
+            cmd_handler = self.commands_registry.get(msg_type)
+            plan: DispatchPlan = (
+                True,
+                (cmd_handler,) if cmd_handler is not None else (),
+            )
+        elif issubclass(msg_type, Event):
+            plan = (
+                False,
+                tuple(
+                    callback
+                    for klass in msg_type.__mro__
+                    if klass in self.events_registry
+                    for callback in self.events_registry[klass]
+                ),
+            )
+        else:
+            raise RuntimeError(f"{msg_type} is not an Event or Command")
+        self.dispatch_plans[msg_type] = plan
+        return plan
 
     def add_listener(
         self, msg_type: type[Message], callback: SyncMessageHandler[Any, Any]
     ) -> None:
+        self.dispatch_plans.clear()
         if issubclass(msg_type, Command):
             if msg_type in self.commands_registry:
                 raise ConfigurationError(
@@ -55,6 +94,7 @@ class SyncMessageRegistry:
     def remove_listener(
         self, msg_type: type, callback: SyncMessageHandler[Any, Any]
     ) -> None:
+        self.dispatch_plans.clear()
         if issubclass(msg_type, Command):
             if msg_type not in self.commands_registry:
                 raise ConfigurationError(f"{msg_type} command has not been registered")
@@ -79,24 +119,38 @@ class SyncMessageRegistry:
         Notify listener of that event registered with `messagebus.add_listener`.
         Return the first event from the command.
         """
-        queue = [message]
+        return self.handle_batch((message,), uow)
+
+    def handle_batch(
+        self, messages: Iterable[Message], uow: SyncAbstractUnitOfWork
+    ) -> Any:
+        """
+        Handle many messages, and the events they raised, in a single pass.
+        Return the result of the first message if it is a command.
+        """
+        queue: deque[Message] = deque(messages)
+        plans = self.dispatch_plans
         idx = 0
         ret = None
         while queue:
-            message = queue.pop(0)
-            if not isinstance(message, (Command, Event)):
-                raise RuntimeError(f"{message} was not an Event or Command")
-            msg_type = type(message)
-            if msg_type in self.commands_registry:
-                cmdret = self.commands_registry[cast(type[Command], msg_type)](
-                    cast(Command, message), uow
-                )
-                if idx == 0:
-                    ret = cmdret
-                queue.extend(uow.collect_new_events())
-            elif msg_type in self.events_registry:
-                for callback in self.events_registry[cast(type[Event], msg_type)]:
-                    callback(cast(Event, message), uow)
+            message = queue.popleft()
+            try:
+                is_command, handlers = plans[type(message)]
+            except KeyError:
+                if not isinstance(message, (Command, Event)):
+                    raise RuntimeError(
+                        f"{message} was not an Event or Command"
+                    ) from None
+                is_command, handlers = self.get_dispatch_plan(type(message))
+            if is_command:
+                if handlers:
+                    cmdret = handlers[0](message, uow)
+                    if idx == 0:
+                        ret = cmdret
+                    queue.extend(uow.collect_new_events())
+            else:
+                for callback in handlers:
+                    callback(message, uow)
                     queue.extend(uow.collect_new_events())
             idx += 1
         return ret
@@ -0,0 +1,78 @@
+"""
+Timers of the write behind repositories.
+
+The pending updates are written after a delay, even if no other update
+comes. The async timer runs the flush in a task of the event loop, the sync
+timer runs it in a daemon thread.
+"""
+
+import asyncio
+import logging
+import threading
+from collections.abc import Awaitable
+from typing import Any, Callable, Optional
+
+log = logging.getLogger(__name__)
+
+
+class AsyncFlushTimer:
+    """Run the flush once, after the delay, in the running event loop."""
+
+    def __init__(self, delay: float, flush: Callable[[], Awaitable[None]]) -> None:
+        self.delay = delay
+        self.flush = flush
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # the task of the flush in progress, kept until it is done
+        self.task: Optional[asyncio.Task[Any]] = None
+
+    def start(self) -> None:
+        """Arm the timer, if it is not armed yet."""
+        if self.timer is None:
+            loop = asyncio.get_running_loop()
+            self.timer = loop.call_later(self.delay, self.run)
+
+    def cancel(self) -> None:
+        """Disarm the timer, the pending updates have been written."""
+        timer, self.timer = self.timer, None
+        if timer is not None:
+            timer.cancel()
+
+    def run(self) -> None:
+        self.timer = None
+        self.task = asyncio.ensure_future(self.run_flush())
+
+    async def run_flush(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            log.exception("Cannot write the pending updates")
+
+
+class SyncFlushTimer:
+    """Run the flush once, after the delay, in a daemon thread."""
+
+    def __init__(self, delay: float, flush: Callable[[], None]) -> None:
+        self.delay = delay
+        self.flush = flush
+        self.timer: Optional[threading.Timer] = None
+
+    def start(self) -> None:
+        """Arm the timer, if it is not armed yet."""
+        if self.timer is None:
+            timer = threading.Timer(self.delay, self.run)
+            timer.daemon = True
+            self.timer = timer
+            timer.start()
+
+    def cancel(self) -> None:
+        """Disarm the timer, the pending updates have been written."""
+        timer, self.timer = self.timer, None
+        if timer is not None:
+            timer.cancel()
+
+    def run(self) -> None:
+        self.timer = None
+        try:
+            self.flush()
+        except Exception:
+            log.exception("Cannot write the pending updates")
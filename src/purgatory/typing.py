@@ -5,13 +5,21 @@ from purgatory.domain.messages.base import Event
 CircuitName = str
 TTL = float
 Threshold = int
+# Return a time in seconds
+Clock = Callable[[], float]
 
 
 StateName = Literal["opened", "closed", "half-opened"]
 Hook = Callable[
     [
         CircuitName,
-        Literal["circuit_breaker_created", "state_changed", "failed", "recovered"],
+        Literal[
+            "circuit_breaker_created",
+            "state_changed",
+            "failed",
+            "recovered",
+            "bulkhead_full",
+        ],
         Event,
     ],
     None,
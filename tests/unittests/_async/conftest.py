@@ -1,20 +1,29 @@
-import json
-from typing import Any, Optional, cast
+from typing import cast
 
 import pytest
 
 from purgatory import AsyncCircuitBreakerFactory
 from purgatory.service._async.messagebus import AsyncMessageRegistry
 from purgatory.service._async.repository import (
+    AsyncCachedRepository,
     AsyncInMemoryRepository,
     AsyncRedisRepository,
+    AsyncSharedMemoryRepository,
+    AsyncSqliteRepository,
 )
 from purgatory.service._async.unit_of_work import AsyncRedisUnitOfWork
+from tests.unittests._async.fake_redis import FakeRedis
+from tests.unittests.time import VirtualClock
 
 
 @pytest.fixture()
-def circuitbreaker():
-    yield AsyncCircuitBreakerFactory()
+def clock():
+    yield VirtualClock()
+
+
+@pytest.fixture()
+def circuitbreaker(clock):
+    yield AsyncCircuitBreakerFactory(clock=clock.monotonic, wall_clock=clock.time)
 
 
 @pytest.fixture()
@@ -22,56 +31,65 @@ def messagebus():
     yield AsyncMessageRegistry()
 
 
-class FakeRedis:
-    def __init__(self):
-        self.initialized = False
-        self.storage = None
+@pytest.fixture()
+def fake_redis():
+    yield FakeRedis()
 
-    @property
-    def deserialized_storage(self):
-        return {
-            key: json.loads(val) if isinstance(val, str) else val
-            for key, val in self.storage.items()
-        }
 
-    async def initialize(self):
-        self.initialized = True
-        self.storage = {}
+@pytest.fixture()
+def inmemory_repository():
+    return AsyncInMemoryRepository()
 
-    async def get(self, key) -> Optional[Any]:
-        if not self.initialized:
-            raise RuntimeError("Unititialized")
-        return self.storage.get(key)
 
-    async def set(self, key, val):
-        if not self.initialized:
-            raise RuntimeError("Unititialized")
-        self.storage[key] = val
+@pytest.fixture()
+def shm_path(tmp_path):
+    yield str(tmp_path / "purgatory")
 
-    async def incr(self, key):
-        if not self.initialized:
-            raise RuntimeError("Unititialized")
-        val = int(self.storage.get(key, 0)) + 1
-        self.storage[key] = val
+
+@pytest.fixture()
+def shm_repository(shm_path):
+    repo = AsyncSharedMemoryRepository(shm_path, capacity=8)
+    yield repo
+    repo.table.close()
 
 
 @pytest.fixture()
-def fake_redis():
-    yield FakeRedis()
+def sqlite_path(tmp_path):
+    yield str(tmp_path / "purgatory.sqlite")
 
 
 @pytest.fixture()
-def inmemory_repository():
-    return AsyncInMemoryRepository()
+def sqlite_repository(sqlite_path):
+    repo = AsyncSqliteRepository(sqlite_path, flush_interval=60, flush_size=5)
+    yield repo
+    repo.connection.close()
 
 
 @pytest.fixture()
 def redis_repository(fake_redis):
-    repo = AsyncRedisRepository("redis://localhost")
-    repo.redis = fake_redis
+    repo = AsyncRedisRepository(client=fake_redis)
+    yield repo
+
+
+@pytest.fixture()
+def atomic_redis_repository(fake_redis):
+    repo = AsyncRedisRepository(client=fake_redis, atomic=True)
     yield repo
 
 
+@pytest.fixture()
+def write_behind_redis_repository(fake_redis):
+    repo = AsyncRedisRepository(
+        client=fake_redis, write_behind=True, flush_interval=60, flush_size=5
+    )
+    yield repo
+
+
+@pytest.fixture()
+def cached_redis_repository(redis_repository):
+    yield AsyncCachedRepository(redis_repository, max_age=60)
+
+
 @pytest.fixture()
 def redis_uow(fake_redis):
     repo = AsyncRedisUnitOfWork("redis://localhost")
@@ -80,5 +98,7 @@ def redis_uow(fake_redis):
 
 
 @pytest.fixture()
-def circuitbreaker_redis(redis_uow):
-    yield AsyncCircuitBreakerFactory(uow=redis_uow)
+def circuitbreaker_redis(redis_uow, clock):
+    yield AsyncCircuitBreakerFactory(
+        uow=redis_uow, clock=clock.monotonic, wall_clock=clock.time
+    )
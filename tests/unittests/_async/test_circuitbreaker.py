@@ -3,14 +3,26 @@ from dataclasses import asdict
 import pytest
 
 from purgatory.domain.messages.events import (
+    BulkheadFull,
     CircuitBreakerCreated,
     CircuitBreakerFailed,
     CircuitBreakerRecovered,
     ContextChanged,
 )
-from purgatory.domain.model import Context
+from purgatory.domain.model import Bulkhead, BulkheadFullError, Context, OpenedState
 from purgatory.service._async.circuitbreaker import AsyncCircuitBreakerFactory
-from tests.unittests.time import AsyncSleep
+from purgatory.service._async.repository import (
+    AsyncAbstractRepository,
+    AsyncInMemoryRepository,
+)
+from purgatory.service._async.unit_of_work import (
+    AsyncCachedUnitOfWork,
+    AsyncInMemoryUnitOfWork,
+    AsyncRedisUnitOfWork,
+    AsyncSharedMemoryUnitOfWork,
+    AsyncSqliteUnitOfWork,
+)
+from tests.unittests.time import VirtualClock
 
 
 async def test_circuitbreaker_factory_decorator(
@@ -75,14 +87,15 @@ async def test_redis_circuitbreaker_factory_decorator(
     await fail()
 
     assert fake_redis.deserialized_storage == {
-        "cbr::client": {
+        "cbrh::client": {
             "name": "client",
-            "opened_at": None,
+            "opened_at": "",
             "state": "closed",
-            "threshold": 3,
-            "ttl": 0.1,
+            "threshold": "3",
+            "ttl": "0.1",
+            "failure_count": "2",
+            "open_count": "0",
         },
-        "cbr::client::failure_count": 2,
     }
 
     await fail_or_success(fail=False)
@@ -195,7 +208,13 @@ async def test_circuitbreaker_factory_add_listener():
     def hook(name, evt_name, evt):
         evts.append((name, evt_name, evt))
 
-    circuitbreaker = AsyncCircuitBreakerFactory(default_threshold=2, default_ttl=0.1)
+    clock = VirtualClock()
+    circuitbreaker = AsyncCircuitBreakerFactory(
+        default_threshold=2,
+        default_ttl=0.1,
+        clock=clock.monotonic,
+        wall_clock=clock.time,
+    )
     circuitbreaker.add_listener(hook)
 
     brk = await circuitbreaker.get_breaker("my")
@@ -237,7 +256,7 @@ async def test_circuitbreaker_factory_add_listener():
     ]
 
     evts.clear()
-    await AsyncSleep(0.11)
+    await clock.AsyncSleep(0.11)
     await boom()
     assert evts == [
         (
@@ -255,7 +274,7 @@ async def test_circuitbreaker_factory_add_listener():
     ]
     evts.clear()
 
-    await AsyncSleep(0.11)
+    await clock.AsyncSleep(0.11)
     async with brk:
         pass
 
@@ -310,3 +329,487 @@ async def test_circuitbreaker_factory_remove_listener():
     await circuitbreaker.get_breaker("my2")
     assert evts == []
     assert circuitbreaker.listeners == {}
+
+
+async def test_atomic_redis_circuitbreaker_share_failures(fake_redis):
+    uow = AsyncRedisUnitOfWork("redis://localhost", atomic=True)
+    uow.contexts.redis = fake_redis
+    uow2 = AsyncRedisUnitOfWork("redis://localhost", atomic=True)
+    uow2.contexts.redis = fake_redis
+
+    circuitbreaker = AsyncCircuitBreakerFactory(default_threshold=2, uow=uow)
+    circuitbreaker2 = AsyncCircuitBreakerFactory(default_threshold=2, uow=uow2)
+    await circuitbreaker.initialize()
+
+    with pytest.raises(RuntimeError):
+        async with await circuitbreaker.get_breaker("my"):
+            raise RuntimeError("Boom")
+    with pytest.raises(RuntimeError):
+        async with await circuitbreaker2.get_breaker("my"):
+            raise RuntimeError("Boom")
+
+    with pytest.raises(OpenedState):
+        async with await circuitbreaker.get_breaker("my"):
+            pass
+
+
+async def test_circuitbreaker_half_opened_max_probes(circuitbreaker, clock):
+    brk = await circuitbreaker.get_breaker("my", threshold=1, ttl=10, max_probes=1)
+    with pytest.raises(RuntimeError):
+        async with brk:
+            raise RuntimeError("Boom")
+    assert brk.context.state == "opened"
+    await clock.AsyncSleep(11)
+
+    probe = await circuitbreaker.get_breaker("my", max_probes=1)
+    async with probe:
+        assert brk.context.state == "half-opened"
+        with pytest.raises(OpenedState):
+            async with await circuitbreaker.get_breaker("my", max_probes=1):
+                raise AssertionError("Unexpected call")  # coverage: ignore
+        assert circuitbreaker.uow.contexts.probes == {"my": 1}
+
+    assert brk.context.state == "closed"
+    assert circuitbreaker.uow.contexts.probes == {}
+
+
+async def test_circuitbreaker_decorator_max_probes(circuitbreaker, clock):
+    @circuitbreaker("my", threshold=1, ttl=10, max_probes=1)
+    async def call(func):
+        return await func()
+
+    async def boom():
+        raise RuntimeError("Boom")
+
+    async def rejected():
+        with pytest.raises(OpenedState):
+            await call(boom)
+        return 42
+
+    with pytest.raises(RuntimeError):
+        await call(boom)
+    await clock.AsyncSleep(11)
+    # the second call is rejected while the first one is probing
+    assert await call(rejected) == 42
+    assert circuitbreaker.uow.contexts.probes == {}
+    brk = await circuitbreaker.get_breaker("my")
+    assert brk.context.state == "closed"
+
+    with pytest.raises(RuntimeError):
+        await call(boom)
+    await clock.AsyncSleep(11)
+    with pytest.raises(RuntimeError):
+        await call(boom)
+    assert brk.context.state == "opened"
+    assert circuitbreaker.uow.contexts.probes == {}
+
+
+async def test_redis_circuitbreaker_max_probes(circuitbreaker_redis, fake_redis):
+    await circuitbreaker_redis.initialize()
+    await circuitbreaker_redis.get_breaker("my", threshold=1, ttl=10)
+    fake_redis.storage["cbrh::my"]["state"] = "half-opened"
+
+    async with await circuitbreaker_redis.get_breaker("my", max_probes=1):
+        assert fake_redis.storage["cbrh::my"]["probes"] == "1"
+        with pytest.raises(OpenedState):
+            async with await circuitbreaker_redis.get_breaker("my", max_probes=1):
+                raise AssertionError("Unexpected call")  # coverage: ignore
+
+    assert fake_redis.storage["cbrh::my"]["probes"] == "0"
+    assert fake_redis.storage["cbrh::my"]["state"] == "closed"
+
+
+async def test_redis_circuitbreaker_write_behind(fake_redis):
+    uow = AsyncRedisUnitOfWork(
+        "redis://localhost", write_behind=True, flush_interval=60, flush_size=10
+    )
+    uow.contexts.redis = fake_redis
+    circuitbreaker = AsyncCircuitBreakerFactory(default_threshold=3, uow=uow)
+    await circuitbreaker.initialize()
+
+    @circuitbreaker("my")
+    async def boom():
+        raise RuntimeError("Boom")
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await boom()
+    assert fake_redis.storage["cbrh::my"]["failure_count"] == "0"
+
+    with pytest.raises(RuntimeError):
+        await boom()
+    assert fake_redis.storage["cbrh::my"]["state"] == "opened"
+    assert fake_redis.storage["cbrh::my"]["failure_count"] == "3"
+
+
+async def test_circuitbreaker_factory_get_breakers(
+    circuitbreaker: AsyncCircuitBreakerFactory,
+):
+    await circuitbreaker.get_breaker("foo", threshold=2)
+    breakers = await circuitbreaker.get_breakers(
+        ["foo", "bar"], threshold=10, max_probes=1
+    )
+    assert list(breakers) == ["foo", "bar"]
+    assert breakers["foo"].context.threshold == 2
+    assert breakers["bar"].context.threshold == 10
+    assert breakers["bar"].context.max_probes == 1
+    assert breakers["bar"].context.clock == circuitbreaker.clock
+
+    async with breakers["bar"]:
+        pass
+    assert await circuitbreaker.uow.contexts.get("bar") is breakers["bar"].context
+
+
+async def test_redis_circuitbreaker_factory_get_breakers(fake_redis):
+    uow = AsyncRedisUnitOfWork(client=fake_redis)
+    circuitbreaker = AsyncCircuitBreakerFactory(uow=uow)
+    evts = []
+
+    def hook(name, evt_type, payload):
+        assert evt_type == "circuit_breaker_created"
+        evts.append(name)
+
+    circuitbreaker.add_listener(hook)
+    names = [f"circuit{idx}" for idx in range(50)]
+    await circuitbreaker.get_breakers(names)
+    # the hashes, the legacy layout, and the registration of the circuits
+    assert fake_redis.round_trips == 3
+    assert set(fake_redis.storage) == {f"cbrh::{name}" for name in names}
+    assert evts == names
+
+
+async def test_circuitbreaker_factory_preload(
+    circuitbreaker: AsyncCircuitBreakerFactory,
+):
+    await circuitbreaker.initialize(preload=["foo", "bar"])
+    contexts = await circuitbreaker.uow.contexts.get_all()
+    assert set(contexts) == {"foo", "bar"}
+
+    contexts = await circuitbreaker.preload()
+    assert set(contexts) == {"foo", "bar"}
+
+
+async def test_circuitbreaker_factory_preload_unlisted():
+    class UnlistedRepository(AsyncInMemoryRepository):
+        get_all = AsyncAbstractRepository.get_all
+
+    uow = AsyncInMemoryUnitOfWork()
+    uow.contexts = UnlistedRepository()
+    circuitbreaker = AsyncCircuitBreakerFactory(uow=uow)
+    await circuitbreaker.get_breaker("foo")
+    await circuitbreaker.initialize(preload=True)
+    assert await circuitbreaker.preload() == {}
+
+
+async def test_redis_circuitbreaker_factory_preload(fake_redis):
+    uow = AsyncRedisUnitOfWork(client=fake_redis)
+    circuitbreaker = AsyncCircuitBreakerFactory(uow=uow)
+    await circuitbreaker.initialize(preload=["foo", "bar"])
+    assert set(fake_redis.storage) == {"cbrh::foo", "cbrh::bar"}
+
+    uow = AsyncCachedUnitOfWork(AsyncRedisUnitOfWork(client=fake_redis), 60)
+    circuitbreaker = AsyncCircuitBreakerFactory(uow=uow)
+    await circuitbreaker.initialize(preload=True)
+    round_trips = fake_redis.round_trips
+    await circuitbreaker.get_breaker("foo")
+    await circuitbreaker.get_breaker("bar")
+    assert fake_redis.round_trips == round_trips
+
+
+async def test_circuitbreaker_factory_bounded_inmemory(clock):
+    circuitbreaker = AsyncCircuitBreakerFactory(
+        default_threshold=1,
+        uow=AsyncInMemoryUnitOfWork(max_size=1, clock=clock.monotonic),
+        clock=clock.monotonic,
+        wall_clock=clock.time,
+    )
+
+    @circuitbreaker("foo")
+    async def foo(fail=False):
+        if fail:
+            raise RuntimeError("Boom")
+
+    await foo()
+    await circuitbreaker.get_breaker("bar")
+    assert circuitbreaker.uow.contexts.evictions == 1
+    with pytest.raises(RuntimeError):
+        await foo(fail=True)
+    assert circuitbreaker.uow.contexts.breakers["foo"].state == "opened"
+    await circuitbreaker.get_breaker("baz")
+    assert set(circuitbreaker.uow.contexts.breakers) == {"foo", "baz"}
+    with pytest.raises(OpenedState):
+        await foo()
+
+
+async def test_shm_circuitbreaker_share_failures(shm_path):
+    circuitbreaker = AsyncCircuitBreakerFactory(
+        default_threshold=2, uow=AsyncSharedMemoryUnitOfWork(shm_path)
+    )
+    other = AsyncCircuitBreakerFactory(
+        default_threshold=2, uow=AsyncSharedMemoryUnitOfWork(shm_path)
+    )
+    with pytest.raises(RuntimeError):
+        async with await circuitbreaker.get_breaker("my"):
+            raise RuntimeError("Boom")
+    with pytest.raises(RuntimeError):
+        async with await other.get_breaker("my"):
+            raise RuntimeError("Boom")
+    with pytest.raises(OpenedState):
+        async with await circuitbreaker.get_breaker("my"):
+            raise AssertionError("Unexpected call")  # coverage: ignore
+
+
+async def test_sqlite_circuitbreaker_survives_restarts(sqlite_path):
+    circuitbreaker = AsyncCircuitBreakerFactory(
+        default_threshold=2, uow=AsyncSqliteUnitOfWork(sqlite_path)
+    )
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            async with await circuitbreaker.get_breaker("my"):
+                raise RuntimeError("Boom")
+
+    restarted = AsyncCircuitBreakerFactory(uow=AsyncSqliteUnitOfWork(sqlite_path))
+    await restarted.initialize()
+    with pytest.raises(OpenedState):
+        async with await restarted.get_breaker("my"):
+            raise AssertionError("Unexpected call")  # coverage: ignore
+
+
+async def test_circuitbreaker_thread_safe(clock):
+    evts = []
+
+    def hook(name, evt_name, evt):
+        evts.append((name, evt_name))
+
+    circuitbreaker = AsyncCircuitBreakerFactory(
+        default_threshold=2,
+        default_ttl=10,
+        clock=clock.monotonic,
+        wall_clock=clock.time,
+        thread_safe=True,
+        lock_stripes=4,
+    )
+    assert circuitbreaker.locks is not None and len(circuitbreaker.locks) == 4
+    assert circuitbreaker.get_lock("my") is circuitbreaker.get_lock("my")
+    circuitbreaker.add_listener(hook)
+
+    @circuitbreaker("my", max_probes=1)
+    async def call(fail=False):
+        if fail:
+            raise RuntimeError("Boom")
+        return 42
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await call(fail=True)
+    with pytest.raises(OpenedState):
+        await call()
+    brk = await circuitbreaker.get_breaker("my", max_probes=1)
+    assert brk.lock is circuitbreaker.get_lock("my")
+    with pytest.raises(OpenedState):
+        async with brk:
+            raise AssertionError("Unexpected call")  # coverage: ignore
+
+    await clock.AsyncSleep(11)
+    async with brk:
+        with pytest.raises(OpenedState):
+            async with await circuitbreaker.get_breaker("my", max_probes=1):
+                raise AssertionError("Unexpected call")  # coverage: ignore
+    assert await call() == 42
+    assert brk.context.state == "closed"
+    assert evts == [
+        ("my", "circuit_breaker_created"),
+        ("my", "failed"),
+        ("my", "failed"),
+        ("my", "state_changed"),
+        ("my", "state_changed"),
+        ("my", "recovered"),
+        ("my", "state_changed"),
+    ]
+
+
+async def test_circuitbreaker_thread_safe_context_manager(clock):
+    circuitbreaker = AsyncCircuitBreakerFactory(
+        default_threshold=1,
+        default_ttl=10,
+        clock=clock.monotonic,
+        wall_clock=clock.time,
+        thread_safe=True,
+    )
+    brk = await circuitbreaker.get_breaker("my", slow_call_duration=1)
+    async with brk:
+        await clock.AsyncSleep(2)
+    assert brk.context.state == "opened"
+    with pytest.raises(OpenedState):
+        async with brk:
+            raise AssertionError("Unexpected call")  # coverage: ignore
+
+
+async def test_circuitbreaker_decorator_dispatch_events_before_call(
+    circuitbreaker, clock
+):
+    evts = []
+
+    def hook(name, evt_name, evt):
+        evts.append(getattr(evt, "state", evt_name))
+
+    circuitbreaker.add_listener(hook)
+
+    @circuitbreaker("my", threshold=1, ttl=10)
+    async def call(fail=False):
+        seen = list(evts)
+        if fail:
+            raise RuntimeError("Boom")
+        return seen
+
+    with pytest.raises(RuntimeError):
+        await call(fail=True)
+    await clock.AsyncSleep(11)
+    # the half opened transition is dispatched by the call that produced it,
+    # before the call, it is not left in the context for the next calls.
+    assert await call() == [
+        "circuit_breaker_created",
+        "failed",
+        "opened",
+        "half-opened",
+    ]
+    assert evts[-2:] == ["recovered", "closed"]
+
+
+async def test_circuitbreaker_bulkhead(circuitbreaker):
+    evts = []
+
+    def hook(name, evt_name, evt):
+        evts.append((name, evt_name, evt))
+
+    circuitbreaker.add_listener(hook)
+    brk = await circuitbreaker.get_breaker("my", bulkhead=Bulkhead(1))
+    async with brk:
+        with pytest.raises(BulkheadFullError) as ctx:
+            # the limiter of the circuit is shared by its breakers
+            other = await circuitbreaker.get_breaker("my", bulkhead=Bulkhead(5))
+            async with other:
+                raise AssertionError("Unexpected call")  # coverage: ignore
+        assert ctx.value.circuit_name == "my"
+        # other circuits are not limited
+        async with await circuitbreaker.get_breaker("other"):
+            pass
+    assert circuitbreaker.bulkheads["my"].in_flight == 0
+    assert "other" not in circuitbreaker.bulkheads
+
+    with pytest.raises(RuntimeError):
+        async with brk:
+            raise RuntimeError("Boom")
+    assert circuitbreaker.bulkheads["my"].in_flight == 0
+    assert evts[1] == ("my", "bulkhead_full", BulkheadFull("my", 1))
+    # a rejection is not a failure of the circuit
+    assert brk.context.failure_count == 1
+
+
+async def test_circuitbreaker_bulkhead_queue_timeout(clock):
+    circuitbreaker = AsyncCircuitBreakerFactory(
+        clock=clock.monotonic,
+        wall_clock=clock.time,
+        default_bulkhead=Bulkhead(1, max_queued=1, max_wait=0),
+    )
+    async with await circuitbreaker.get_breaker("my"):
+        with pytest.raises(BulkheadFullError):
+            async with await circuitbreaker.get_breaker("my"):
+                raise AssertionError("Unexpected call")  # coverage: ignore
+    bulkhead = circuitbreaker.bulkheads["my"]
+    assert bulkhead.in_flight == 0
+    async with await circuitbreaker.get_breaker("my"):
+        assert bulkhead.in_flight == 1
+
+
+async def test_circuitbreaker_bulkhead_opened(circuitbreaker, clock):
+    brk = await circuitbreaker.get_breaker(
+        "my", threshold=1, ttl=10, max_probes=1, bulkhead=Bulkhead(2)
+    )
+    bulkhead = circuitbreaker.bulkheads["my"]
+    with pytest.raises(RuntimeError):
+        async with brk:
+            raise RuntimeError("Boom")
+    with pytest.raises(OpenedState):
+        async with brk:
+            raise AssertionError("Unexpected call")  # coverage: ignore
+    assert bulkhead.in_flight == 0
+
+    await clock.AsyncSleep(11)
+    async with brk:
+        with pytest.raises(OpenedState):
+            async with await circuitbreaker.get_breaker("my", max_probes=1):
+                raise AssertionError("Unexpected call")  # coverage: ignore
+        assert bulkhead.in_flight == 1
+    assert bulkhead.in_flight == 0
+
+
+async def test_circuitbreaker_bulkhead_probe_error(circuitbreaker, clock):
+    brk = await circuitbreaker.get_breaker(
+        "my", threshold=1, ttl=10, max_probes=1, bulkhead=Bulkhead(1)
+    )
+    bulkhead = circuitbreaker.bulkheads["my"]
+    with pytest.raises(RuntimeError):
+        async with brk:
+            raise RuntimeError("Boom")
+    await clock.AsyncSleep(11)
+
+    async def acquire_probe(name, max_probes, lease):
+        raise ConnectionError("Storage unavailable")
+
+    circuitbreaker.uow.contexts.acquire_probe = acquire_probe
+    with pytest.raises(ConnectionError):
+        async with brk:
+            raise AssertionError("Unexpected call")  # coverage: ignore
+    assert bulkhead.in_flight == 0
+
+
+async def test_circuitbreaker_decorator_bulkhead(circuitbreaker, clock):
+    evts = []
+
+    def hook(name, evt_name, evt):
+        evts.append(evt_name)
+
+    circuitbreaker.add_listener(hook)
+
+    @circuitbreaker("my", threshold=1, ttl=10, max_probes=1, bulkhead=Bulkhead(1))
+    async def call(func):
+        return await func()
+
+    async def nested():
+        with pytest.raises(BulkheadFullError):
+            await call(nested)  # coverage: ignore
+        return 42
+
+    async def boom():
+        raise RuntimeError("Boom")
+
+    assert await call(nested) == 42
+    bulkhead = circuitbreaker.bulkheads["my"]
+    assert bulkhead.in_flight == 0
+    assert evts == ["circuit_breaker_created", "bulkhead_full"]
+
+    with pytest.raises(RuntimeError):
+        await call(boom)
+    assert bulkhead.in_flight == 0
+    with pytest.raises(OpenedState):
+        await call(boom)
+    assert bulkhead.in_flight == 0
+    await clock.AsyncSleep(11)
+    assert await call(nested) == 42
+    assert bulkhead.in_flight == 0
+
+
+async def test_circuitbreaker_timeout_not_reached(circuitbreaker):
+    @circuitbreaker("my", timeout=60)
+    async def call():
+        return 42
+
+    assert await call() == 42
+    brk = await circuitbreaker.get_breaker("my", timeout=60)
+    # the calls of the same timeout share their deadlines
+    assert brk.deadlines is circuitbreaker.deadlines[60]
+    async with brk:
+        assert len(brk.calls) == 1
+    assert brk.calls == {}
+    assert brk.context.failure_count == 0
@@ -1,7 +1,21 @@
 from typing import cast
 
-from purgatory.domain.model import Context
+import pytest
+
+from purgatory.domain.model import (
+    Backoff,
+    Context,
+    CountWindow,
+    FailureRatePolicy,
+    OpenedState,
+)
+from purgatory.service._async.circuitbreaker import AsyncCircuitBreakerFactory
 from purgatory.service._async.repository import AsyncInMemoryRepository
+from purgatory.service._async.unit_of_work import (
+    AsyncCachedUnitOfWork,
+    AsyncRedisUnitOfWork,
+)
+from purgatory.service._redis import ConfigurationError
 
 
 async def test_circuitbreaker_factory_context(circuitbreaker):
@@ -67,3 +81,213 @@ async def test_circuitbreaker_factory_context_exclude_exceptions_with_decorator(
         pass
 
     assert (await circuitbreaker.get_breaker("my")).context.state == "opened"
+
+
+async def test_circuitbreaker_factory_handle(circuitbreaker):
+    handle = circuitbreaker.get_handle("my", threshold=7, exclude=[ValueError])
+    assert handle.threshold == 7
+    assert handle.ttl == 30
+    assert handle.classifier.exclude_list == [ValueError]
+    assert handle.context is None
+
+    brk = await handle.get_breaker()
+    assert brk.context is handle.context
+    assert brk.context == Context(name="my", threshold=7, ttl=30)
+
+    await circuitbreaker.get_breaker("my", exclude=[KeyError])
+    assert (await handle.get_context()).exclude_list == [ValueError]
+
+
+async def test_circuitbreaker_factory_classifier_compiled_once(circuitbreaker):
+    brk = await circuitbreaker.get_breaker("my", exclude=[ValueError])
+    classifier = brk.context.classifier
+    assert classifier.is_failure(KeyError()) is True
+    assert classifier.decisions
+
+    brk = await circuitbreaker.get_breaker("my", exclude=[ValueError])
+    assert brk.context.classifier is classifier
+    assert circuitbreaker.get_handle("my", exclude=[ValueError]).classifier is (
+        classifier
+    )
+
+    brk = await circuitbreaker.get_breaker("my", exclude=[KeyError])
+    assert brk.context.classifier is not classifier
+    assert brk.context.exclude_list == [KeyError]
+    brk = await circuitbreaker.get_breaker("my")
+    assert brk.context.classifier is circuitbreaker.global_classifier
+
+
+async def test_circuitbreaker_factory_decorator_resolve_once(circuitbreaker):
+    calls = []
+    get = circuitbreaker.uow.contexts.get
+
+    async def spy_get(name):
+        calls.append(name)
+        return await get(name)
+
+    circuitbreaker.uow.contexts.get = spy_get
+
+    @circuitbreaker("my")
+    async def success():
+        pass
+
+    await success()
+    await success()
+    await success()
+    assert calls == ["my"]
+
+
+async def test_circuitbreaker_factory_decorator_reload(circuitbreaker_redis):
+    await circuitbreaker_redis.initialize()
+    calls = []
+    get = circuitbreaker_redis.uow.contexts.get
+
+    async def spy_get(name):
+        calls.append(name)
+        return await get(name)
+
+    circuitbreaker_redis.uow.contexts.get = spy_get
+
+    @circuitbreaker_redis("my")
+    async def success():
+        pass
+
+    await success()
+    await success()
+    assert calls == ["my", "my"]
+
+
+async def test_circuitbreaker_factory_decorator_fast_path(circuitbreaker):
+    @circuitbreaker("my")
+    async def success():
+        return 42
+
+    assert await success() == 42
+
+    async def unexpected(*args):
+        raise AssertionError("Unexpected call")
+
+    circuitbreaker.uow.contexts.get = unexpected
+    circuitbreaker.messagebus.handle = unexpected
+    assert await success() == 42
+
+
+async def test_circuitbreaker_factory_failure_rate_policy(circuitbreaker):
+    policy = FailureRatePolicy(failure_rate=0.5, minimum_calls=4, window_size=10)
+
+    @circuitbreaker("my", threshold=2, policy=policy)
+    async def call(fail: bool):
+        if fail:
+            raise RuntimeError("Boom")
+
+    for fail in (True, False, True, False, False):
+        try:
+            await call(fail)
+        except RuntimeError:
+            pass
+
+    window = circuitbreaker.windows["my"]
+    assert isinstance(window, CountWindow)
+    assert (window.calls, window.failures) == (5, 2)
+    brk = await circuitbreaker.get_breaker("my", policy=policy)
+    assert brk.context.window is window
+    assert brk.context.state == "closed"
+
+    try:
+        await call(True)
+    except RuntimeError:
+        pass
+    assert brk.context.state == "opened"
+
+
+async def test_circuitbreaker_factory_failure_rate_policy_atomic(fake_redis):
+    policy = FailureRatePolicy(failure_rate=0.5, minimum_calls=2, window_size=10)
+    uow = AsyncRedisUnitOfWork(client=fake_redis, atomic=True)
+    circuitbreaker = AsyncCircuitBreakerFactory(uow=uow)
+    with pytest.raises(ConfigurationError):
+        await circuitbreaker.get_breaker("my", policy=policy)
+    with pytest.raises(ConfigurationError):
+        circuitbreaker("my", policy=policy)
+    circuitbreaker = AsyncCircuitBreakerFactory(uow=AsyncCachedUnitOfWork(uow))
+    with pytest.raises(ConfigurationError):
+        await circuitbreaker.get_breaker("my", policy=policy)
+
+    # the policies are used with the non atomic mode
+    uow = AsyncRedisUnitOfWork(client=fake_redis)
+    circuitbreaker = AsyncCircuitBreakerFactory(uow=uow)
+    brk = await circuitbreaker.get_breaker("my", policy=policy)
+    assert brk.context.window is not None
+
+
+async def test_circuitbreaker_factory_without_policy(circuitbreaker):
+    brk = await circuitbreaker.get_breaker("my")
+    assert brk.context.window is None
+    assert circuitbreaker.get_handle("my").window is None
+    assert circuitbreaker.windows == {}
+
+
+async def test_circuitbreaker_factory_slow_call_with_decorator(circuitbreaker, clock):
+    @circuitbreaker("my", threshold=2, slow_call_duration=0.01)
+    async def call(duration: float):
+        await clock.AsyncSleep(duration)
+
+    await call(0)
+    await call(0.02)
+    brk = await circuitbreaker.get_breaker("my")
+    assert brk.context.state == "closed"
+    assert brk.context.failure_count == 1
+
+    await call(0.02)
+    assert brk.context.state == "opened"
+
+
+async def test_circuitbreaker_factory_slow_call_with_context(circuitbreaker, clock):
+    brk = await circuitbreaker.get_breaker("my", threshold=1, slow_call_duration=0.01)
+    assert brk.context.slow_call_duration == 0.01
+    async with brk:
+        pass
+    assert brk.context.state == "closed"
+    async with await circuitbreaker.get_breaker("my", slow_call_duration=0.01):
+        await clock.AsyncSleep(0.02)
+    assert brk.context.state == "opened"
+
+
+async def test_circuitbreaker_factory_default_slow_call_duration():
+    circuitbreaker = AsyncCircuitBreakerFactory(default_slow_call_duration=2)
+    assert circuitbreaker.get_handle("my").slow_call_duration == 2
+    assert circuitbreaker.get_handle("my", slow_call_duration=1).slow_call_duration == 1
+    brk = await circuitbreaker.get_breaker("my")
+    assert brk.context.slow_call_duration == 2
+
+
+async def test_circuitbreaker_factory_backoff(circuitbreaker, clock):
+    backoff = Backoff(factor=2, jitter=0)
+
+    @circuitbreaker("my", threshold=1, ttl=10, backoff=backoff)
+    async def boom():
+        raise RuntimeError("Boom")
+
+    with pytest.raises(RuntimeError):
+        await boom()
+    await clock.AsyncSleep(10.1)
+    with pytest.raises(RuntimeError):
+        await boom()
+    await clock.AsyncSleep(10.1)
+    with pytest.raises(OpenedState):
+        await boom()
+    await clock.AsyncSleep(10)
+    with pytest.raises(RuntimeError):
+        await boom()
+
+    brk = await circuitbreaker.get_breaker("my")
+    assert brk.context.backoff is None
+    assert brk.context.open_count == 3
+    assert circuitbreaker.get_handle("my", backoff=backoff).backoff is backoff
+
+
+async def test_circuitbreaker_factory_default_backoff():
+    backoff = Backoff()
+    circuitbreaker = AsyncCircuitBreakerFactory(default_backoff=backoff)
+    assert circuitbreaker.get_handle("my").backoff is backoff
+    brk = await circuitbreaker.get_breaker("my")
+    assert brk.context.backoff is backoff
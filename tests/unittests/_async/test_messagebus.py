@@ -1,5 +1,6 @@
 import pytest
 
+from purgatory.domain.messages import Event
 from purgatory.service._async.messagebus import ConfigurationError
 from purgatory.service._async.unit_of_work import AsyncInMemoryUnitOfWork
 from tests.unittests.dummy_models import DummyCommand, DummyEvent, DummyModel
@@ -123,3 +124,51 @@ async def test_messagebus_cannot_unregister_non_unregistered_handler(messagebus)
         == "Invalid usage of the listen decorator: type <class 'object'> "
         "should be a command or an event"
     )
+
+
+async def test_messagebus_handle_batch(messagebus):
+    handled = []
+
+    async def listen_event_order(evt: DummyEvent, uow):
+        handled.append(evt.id)
+        if evt.id == "a":
+            uow.events.append(DummyEvent(id="c", increment=0))
+
+    messagebus.add_listener(DummyEvent, listen_event_order)
+    ret = await messagebus.handle_batch(
+        [DummyEvent(id="a", increment=0), DummyEvent(id="b", increment=0)],
+        FakeUnitOfWorkWithDummyEvents(),
+    )
+    assert ret is None
+    assert handled == ["a", "b", "c"]
+
+
+async def test_messagebus_dispatch_to_base_event_listeners(messagebus):
+    handled = []
+
+    async def listen_any_event(evt: Event, uow):
+        handled.append(("any", evt.id))
+
+    async def listen_dummy_event(evt: DummyEvent, uow):
+        handled.append(("dummy", evt.id))
+
+    messagebus.add_listener(Event, listen_any_event)
+    messagebus.add_listener(DummyEvent, listen_dummy_event)
+    uow = FakeUnitOfWorkWithDummyEvents()
+    await messagebus.handle(DummyEvent(id="a", increment=0), uow)
+    assert handled == [("dummy", "a"), ("any", "a")]
+    assert messagebus.dispatch_plans == {
+        DummyEvent: (False, (listen_dummy_event, listen_any_event)),
+    }
+
+    messagebus.remove_listener(DummyEvent, listen_dummy_event)
+    assert messagebus.dispatch_plans == {}
+    handled.clear()
+    await messagebus.handle(DummyEvent(id="b", increment=0), uow)
+    assert handled == [("any", "b")]
+
+
+async def test_messagebus_dispatch_unregistered_command(messagebus):
+    ret = await messagebus.handle(DummyCommand(id=""), FakeUnitOfWorkWithDummyEvents())
+    assert ret is None
+    assert messagebus.dispatch_plans == {DummyCommand: (True, ())}
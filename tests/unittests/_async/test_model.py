@@ -1,12 +1,27 @@
 import pytest
 
+from purgatory.domain.clock import coarse_monotonic, monotonic
 from purgatory.domain.messages.events import (
     CircuitBreakerFailed,
     CircuitBreakerRecovered,
     ContextChanged,
 )
-from purgatory.domain.model import ClosedState, Context, OpenedState
-from tests.unittests.time import AsyncSleep
+from purgatory.domain.model import (
+    HALF_OPENED_STATE,
+    Backoff,
+    Bulkhead,
+    BulkheadFullError,
+    ClosedState,
+    Context,
+    CountWindow,
+    ExceptionClassifier,
+    FailureRatePolicy,
+    HalfOpenedState,
+    OpenedState,
+    SlowCallError,
+    TimeWindow,
+)
+from tests.unittests.time import VirtualClock
 
 
 def test_circuitbreaker_open_raise():
@@ -23,14 +38,21 @@ def test_circuitbreaker_open_raise():
 
 
 async def test_circuitbreaker_open_closed_after_ttl_passed():
-    context = Context("my", threshold=5, ttl=0.1)
-    state = OpenedState("my")
+    clock = VirtualClock()
+    context = Context(
+        "my", threshold=5, ttl=0.1, clock=clock.monotonic, wall_clock=clock.time
+    )
+    state = OpenedState("my", clock.time())
     context.set_state(state)
     assert context.messages == [
         ContextChanged(name="my", state="opened", opened_at=state.opened_at),
     ]
     context.messages.clear()
-    await AsyncSleep(0.1)
+    await clock.AsyncSleep(0.05)
+    with pytest.raises(OpenedState):
+        with context:
+            pass
+    await clock.AsyncSleep(0.06)
 
     count = 0
     with context:
@@ -45,10 +67,13 @@ async def test_circuitbreaker_open_closed_after_ttl_passed():
 
 
 async def test_circuitbreaker_open_reopened_after_ttl_passed():
-    context = Context("my", threshold=5, ttl=0.1)
-    state = OpenedState("my")
+    clock = VirtualClock()
+    context = Context(
+        "my", threshold=5, ttl=0.1, clock=clock.monotonic, wall_clock=clock.time
+    )
+    state = OpenedState("my", clock.time())
     context.set_state(state)
-    await AsyncSleep(0.1)
+    await clock.AsyncSleep(0.11)
 
     try:
         with context:
@@ -186,3 +211,404 @@ def test_circuitbreaker_can_exclude_function():
 
     assert context.messages == [CircuitBreakerFailed(name="my", failure_count=1)]
     assert context.failure_count == 1
+
+
+def test_exception_classifier():
+    class HTTPError(Exception):
+        def __init__(self, status_code) -> None:
+            super().__init__(f"{status_code} Error")
+            self.status_code = status_code
+
+    class NotFound(HTTPError):
+        def __init__(self) -> None:
+            super().__init__(404)
+
+    calls = []
+
+    def is_client_error(exc):
+        calls.append(exc)
+        return exc.status_code < 500
+
+    classifier = ExceptionClassifier(
+        [KeyError, (HTTPError, is_client_error), LookupError]
+    )
+    assert classifier.is_failure(RuntimeError()) is True
+    assert classifier.is_failure(KeyError()) is False
+    assert classifier.is_failure(IndexError()) is False
+    assert calls == []
+
+    assert classifier.is_failure(HTTPError(503)) is True
+    assert classifier.is_failure(HTTPError(400)) is False
+    assert classifier.is_failure(NotFound()) is False
+    assert len(calls) == 3
+
+    assert classifier.decisions == {
+        RuntimeError: True,
+        KeyError: False,
+        IndexError: False,
+        HTTPError: is_client_error,
+        NotFound: is_client_error,
+    }
+
+
+def test_context_exclude_list():
+    context = Context("my", threshold=5, ttl=1)
+    assert context.exclude_list == []
+    context.exclude_list = [ValueError]
+    assert context.exclude_list == [ValueError]
+    assert context.classifier.is_failure(ValueError()) is False
+
+
+@pytest.mark.parametrize("state", ["closed", "opened", "half-opened"])
+def test_context_is_slotted(state):
+    context = Context("my", threshold=5, ttl=1, state=state)
+    assert not hasattr(context, "__dict__")
+    if state != "opened":
+        assert not hasattr(context._state, "__dict__")
+
+
+def test_half_opened_state_is_shared():
+    context = Context("my", threshold=5, ttl=1, state="half-opened")
+    context2 = Context("my2", threshold=5, ttl=1, state="half-opened")
+    assert context._state is HALF_OPENED_STATE
+    assert context2._state is HALF_OPENED_STATE
+    assert context._state == HalfOpenedState()
+    assert context.failure_count == 0
+
+
+def test_context_pop_messages():
+    context = Context("my", threshold=5, ttl=1)
+    assert context.pop_messages() == ()
+    try:
+        with context:
+            raise RuntimeError("Boom")
+    except RuntimeError:
+        pass
+    assert context.pop_messages() == [CircuitBreakerFailed(name="my", failure_count=1)]
+    assert context.pop_messages() == ()
+
+
+def test_context_call_events():
+    clock = VirtualClock()
+    context = Context(
+        "my", threshold=1, ttl=10, clock=clock.monotonic, wall_clock=clock.time
+    )
+    assert context.new_call() == ()
+    assert context.end_call() == ()
+    assert context.end_call(RuntimeError("Boom")) == [
+        CircuitBreakerFailed(name="my", failure_count=1),
+        ContextChanged(name="my", state="opened", opened_at=clock.time()),
+    ]
+    with pytest.raises(OpenedState):
+        context.new_call()
+    clock.SyncSleep(11)
+    assert context.new_call() == [
+        ContextChanged(name="my", state="half-opened", opened_at=None),
+    ]
+    assert context.end_call(duration=1) == [
+        CircuitBreakerRecovered(name="my"),
+        ContextChanged(name="my", state="closed", opened_at=None),
+    ]
+    assert context.messages == []
+
+
+def test_context_call_events_are_not_shared():
+    context = Context("my", threshold=5, ttl=10)
+    try:
+        with context:
+            raise RuntimeError("Boom")
+    except RuntimeError:
+        pass
+    # the events of a call are not mixed with the messages of the context
+    assert context.end_call(RuntimeError("Boom")) == [
+        CircuitBreakerFailed(name="my", failure_count=2)
+    ]
+    assert context.end_call() == [CircuitBreakerRecovered(name="my")]
+    assert context.pop_messages() == [CircuitBreakerFailed(name="my", failure_count=1)]
+
+
+def test_count_window():
+    window = CountWindow(4, failure_rate=0.5, minimum_calls=3)
+    assert window.record_failure() is False
+    window.record_success()
+    assert (window.calls, window.failures) == (2, 1)
+    assert window.record_failure() is True
+
+    window.record_success()
+    window.record_success()
+    window.record_success()
+    # the ring buffer only keeps the last 4 calls
+    assert (window.calls, window.failures) == (4, 1)
+    assert window.record_failure() is False
+    assert (window.calls, window.failures) == (4, 1)
+    assert window.record_failure() is True
+    assert (window.calls, window.failures) == (4, 2)
+
+    window.reset()
+    assert (window.calls, window.failures) == (0, 0)
+    assert window.outcomes == bytearray(4)
+
+
+def test_time_window():
+    now = [100.0]
+    window = TimeWindow(
+        10, failure_rate=0.5, minimum_calls=2, buckets=5, clock=lambda: now[0]
+    )
+    assert window.record_failure() is False
+    now[0] += 3
+    window.record_success()
+    assert (window.calls, window.failures) == (2, 1)
+
+    now[0] += 8
+    # the failure is older than 10 seconds, its bucket is dropped
+    window.record_success()
+    assert (window.calls, window.failures) == (2, 0)
+
+    now[0] += 60
+    assert window.record_failure() is False
+    assert (window.calls, window.failures) == (1, 1)
+    assert window.record_failure() is True
+
+    window.reset()
+    assert (window.calls, window.failures) == (0, 0)
+
+
+def test_failure_rate_policy():
+    window = FailureRatePolicy(window_size=20).create_window()
+    assert isinstance(window, CountWindow)
+    assert window.size == 20
+    window = FailureRatePolicy(window_duration=60, buckets=6).create_window()
+    assert isinstance(window, TimeWindow)
+    assert window.bucket_width == 10
+    assert repr(FailureRatePolicy(0.2, 5, window_duration=30)) == (
+        "FailureRatePolicy(failure_rate=0.2, minimum_calls=5, window_duration=30)"
+    )
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"failure_rate": 0},
+        {"failure_rate": 1.5},
+        {"minimum_calls": 0},
+        {"window_size": 0},
+        {"window_duration": 0},
+        {"minimum_calls": 20, "window_size": 10},
+    ],
+)
+def test_failure_rate_policy_validation(params):
+    with pytest.raises(ValueError):
+        FailureRatePolicy(**params)
+    # the time window is not limited in size
+    FailureRatePolicy(minimum_calls=200, window_duration=60)
+
+
+def test_context_open_on_failure_rate():
+    context = Context("my", threshold=2, ttl=42)
+    context.window = CountWindow(10, failure_rate=0.7, minimum_calls=4)
+    for _ in range(3):
+        try:
+            with context:
+                raise RuntimeError("Boom")
+        except RuntimeError:
+            pass
+        with context:
+            pass
+    assert (context.window.calls, context.window.failures) == (6, 3)
+
+    for _ in range(3):
+        try:
+            with context:
+                raise RuntimeError("Boom")
+        except RuntimeError:
+            pass
+    # the threshold of consecutive failures is not used
+    assert context.state == "closed"
+    assert context.failure_count == 3
+
+    try:
+        with context:
+            raise RuntimeError("Boom")
+    except RuntimeError:
+        pass
+    assert context.state == "opened"
+    assert context.window.calls == 0
+
+
+def test_context_slow_call():
+    context = Context("my", threshold=2, ttl=42)
+    context.handle_end_request(10)
+    assert context.messages == []
+
+    context.slow_call_duration = 1
+    context.handle_end_request(0.5)
+    context.handle_end_request()
+    assert context.messages == []
+
+    context.handle_end_request(1.5)
+    assert context.pop_messages() == [CircuitBreakerFailed(name="my", failure_count=1)]
+    context.handle_end_request(1.5)
+    assert context.state == "opened"
+
+
+def test_context_slow_call_reopen_half_opened():
+    context = Context("my", threshold=2, ttl=42, state="half-opened")
+    context.slow_call_duration = 1
+    context.handle_end_request(2)
+    assert context.state == "opened"
+
+
+def test_slow_call_error():
+    err = SlowCallError("my", 1.23456)
+    assert str(err) == "Call of circuit my took 1.235s"
+    assert err.duration == 1.23456
+
+
+def test_opened_state_uses_monotonic_clock():
+    clock = VirtualClock()
+    context = Context(
+        "my",
+        threshold=5,
+        ttl=10,
+        state="opened",
+        # loaded from a repository, opened by another process 5 seconds ago
+        opened_at=clock.time() - 5,
+        clock=clock.monotonic,
+        wall_clock=clock.time,
+    )
+    with pytest.raises(OpenedState):
+        context.handle_new_request()
+    assert context._state.closed_at == pytest.approx(clock.monotonic() + 5)
+
+    # the system time is updated, the circuit is still opened for 5 seconds
+    clock.started_at += 3600
+    with pytest.raises(OpenedState):
+        context.handle_new_request()
+    clock.SyncSleep(5.1)
+    context.handle_new_request()
+    assert context.state == "half-opened"
+
+
+def test_context_open():
+    clock = VirtualClock()
+    context = Context(
+        "my", threshold=5, ttl=10, clock=clock.monotonic, wall_clock=clock.time
+    )
+    context.open()
+    assert context._state == OpenedState("my", clock.time())
+    assert context._state.closed_at == clock.monotonic() + 10
+    assert context.messages == [
+        ContextChanged(name="my", state="opened", opened_at=clock.time()),
+    ]
+
+
+def test_clocks():
+    assert monotonic() <= monotonic()
+    now = coarse_monotonic()
+    assert now == pytest.approx(monotonic(), abs=0.1)
+    assert now <= coarse_monotonic()
+
+
+def test_backoff_duration():
+    backoff = Backoff(factor=2, max_ttl=100, jitter=0)
+    assert [backoff.duration(10, count) for count in range(6)] == [
+        10,
+        10,
+        20,
+        40,
+        80,
+        100,
+    ]
+    assert backoff.duration(10, 10_000) == 100
+    assert Backoff(max_ttl=1, jitter=0).duration(10, 3) == 10
+    assert repr(backoff) == "Backoff(factor=2, max_ttl=100, jitter=0)"
+
+
+def test_backoff_jitter():
+    backoff = Backoff(factor=2, max_ttl=100, jitter=0.5)
+    assert 1 <= backoff.spread <= 1.5
+    assert backoff.duration(10, 1) == 10 * backoff.spread
+    assert backoff.duration(10, 1) == backoff.duration(10, 1)
+
+
+@pytest.mark.parametrize("params", [{"factor": 0.5}, {"jitter": -1}, {"jitter": 2}])
+def test_backoff_validation(params):
+    with pytest.raises(ValueError):
+        Backoff(**params)
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"max_calls": 0},
+        {"max_calls": 1, "max_queued": -1},
+        {"max_calls": 1, "max_wait": -1},
+    ],
+)
+def test_bulkhead_validation(params):
+    with pytest.raises(ValueError):
+        Bulkhead(**params)
+
+
+def test_bulkhead_repr():
+    assert repr(Bulkhead(4, max_queued=2, max_wait=0.5)) == (
+        "Bulkhead(max_calls=4, max_queued=2, max_wait=0.5)"
+    )
+    err = BulkheadFullError("my", 4)
+    assert str(err) == "Circuit my has reached its 4 calls in flight"
+    assert (err.circuit_name, err.max_calls) == ("my", 4)
+
+
+def test_context_backoff():
+    clock = VirtualClock()
+    context = Context(
+        "my", threshold=1, ttl=10, clock=clock.monotonic, wall_clock=clock.time
+    )
+    context.backoff = Backoff(factor=3, max_ttl=50, jitter=0)
+
+    def fail():
+        try:
+            with context:
+                raise RuntimeError("Boom")
+        except RuntimeError:
+            pass
+
+    fail()
+    assert context.open_count == 1
+    assert context._state.closed_at == clock.monotonic() + 10
+
+    clock.SyncSleep(10.1)
+    fail()
+    assert context.open_count == 2
+    assert context._state.closed_at == clock.monotonic() + 30
+
+    clock.SyncSleep(30.1)
+    fail()
+    assert context.open_count == 3
+    assert context._state.closed_at == clock.monotonic() + 50
+
+    clock.SyncSleep(50.1)
+    with context:
+        pass
+    assert context.state == "closed"
+    assert context.open_count == 0
+
+
+def test_context_backoff_loaded():
+    clock = VirtualClock()
+    context = Context(
+        "my",
+        threshold=1,
+        ttl=10,
+        state="opened",
+        opened_at=clock.time() - 15,
+        clock=clock.monotonic,
+        wall_clock=clock.time,
+        open_count=2,
+    )
+    context.backoff = Backoff(factor=2, jitter=0)
+    with pytest.raises(OpenedState):
+        context.handle_new_request()
+    clock.SyncSleep(5.1)
+    context.handle_new_request()
+    assert context.state == "half-opened"
@@ -1,25 +1,37 @@
+import json
 import time
+from typing import cast
 
 import pytest
 
-from purgatory.domain.model import Context
+from purgatory.domain.model import ClosedState, Context
 from purgatory.service._async.repository import (
+    AsyncCachedRepository,
     AsyncInMemoryRepository,
     AsyncRedisRepository,
+    AsyncSharedMemoryRepository,
+    AsyncSqliteRepository,
+    ConfigurationError,
 )
+from purgatory.service._shm import SEQ
 
 
-@pytest.mark.parametrize("repository", ["inmemory", "redis"])
+@pytest.mark.parametrize("repository", ["inmemory", "redis", "shm", "sqlite"])
 @pytest.mark.parametrize("state", ["half-opened", "opened", "closed"])
 async def test_redis_respository_state_recovery(
     state,
     repository,
     inmemory_repository: AsyncInMemoryRepository,
     redis_repository: AsyncRedisRepository,
+    shm_repository: AsyncSharedMemoryRepository,
+    sqlite_repository: AsyncSqliteRepository,
 ):
-    repository = {"inmemory": inmemory_repository, "redis": redis_repository}[
-        repository
-    ]
+    repository = {
+        "inmemory": inmemory_repository,
+        "redis": redis_repository,
+        "shm": shm_repository,
+        "sqlite": sqlite_repository,
+    }[repository]
     context = Context("foo", 40, 10, state)
     await repository.initialize()
     await repository.register(context)
@@ -27,15 +39,21 @@ async def test_redis_respository_state_recovery(
     assert context2 == context
 
 
-@pytest.mark.parametrize("repository", ["redis"])
+@pytest.mark.parametrize("repository", ["redis", "shm", "sqlite"])
 async def test_redis_respository_workflow(
     repository,
     # the in memory repository works update its state in the model,
     # and does not affect the repository
     # inmemory_repository: AsyncInMemoryRepository,
     redis_repository: AsyncRedisRepository,
+    shm_repository: AsyncSharedMemoryRepository,
+    sqlite_repository: AsyncSqliteRepository,
 ):
-    repository = {"redis": redis_repository}[repository]
+    repository = {
+        "redis": redis_repository,
+        "shm": shm_repository,
+        "sqlite": sqlite_repository,
+    }[repository]
 
     breaker = Context("foo", 40, 10)
     await repository.initialize()
@@ -66,3 +84,771 @@ async def test_redis_respository_workflow(
     await repository.update_state("foo", state="closed", opened_at=None)
     breaker = await repository.get("foo")
     assert breaker.opened_at is None
+
+
+async def test_cached_repository_read_through(
+    fake_redis, cached_redis_repository: AsyncCachedRepository
+):
+    repository = cached_redis_repository
+    await repository.initialize()
+    assert await repository.get("foo") is None
+
+    await repository.register(Context("foo", 40, 10))
+    breaker = await repository.get("foo")
+    assert breaker is not None
+    fake_redis.storage.clear()
+    assert await repository.get("foo") is breaker
+
+    repository.invalidate("foo")
+    assert await repository.get("foo") is None
+
+
+async def test_cached_repository_expires(redis_repository: AsyncRedisRepository, clock):
+    repository = AsyncCachedRepository(
+        redis_repository, max_age=10, clock=clock.monotonic
+    )
+    await repository.initialize()
+    await repository.register(Context("foo", 40, 10))
+    breaker = await repository.get("foo")
+    await clock.AsyncSleep(9)
+    assert await repository.get("foo") is breaker
+    assert await repository.get_many(["foo"]) == {"foo": breaker}
+    await clock.AsyncSleep(2)
+    breaker2 = await repository.get("foo")
+    assert breaker == breaker2
+    assert breaker is not breaker2
+
+
+async def test_cached_repository_invalidate_on_state_change(
+    cached_redis_repository: AsyncCachedRepository,
+):
+    repository = cached_redis_repository
+    await repository.initialize()
+    await repository.register(Context("foo", 40, 10))
+    await repository.register(Context("bar", 40, 10))
+
+    await repository.inc_failures("foo", 1)
+    breaker = await repository.get("foo")
+    assert breaker.failure_count == 0
+
+    opened_at = time.time()
+    await repository.update_state("foo", state="opened", opened_at=opened_at)
+    breaker = await repository.get("foo")
+    assert breaker.state == "opened"
+    assert breaker.opened_at == opened_at
+    assert breaker.failure_count == 1
+
+    await repository.reset_failure("foo")
+    assert (await repository.get("foo")).failure_count == 1
+
+    repository.invalidate()
+    assert repository.cache == {}
+    assert (await repository.get("foo")).failure_count == 0
+
+
+async def test_redis_repository_single_round_trips(
+    fake_redis, redis_repository: AsyncRedisRepository
+):
+    await redis_repository.initialize()
+    await redis_repository.register(Context("foo", 40, 10))
+    assert fake_redis.round_trips == 1
+
+    await redis_repository.get("foo")
+    assert fake_redis.round_trips == 2
+
+    await redis_repository.update_state("foo", state="opened", opened_at=42.0)
+    assert fake_redis.round_trips == 3
+
+    await redis_repository.inc_failures("foo", 1)
+    assert fake_redis.round_trips == 4
+
+    assert fake_redis.storage == {
+        "cbrh::foo": {
+            "name": "foo",
+            "threshold": "40",
+            "ttl": "10",
+            "state": "opened",
+            "opened_at": "42.0",
+            "failure_count": "1",
+            "open_count": "1",
+        }
+    }
+
+
+async def test_redis_repository_migrate_legacy_layout(
+    fake_redis, redis_repository: AsyncRedisRepository
+):
+    await redis_repository.initialize()
+    fake_redis.storage["cbr::foo"] = json.dumps(
+        {
+            "name": "foo",
+            "threshold": 40,
+            "ttl": 10,
+            "state": "opened",
+            "opened_at": 42.0,
+        }
+    )
+    fake_redis.storage["cbr::foo::failure_count"] = 3
+
+    breaker = await redis_repository.get("foo")
+    assert breaker == Context("foo", 40, 10)
+    assert breaker.state == "opened"
+    assert breaker.opened_at == 42.0
+    assert breaker.failure_count == 3
+    assert fake_redis.storage["cbrh::foo"] == {
+        "name": "foo",
+        "threshold": "40",
+        "ttl": "10",
+        "state": "opened",
+        "opened_at": "42.0",
+        "failure_count": "3",
+        "open_count": "0",
+    }
+
+    round_trips = fake_redis.round_trips
+    assert await redis_repository.get("foo") == breaker
+    assert fake_redis.round_trips == round_trips + 1
+
+    assert await redis_repository.get("bar") is None
+    redis_repository.legacy_prefix = None
+    fake_redis.storage.pop("cbrh::foo")
+    assert await redis_repository.get("foo") is None
+
+
+async def test_redis_repository_migrate_legacy_layout_at_once(
+    fake_redis, redis_repository: AsyncRedisRepository
+):
+    await redis_repository.initialize()
+    for name in ("foo", "bar"):
+        fake_redis.storage[f"cbr::{name}"] = json.dumps(
+            {"name": name, "threshold": 40, "ttl": 10, "state": "closed"}
+        )
+    fake_redis.storage["cbr::bar::failure_count"] = 2
+
+    round_trips = fake_redis.round_trips
+    breakers = await redis_repository.get_many(["foo", "bar", "baz"])
+    # the hashes, the legacy layout, and the migrated hashes
+    assert fake_redis.round_trips == round_trips + 3
+    assert set(breakers) == {"foo", "bar"}
+    assert breakers["bar"].failure_count == 2
+    assert fake_redis.storage["cbrh::bar"]["failure_count"] == "2"
+    assert "cbrh::baz" not in fake_redis.storage
+
+
+async def test_atomic_redis_repository_record_failure(
+    fake_redis, atomic_redis_repository: AsyncRedisRepository
+):
+    repository = atomic_redis_repository
+    await repository.initialize()
+    assert await repository.record_failure("foo") is None
+
+    await repository.register(Context("foo", 3, 10))
+    assert await repository.record_failure("foo") == "closed"
+    assert await repository.record_failure("foo") == "closed"
+    round_trips = fake_redis.round_trips
+    assert await repository.record_failure("foo") == "opened"
+    assert fake_redis.round_trips == round_trips + 1
+
+    breaker = await repository.get("foo")
+    assert breaker.state == "opened"
+    assert breaker.failure_count == 3
+    assert breaker.opened_at == pytest.approx(time.time(), abs=1)
+
+    assert await repository.record_success("foo") == "opened"
+
+
+async def test_atomic_redis_repository_open(
+    atomic_redis_repository: AsyncRedisRepository,
+):
+    repository = atomic_redis_repository
+    await repository.initialize()
+    await repository.register(Context("foo", 2, 10))
+    assert await repository.open("foo", 42.0) == "closed"
+
+    await repository.register(Context("foo", 2, 10, failure_count=2))
+    assert await repository.open("foo", 42.0) == "opened"
+    assert (await repository.get("foo")).opened_at == 42.0
+    assert await repository.open("foo", 43.0) == "opened"
+    assert (await repository.get("foo")).opened_at == 42.0
+
+    await repository.register(Context("foo", 2, 10, state="half-opened"))
+    assert await repository.open("foo", 44.0) == "opened"
+    assert (await repository.get("foo")).opened_at == 44.0
+
+
+async def test_atomic_redis_repository_try_half_open(
+    atomic_redis_repository: AsyncRedisRepository,
+):
+    repository = atomic_redis_repository
+    await repository.initialize()
+    await repository.register(
+        Context("foo", 2, 10, state="opened", opened_at=time.time())
+    )
+    assert await repository.try_half_open("foo") == "opened"
+
+    await repository.register(
+        Context("foo", 2, 10, state="opened", opened_at=time.time() - 11)
+    )
+    assert await repository.try_half_open("foo") == "half-opened"
+    breaker = await repository.get("foo")
+    assert breaker.state == "half-opened"
+    assert breaker.opened_at is None
+    assert await repository.try_half_open("foo") == "half-opened"
+
+    assert await repository.record_success("foo") == "closed"
+    breaker = await repository.get("foo")
+    assert breaker.state == "closed"
+    assert breaker.failure_count == 0
+
+
+async def test_atomic_redis_repository_workflow(
+    fake_redis, atomic_redis_repository: AsyncRedisRepository
+):
+    repository = atomic_redis_repository
+    await repository.initialize()
+    await repository.register(Context("foo", 2, 0.1))
+    round_trips = fake_redis.round_trips
+
+    await repository.inc_failures("foo", 1)
+    await repository.update_state("foo", state="opened", opened_at=time.time())
+    assert (await repository.get("foo")).state == "closed"
+
+    await repository.inc_failures("foo", 2)
+    await repository.update_state("foo", state="opened", opened_at=time.time())
+    assert (await repository.get("foo")).state == "opened"
+
+    await repository.update_state("foo", state="half-opened", opened_at=None)
+    assert (await repository.get("foo")).state == "opened"
+
+    fake_redis.storage["cbrh::foo"]["opened_at"] = str(time.time() - 1)
+    await repository.update_state("foo", state="half-opened", opened_at=None)
+    assert (await repository.get("foo")).state == "half-opened"
+
+    await repository.reset_failure("foo")
+    await repository.update_state("foo", state="closed", opened_at=None)
+    breaker = await repository.get("foo")
+    assert breaker.state == "closed"
+    assert breaker.failure_count == 0
+    assert fake_redis.round_trips == round_trips + 13
+
+
+@pytest.mark.parametrize("repository", ["inmemory", "redis", "cached"])
+async def test_repository_probes(
+    repository,
+    inmemory_repository: AsyncInMemoryRepository,
+    redis_repository: AsyncRedisRepository,
+    cached_redis_repository: AsyncCachedRepository,
+):
+    repository = {
+        "inmemory": inmemory_repository,
+        "redis": redis_repository,
+        "cached": cached_redis_repository,
+    }[repository]
+    await repository.initialize()
+    await repository.register(Context("foo", 2, 10, "half-opened"))
+    assert await repository.acquire_probe("foo", 2, 10) is True
+    assert await repository.acquire_probe("foo", 2, 10) is True
+    assert await repository.acquire_probe("foo", 2, 10) is False
+    await repository.release_probe("foo")
+    assert await repository.acquire_probe("foo", 2, 10) is True
+    await repository.release_probe("foo")
+    await repository.release_probe("foo")
+    await repository.release_probe("foo")
+    assert await repository.acquire_probe("foo", 1, 10) is True
+    assert await repository.acquire_probe("foo", 1, 10) is False
+
+
+async def test_redis_repository_probes_lease(
+    fake_redis, redis_repository: AsyncRedisRepository
+):
+    repository = redis_repository
+    await repository.initialize()
+    await repository.register(Context("foo", 2, 10, "half-opened"))
+    assert await repository.acquire_probe("foo", 1, 10) is True
+    assert fake_redis.storage["cbrh::foo"]["probes"] == "1"
+    assert await repository.acquire_probe("foo", 1, 10) is False
+
+    # the process of the probe died without releasing it
+    fake_redis.storage["cbrh::foo"]["probed_at"] = str(time.time() - 11)
+    assert await repository.acquire_probe("foo", 1, 10) is True
+    assert fake_redis.storage["cbrh::foo"]["probes"] == "1"
+
+
+async def test_inmemory_repository_probes_lease(clock):
+    repository = AsyncInMemoryRepository(clock=clock.monotonic)
+    await repository.register(Context("foo", 2, 10, "half-opened"))
+    assert await repository.acquire_probe("foo", 1, 10) is True
+    assert await repository.acquire_probe("foo", 1, 10) is False
+
+    # the call of the probe never released it
+    await clock.AsyncSleep(11)
+    assert await repository.acquire_probe("foo", 1, 10) is True
+    assert repository.probes == {"foo": 1}
+    await repository.release_probe("foo")
+    assert repository.probes == {}
+    assert repository.probed_at == {}
+
+
+@pytest.mark.parametrize("atomic", [False, True])
+async def test_redis_repository_open_count(
+    atomic,
+    fake_redis,
+    redis_repository: AsyncRedisRepository,
+    atomic_redis_repository: AsyncRedisRepository,
+):
+    repository = atomic_redis_repository if atomic else redis_repository
+    await repository.initialize()
+    await repository.register(Context("foo", 1, 0.1))
+
+    await repository.inc_failures("foo", 1)
+    await repository.update_state("foo", state="opened", opened_at=time.time())
+    assert (await repository.get("foo")).open_count == 1
+
+    fake_redis.storage["cbrh::foo"]["opened_at"] = str(time.time() - 1)
+    await repository.update_state("foo", state="half-opened", opened_at=None)
+    await repository.update_state("foo", state="opened", opened_at=time.time())
+    assert (await repository.get("foo")).open_count == 2
+
+    fake_redis.storage["cbrh::foo"]["opened_at"] = str(time.time() - 1)
+    await repository.update_state("foo", state="half-opened", opened_at=None)
+    await repository.update_state("foo", state="closed", opened_at=None)
+    breaker = await repository.get("foo")
+    assert breaker.state == "closed"
+    assert breaker.open_count == 0
+
+
+async def test_redis_repository_write_behind(
+    fake_redis, write_behind_redis_repository: AsyncRedisRepository
+):
+    repository = write_behind_redis_repository
+    await repository.initialize()
+    await repository.register(Context("foo", 10, 10))
+    round_trips = fake_redis.round_trips
+
+    await repository.inc_failures("foo", 1)
+    await repository.inc_failures("foo", 2)
+    assert fake_redis.round_trips == round_trips
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "0"
+    # the pending failures of the process are loaded with the context
+    assert (await repository.get("foo")).failure_count == 2
+
+    await repository.reset_failure("foo")
+    await repository.inc_failures("foo", 1)
+    assert repository.pending == {"foo": (True, 1)}
+    assert (await repository.get("foo")).failure_count == 1
+    round_trips = fake_redis.round_trips
+
+    await repository.flush()
+    assert fake_redis.round_trips == round_trips + 1
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "1"
+    assert repository.pending == {}
+    await repository.flush()
+    assert fake_redis.round_trips == round_trips + 1
+
+
+async def test_redis_repository_write_behind_flush_size(
+    fake_redis, write_behind_redis_repository: AsyncRedisRepository
+):
+    repository = write_behind_redis_repository
+    await repository.initialize()
+    await repository.register(Context("foo", 10, 10))
+    await repository.register(Context("bar", 10, 10))
+    round_trips = fake_redis.round_trips
+    for _ in range(2):
+        await repository.inc_failures("foo", 1)
+        await repository.inc_failures("bar", 1)
+    assert fake_redis.round_trips == round_trips
+    await repository.inc_failures("foo", 1)
+    assert fake_redis.round_trips == round_trips + 1
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "3"
+    assert fake_redis.storage["cbrh::bar"]["failure_count"] == "2"
+
+
+async def test_redis_repository_write_behind_flush_interval(
+    fake_redis, write_behind_redis_repository: AsyncRedisRepository
+):
+    repository = write_behind_redis_repository
+    await repository.initialize()
+    await repository.register(Context("foo", 10, 10))
+    await repository.inc_failures("foo", 1)
+    assert repository.pending == {"foo": (False, 1)}
+    # the timer is armed by the first pending update
+    timer = repository.timer.timer
+    assert timer is not None
+    await repository.inc_failures("foo", 1)
+    assert repository.timer.timer is timer
+    await repository.flush()
+    assert repository.timer.timer is None
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "2"
+
+
+async def test_redis_repository_write_behind_state_transition(
+    fake_redis, write_behind_redis_repository: AsyncRedisRepository
+):
+    repository = write_behind_redis_repository
+    await repository.initialize()
+    await repository.register(Context("foo", 2, 10))
+    await repository.register(Context("bar", 2, 10))
+    await repository.inc_failures("bar", 1)
+    await repository.inc_failures("foo", 1)
+    await repository.inc_failures("foo", 2)
+    round_trips = fake_redis.round_trips
+
+    await repository.update_state("foo", "opened", 42.0)
+    assert fake_redis.round_trips == round_trips + 1
+    assert fake_redis.storage["cbrh::foo"]["state"] == "opened"
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "2"
+    assert fake_redis.storage["cbrh::bar"]["failure_count"] == "1"
+
+    await repository.reset_failure("foo")
+    await repository.update_state("foo", "closed", None)
+    assert fake_redis.round_trips == round_trips + 2
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "0"
+
+
+def test_redis_repository_write_behind_is_not_atomic():
+    with pytest.raises(ConfigurationError):
+        AsyncRedisRepository("redis://localhost", atomic=True, write_behind=True)
+
+
+def test_redis_repository_requires_a_client():
+    with pytest.raises(ConfigurationError):
+        AsyncRedisRepository()
+
+
+def test_redis_repository_client_is_lazy():
+    repository = AsyncRedisRepository("redis://localhost/1")
+    assert repository._redis is None
+    client = repository.redis
+    assert repository.redis is client
+
+
+def test_redis_repository_share_the_pool_of_the_url():
+    repository = AsyncRedisRepository("redis://localhost/2")
+    other = AsyncRedisRepository("redis://localhost/2")
+    assert repository.redis is other.redis
+    assert repository._redis is None
+
+    sized = AsyncRedisRepository("redis://localhost/2", max_connections=4)
+    assert sized.redis.connection_pool is not repository.redis.connection_pool
+    assert sized.redis.connection_pool.max_connections == 4
+
+    another_db = AsyncRedisRepository("redis://localhost/3")
+    assert another_db.redis.connection_pool is not repository.redis.connection_pool
+
+
+def test_redis_repository_use_the_given_pool():
+    pool = AsyncRedisRepository("redis://localhost/4").redis.connection_pool
+    repository = AsyncRedisRepository(connection_pool=pool)
+    assert repository.redis.connection_pool is pool
+
+
+def test_redis_repository_use_the_given_client(fake_redis):
+    repository = AsyncRedisRepository(client=fake_redis)
+    assert repository.redis is fake_redis
+
+
+async def test_inmemory_repository_get_many(
+    inmemory_repository: AsyncInMemoryRepository,
+):
+    foo = Context("foo", 40, 10)
+    bar = Context("bar", 40, 10)
+    await inmemory_repository.register(foo)
+    await inmemory_repository.register(bar)
+    assert await inmemory_repository.get_many(["foo", "baz"]) == {"foo": foo}
+    assert await inmemory_repository.get_all() == {"foo": foo, "bar": bar}
+
+
+async def test_redis_repository_get_many_single_round_trip(
+    fake_redis, redis_repository: AsyncRedisRepository
+):
+    redis_repository.legacy_prefix = None
+    await redis_repository.register(Context("foo", 40, 10))
+    await redis_repository.register(Context("bar", 5, 30, open_count=2))
+    round_trips = fake_redis.round_trips
+
+    contexts = await redis_repository.get_many(["foo", "bar", "baz"])
+    assert fake_redis.round_trips == round_trips + 1
+    assert contexts == {
+        "foo": Context("foo", 40, 10),
+        "bar": Context("bar", 5, 30, open_count=2),
+    }
+    assert await redis_repository.get_many([]) == {}
+    assert fake_redis.round_trips == round_trips + 1
+
+
+async def test_redis_repository_get_many_migrate_legacy_layout(
+    fake_redis, redis_repository: AsyncRedisRepository
+):
+    fake_redis.storage["cbr::foo"] = json.dumps(
+        {"name": "foo", "threshold": 7, "ttl": 42, "state": "closed"}
+    )
+    contexts = await redis_repository.get_many(["foo"])
+    assert contexts == {"foo": Context("foo", 7, 42)}
+    assert fake_redis.storage["cbrh::foo"]["threshold"] == "7"
+
+
+async def test_redis_repository_get_all(
+    fake_redis, write_behind_redis_repository: AsyncRedisRepository
+):
+    repository = write_behind_redis_repository
+    await repository.register(Context("foo", 40, 10))
+    await repository.register(Context("bar", 5, 30))
+    fake_redis.storage["cbr::legacy"] = "{}"
+    await repository.inc_failures("bar", 1)
+    round_trips = fake_redis.round_trips
+
+    contexts = await repository.get_all()
+    assert fake_redis.round_trips == round_trips + 2
+    assert contexts == {
+        "foo": Context("foo", 40, 10),
+        "bar": Context("bar", 5, 30, failure_count=1),
+    }
+
+
+async def test_cached_repository_get_many(
+    fake_redis, cached_redis_repository: AsyncCachedRepository
+):
+    repository = cached_redis_repository
+    repository.repository.legacy_prefix = None  # type: ignore
+    await repository.register(Context("foo", 40, 10))
+    await repository.repository.register(Context("bar", 5, 30))
+    round_trips = fake_redis.round_trips
+
+    contexts = await repository.get_many(["foo", "bar", "baz"])
+    assert fake_redis.round_trips == round_trips + 1
+    assert set(contexts) == {"foo", "bar"}
+    assert await repository.get_many(["foo", "bar"]) == contexts
+    assert fake_redis.round_trips == round_trips + 1
+
+    repository.invalidate()
+    assert await repository.get_all() == contexts
+    assert fake_redis.round_trips == round_trips + 3
+    assert set(repository.cache) == {"foo", "bar"}
+
+
+async def test_inmemory_repository_evict_least_recently_used():
+    repository = AsyncInMemoryRepository(max_size=2)
+    assert repository.live_contexts is False
+    await repository.register(Context("foo", 40, 10))
+    await repository.register(Context("bar", 40, 10))
+    await repository.get("foo")
+    await repository.register(Context("baz", 40, 10))
+    assert set(repository.breakers) == {"foo", "baz"}
+    assert repository.size == 2
+    assert repository.evictions == 1
+
+    await repository.get_many(["foo"])
+    await repository.register(Context("qux", 40, 10))
+    assert set(repository.breakers) == {"foo", "qux"}
+    assert repository.evictions == 2
+
+
+async def test_inmemory_repository_never_evict_opened_circuits():
+    repository = AsyncInMemoryRepository(max_size=1)
+    opened = Context("foo", 40, 10, state="opened", opened_at=time.time())
+    half_opened = Context("bar", 40, 10, state="half-opened")
+    await repository.register(opened)
+    await repository.register(half_opened)
+    await repository.register(Context("baz", 40, 10))
+    assert set(repository.breakers) == {"foo", "bar", "baz"}
+    assert repository.evictions == 0
+
+    opened.set_state(ClosedState(0))
+    await repository.register(Context("qux", 40, 10))
+    assert set(repository.breakers) == {"bar", "qux"}
+    assert repository.evictions == 2
+
+
+async def test_inmemory_repository_evict_idle_circuits(clock):
+    repository = AsyncInMemoryRepository(idle_ttl=60, clock=clock.monotonic)
+    await repository.register(Context("foo", 40, 10))
+    await repository.register(Context("bar", 40, 10))
+    await clock.AsyncSleep(30)
+    await repository.get("bar")
+    await clock.AsyncSleep(30)
+    await repository.register(Context("baz", 40, 10))
+    assert set(repository.breakers) == {"bar", "baz"}
+    assert repository.evictions == 1
+
+
+def test_inmemory_repository_max_size():
+    with pytest.raises(ValueError):
+        AsyncInMemoryRepository(max_size=0)
+    assert AsyncInMemoryRepository().live_contexts is True
+
+
+async def test_shm_repository_shared_by_processes(
+    shm_path, shm_repository: AsyncSharedMemoryRepository
+):
+    other = AsyncSharedMemoryRepository(shm_path)
+    assert other.table.capacity == 8
+    await shm_repository.register(Context("foo", 40, 10))
+    assert await other.get("foo") == Context("foo", 40, 10)
+
+    await other.inc_failures("foo", 1)
+    await shm_repository.inc_failures("foo", 2)
+    opened_at = time.time()
+    await other.update_state("foo", "opened", opened_at)
+    assert await shm_repository.get("foo") == Context(
+        "foo", 40, 10, "opened", 2, opened_at, open_count=1
+    )
+
+    await other.register(Context("foo", 5, 30))
+    assert await shm_repository.get("foo") == Context("foo", 5, 30)
+    assert await shm_repository.get("bar") is None
+    await other.update_state("bar", "opened", opened_at)
+    assert await other.get("bar") is None
+    other.table.close()
+
+
+async def test_shm_repository_get_all(shm_repository: AsyncSharedMemoryRepository):
+    await shm_repository.register(Context("foo", 40, 10))
+    await shm_repository.register(Context("bar", 5, 30))
+    assert await shm_repository.get_all() == {
+        "foo": Context("foo", 40, 10),
+        "bar": Context("bar", 5, 30),
+    }
+    assert await shm_repository.get_many(["bar", "baz"]) == {
+        "bar": Context("bar", 5, 30),
+    }
+
+
+async def test_shm_repository_full(shm_repository: AsyncSharedMemoryRepository):
+    for i in range(8):
+        await shm_repository.register(Context(f"circuit{i}", 40, 10))
+    with pytest.raises(ConfigurationError):
+        await shm_repository.register(Context("foo", 40, 10))
+    await shm_repository.register(Context("circuit0", 5, 10))
+    assert len(await shm_repository.get_all()) == 8
+
+    with pytest.raises(ValueError):
+        await shm_repository.register(Context("x" * 256, 40, 10))
+
+
+async def test_shm_repository_invalid_record(
+    shm_repository: AsyncSharedMemoryRepository,
+):
+    with pytest.raises(ValueError):
+        await shm_repository.register(Context("big", 2**31, 30))
+    # the slot is left untouched
+    assert await shm_repository.get("big") is None
+    await shm_repository.register(Context("big", 40, 30))
+    with pytest.raises(ValueError):
+        await shm_repository.register(Context("big", 40, 30, failure_count=2**31))
+    assert await shm_repository.get("big") == Context("big", 40, 30)
+
+
+async def test_shm_repository_stale_write(shm_repository: AsyncSharedMemoryRepository):
+    await shm_repository.register(Context("foo", 40, 10))
+    await shm_repository.register(Context("bar", 40, 10))
+    table = shm_repository.table
+    for name in ("foo", "bar"):
+        # a writer died while writing the record
+        offset = table.offset(cast(int, table.find(name)))
+        SEQ.pack_into(table.buf, offset, SEQ.unpack_from(table.buf, offset)[0] + 1)
+
+    # repaired by the reader
+    assert await shm_repository.get("foo") == Context("foo", 40, 10)
+    # repaired by the writer
+    await shm_repository.inc_failures("bar", 1)
+    assert (await shm_repository.get("bar")).failure_count == 1
+    for name in ("foo", "bar"):
+        offset = table.offset(cast(int, table.find(name)))
+        assert SEQ.unpack_from(table.buf, offset)[0] % 2 == 0
+
+
+def test_shm_repository_invalid_file(tmp_path):
+    path = tmp_path / "purgatory"
+    path.write_bytes(b"x" * 1024)
+    with pytest.raises(ValueError):
+        AsyncSharedMemoryRepository(str(path))
+    with pytest.raises(ValueError):
+        AsyncSharedMemoryRepository(str(tmp_path / "empty"), capacity=0)
+
+
+async def test_shm_repository_probes(shm_repository: AsyncSharedMemoryRepository):
+    await shm_repository.register(Context("foo", 40, 10, "half-opened"))
+    assert await shm_repository.acquire_probe("foo", 1, 10) is True
+    assert await shm_repository.acquire_probe("foo", 1, 10) is False
+    await shm_repository.release_probe("foo")
+    assert await shm_repository.acquire_probe("foo", 1, 10) is True
+    # the lease of the probe expires
+    assert await shm_repository.acquire_probe("foo", 1, -1) is True
+    await shm_repository.release_probe("foo")
+    await shm_repository.release_probe("foo")
+    assert (shm_repository.table.get("foo")).probes == 0
+    assert await shm_repository.acquire_probe("bar", 1, 10) is False
+
+
+async def test_sqlite_repository_batch_failures(
+    sqlite_path, sqlite_repository: AsyncSqliteRepository
+):
+    repository = sqlite_repository
+    other = AsyncSqliteRepository(sqlite_path)
+    await repository.initialize()
+    await repository.register(Context("foo", 40, 10))
+    await repository.register(Context("bar", 40, 10, failure_count=3))
+    await repository.inc_failures("foo", 1)
+    await repository.inc_failures("foo", 2)
+    await repository.reset_failure("bar")
+    await repository.inc_failures("bar", 1)
+    assert (await repository.get("foo")).failure_count == 2
+    assert (await other.get("foo")).failure_count == 0
+    assert (await other.get("bar")).failure_count == 3
+
+    await repository.inc_failures("foo", 3)
+    assert repository.pending == {}
+    assert (await other.get("foo")).failure_count == 3
+    assert (await other.get("bar")).failure_count == 1
+
+    await repository.inc_failures("foo", 4)
+    opened_at = time.time()
+    await repository.update_state("foo", "opened", opened_at)
+    assert await other.get("foo") == Context(
+        "foo", 40, 10, "opened", 4, opened_at, open_count=1
+    )
+    await repository.update_state("foo", "closed", None)
+    assert (await other.get("foo")).open_count == 0
+
+    await repository.inc_failures("bar", 1)
+    await repository.flush()
+    await repository.flush()
+    assert (await other.get("bar")).failure_count == 2
+    other.connection.close()
+
+
+async def test_sqlite_repository_get_many(sqlite_repository: AsyncSqliteRepository):
+    repository = sqlite_repository
+    await repository.register(Context("foo", 40, 10))
+    await repository.register(Context("bar", 5, 30))
+    await repository.inc_failures("bar", 1)
+    assert await repository.get_many(["foo", "bar", "baz"]) == {
+        "foo": Context("foo", 40, 10),
+        "bar": Context("bar", 5, 30, failure_count=1),
+    }
+    assert await repository.get_all() == {
+        "foo": Context("foo", 40, 10),
+        "bar": Context("bar", 5, 30, failure_count=1),
+    }
+    names = [f"circuit{i}" for i in range(1200)]
+    for name in names:
+        await repository.register(Context(name, 40, 10))
+    assert len(await repository.get_many(names)) == 1200
+
+
+async def test_sqlite_repository_probes(sqlite_repository: AsyncSqliteRepository):
+    repository = sqlite_repository
+    await repository.register(Context("foo", 40, 10, "half-opened"))
+    assert await repository.acquire_probe("foo", 1, 10) is True
+    assert await repository.acquire_probe("foo", 1, 10) is False
+    await repository.release_probe("foo")
+    assert await repository.acquire_probe("foo", 2, 10) is True
+    assert await repository.acquire_probe("foo", 2, 10) is True
+    assert await repository.acquire_probe("foo", 2, 10) is False
+    # the lease of the probes expires
+    assert await repository.acquire_probe("foo", 2, -1) is True
+    await repository.release_probe("foo")
+    await repository.release_probe("foo")
+    assert await repository.acquire_probe("foo", 1, 10) is True
+    assert await repository.acquire_probe("bar", 1, 10) is False
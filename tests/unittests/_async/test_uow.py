@@ -1,9 +1,17 @@
 from purgatory.domain.messages.base import Message
-from purgatory.service._async.repository import AsyncInMemoryRepository
+from purgatory.domain.model import Context
+from purgatory.service._async.repository import (
+    AsyncCachedRepository,
+    AsyncInMemoryRepository,
+)
 from purgatory.service._async.unit_of_work import (
     AsyncAbstractUnitOfWork,
+    AsyncCachedUnitOfWork,
     AsyncInMemoryUnitOfWork,
+    AsyncRedisUnitOfWork,
+    AsyncSqliteUnitOfWork,
 )
+from tests.unittests.time import VirtualClock
 
 
 class TrackableUnitOfWork(AsyncAbstractUnitOfWork):
@@ -47,3 +55,69 @@ async def test_uow_is_collecting_events():
     uow.contexts.messages = [a, b, c]
     events = list(uow.collect_new_events())
     assert events == [a, b, c]
+
+
+async def test_cached_uow_delegates_transaction():
+    tracked = TrackableUnitOfWork()
+    clock = VirtualClock()
+    uow = AsyncCachedUnitOfWork(tracked, max_age=5, clock=clock.monotonic)
+    assert isinstance(uow.contexts, AsyncCachedRepository)
+    assert uow.contexts.repository is tracked.contexts
+    assert uow.contexts.max_age == 5
+    assert uow.contexts.clock == clock.monotonic
+    await uow.initialize()
+    try:
+        async with uow:
+            raise RuntimeError("Boom")
+    except RuntimeError:
+        pass
+    assert tracked.rollbacked is True
+    await uow.commit()
+    assert tracked.commited is True
+
+
+async def test_uow_is_collecting_events_raised_while_collecting():
+    uow = AsyncInMemoryUnitOfWork()
+    a = Message()
+    b = Message()
+    uow.contexts.messages = [a]
+    events = []
+    for event in uow.collect_new_events():
+        events.append(event)
+        if event is a:
+            uow.contexts.messages.append(b)
+    assert events == [a, b]
+    assert uow.contexts.messages == []
+
+
+async def test_redis_uow_commit_flush(fake_redis):
+    uow = AsyncRedisUnitOfWork(client=fake_redis, write_behind=True)
+    assert uow.contexts.write_behind is True
+    assert uow.contexts.redis is fake_redis
+    await uow.initialize()
+    await uow.contexts.register(Context("foo", 10, 10))
+    await uow.contexts.inc_failures("foo", 1)
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "0"
+    await uow.commit()
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "1"
+
+
+async def test_bounded_inmemory_uow(clock):
+    uow = AsyncInMemoryUnitOfWork(max_size=10, idle_ttl=60, clock=clock.monotonic)
+    assert uow.contexts.max_size == 10
+    assert uow.contexts.idle_ttl == 60
+    assert uow.contexts.clock == clock.monotonic
+
+
+async def test_sqlite_uow(sqlite_path):
+    uow = AsyncSqliteUnitOfWork(sqlite_path, flush_interval=60)
+    await uow.initialize()
+    await uow.contexts.register(Context("foo", 10, 10))
+    await uow.contexts.inc_failures("foo", 1)
+    other = AsyncSqliteUnitOfWork(sqlite_path, max_age=60)
+    assert (await other.contexts.get("foo")).failure_count == 0
+    await uow.commit()
+    assert (await other.contexts.get("foo")).failure_count == 0
+    other.contexts.invalidate()
+    assert (await other.contexts.get("foo")).failure_count == 1
+    await other.rollback()
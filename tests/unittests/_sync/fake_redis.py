@@ -0,0 +1,143 @@
+"""In process redis, used by the tests and the benchmarks."""
+
+import json
+from fnmatch import fnmatch
+from typing import Any, Optional
+
+from lupa import LuaRuntime
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.commands.clear()
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self):
+        self.redis.round_trips += 1
+        return [
+            self.redis.command(name, *args, **kwargs)
+            for name, args, kwargs in self.commands
+        ]
+
+
+class FakeScript:
+    def __init__(self, redis, script):
+        self.redis = redis
+        self.script = script
+
+    def __call__(self, keys=(), args=(), client=None):
+        self.redis.round_trips += 1
+        return self.redis.command("eval", self.script, keys, args)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.storage = {}
+        self.round_trips = 0
+
+    @property
+    def deserialized_storage(self):
+        return {
+            key: json.loads(val) if isinstance(val, str) else val
+            for key, val in self.storage.items()
+        }
+
+    def command(self, name, *args, **kwargs):
+        return getattr(self, f"do_{name}")(*args, **kwargs)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def register_script(self, script):
+        return FakeScript(self, script)
+
+    def get(self, key) -> Optional[Any]:
+        self.round_trips += 1
+        return self.command("get", key)
+
+    def set(self, key, val):
+        self.round_trips += 1
+        return self.command("set", key, val)
+
+    def incr(self, key):
+        self.round_trips += 1
+        return self.command("incr", key)
+
+    def hgetall(self, key):
+        self.round_trips += 1
+        return self.command("hgetall", key)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        self.round_trips += 1
+        return self.command("hset", key, field, value, mapping)
+
+    def hincrby(self, key, field, amount=1):
+        self.round_trips += 1
+        return self.command("hincrby", key, field, amount)
+
+    def scan_iter(self, match="*", count=None):
+        self.round_trips += 1
+        for key in list(self.storage):
+            if fnmatch(key, match):
+                yield key.encode()
+
+    def do_get(self, key):
+        return self.storage.get(key)
+
+    def do_set(self, key, val):
+        self.storage[key] = val
+
+    def do_incr(self, key):
+        val = int(self.storage.get(key, 0)) + 1
+        self.storage[key] = val
+        return val
+
+    def do_hgetall(self, key):
+        return {
+            field.encode(): val.encode()
+            for field, val in self.storage.get(key, {}).items()
+        }
+
+    def do_hset(self, key, field=None, value=None, mapping=None):
+        mapping = dict(mapping or {})
+        if field is not None:
+            mapping[field] = value
+        hash_ = self.storage.setdefault(key, {})
+        hash_.update({fld: str(val) for fld, val in mapping.items()})
+        return len(mapping)
+
+    def do_hincrby(self, key, field, amount=1):
+        hash_ = self.storage.setdefault(key, {})
+        val = int(hash_.get(field, 0)) + amount
+        hash_[field] = str(val)
+        return val
+
+    def do_eval(self, script, keys, args):
+        lua = LuaRuntime()
+        lua.globals().KEYS = lua.table_from(list(keys))
+        lua.globals().ARGV = lua.table_from([str(arg) for arg in args])
+        lua.globals().redis = lua.table_from({"call": self.lua_call})
+        return lua.execute(script)
+
+    def lua_call(self, name, key, *args):
+        if name == "HGET":
+            val = self.storage.get(key, {}).get(args[0])
+            return False if val is None else val
+        if name == "HSET":
+            return self.do_hset(key, mapping=dict(zip(args[::2], args[1::2])))
+        if name == "HINCRBY":
+            return self.do_hincrby(key, args[0], int(args[1]))
+        raise NotImplementedError(name)  # coverage: ignore
@@ -3,14 +3,26 @@ from dataclasses import asdict
 import pytest
 
 from purgatory.domain.messages.events import (
+    BulkheadFull,
     CircuitBreakerCreated,
     CircuitBreakerFailed,
     CircuitBreakerRecovered,
     ContextChanged,
 )
-from purgatory.domain.model import Context
+from purgatory.domain.model import Bulkhead, BulkheadFullError, Context, OpenedState
 from purgatory.service._sync.circuitbreaker import SyncCircuitBreakerFactory
-from tests.unittests.time import SyncSleep
+from purgatory.service._sync.repository import (
+    SyncAbstractRepository,
+    SyncInMemoryRepository,
+)
+from purgatory.service._sync.unit_of_work import (
+    SyncCachedUnitOfWork,
+    SyncInMemoryUnitOfWork,
+    SyncRedisUnitOfWork,
+    SyncSharedMemoryUnitOfWork,
+    SyncSqliteUnitOfWork,
+)
+from tests.unittests.time import VirtualClock
 
 
 def test_circuitbreaker_factory_decorator(
@@ -75,14 +87,15 @@ def test_redis_circuitbreaker_factory_decorator(
     fail()
 
     assert fake_redis.deserialized_storage == {
-        "cbr::client": {
+        "cbrh::client": {
             "name": "client",
-            "opened_at": None,
+            "opened_at": "",
             "state": "closed",
-            "threshold": 3,
-            "ttl": 0.1,
+            "threshold": "3",
+            "ttl": "0.1",
+            "failure_count": "2",
+            "open_count": "0",
         },
-        "cbr::client::failure_count": 2,
     }
 
     fail_or_success(fail=False)
@@ -195,7 +208,13 @@ def test_circuitbreaker_factory_add_listener():
     def hook(name, evt_name, evt):
         evts.append((name, evt_name, evt))
 
-    circuitbreaker = SyncCircuitBreakerFactory(default_threshold=2, default_ttl=0.1)
+    clock = VirtualClock()
+    circuitbreaker = SyncCircuitBreakerFactory(
+        default_threshold=2,
+        default_ttl=0.1,
+        clock=clock.monotonic,
+        wall_clock=clock.time,
+    )
     circuitbreaker.add_listener(hook)
 
     brk = circuitbreaker.get_breaker("my")
@@ -237,7 +256,7 @@ def test_circuitbreaker_factory_add_listener():
     ]
 
     evts.clear()
-    SyncSleep(0.11)
+    clock.SyncSleep(0.11)
     boom()
     assert evts == [
         (
@@ -255,7 +274,7 @@ def test_circuitbreaker_factory_add_listener():
     ]
     evts.clear()
 
-    SyncSleep(0.11)
+    clock.SyncSleep(0.11)
     with brk:
         pass
 
@@ -310,3 +329,483 @@ def test_circuitbreaker_factory_remove_listener():
     circuitbreaker.get_breaker("my2")
     assert evts == []
     assert circuitbreaker.listeners == {}
+
+
+def test_atomic_redis_circuitbreaker_share_failures(fake_redis):
+    uow = SyncRedisUnitOfWork("redis://localhost", atomic=True)
+    uow.contexts.redis = fake_redis
+    uow2 = SyncRedisUnitOfWork("redis://localhost", atomic=True)
+    uow2.contexts.redis = fake_redis
+
+    circuitbreaker = SyncCircuitBreakerFactory(default_threshold=2, uow=uow)
+    circuitbreaker2 = SyncCircuitBreakerFactory(default_threshold=2, uow=uow2)
+    circuitbreaker.initialize()
+
+    with pytest.raises(RuntimeError):
+        with circuitbreaker.get_breaker("my"):
+            raise RuntimeError("Boom")
+    with pytest.raises(RuntimeError):
+        with circuitbreaker2.get_breaker("my"):
+            raise RuntimeError("Boom")
+
+    with pytest.raises(OpenedState):
+        with circuitbreaker.get_breaker("my"):
+            pass
+
+
+def test_circuitbreaker_half_opened_max_probes(circuitbreaker, clock):
+    brk = circuitbreaker.get_breaker("my", threshold=1, ttl=10, max_probes=1)
+    with pytest.raises(RuntimeError):
+        with brk:
+            raise RuntimeError("Boom")
+    assert brk.context.state == "opened"
+    clock.SyncSleep(11)
+
+    probe = circuitbreaker.get_breaker("my", max_probes=1)
+    with probe:
+        assert brk.context.state == "half-opened"
+        with pytest.raises(OpenedState):
+            with circuitbreaker.get_breaker("my", max_probes=1):
+                raise AssertionError("Unexpected call")  # coverage: ignore
+        assert circuitbreaker.uow.contexts.probes == {"my": 1}
+
+    assert brk.context.state == "closed"
+    assert circuitbreaker.uow.contexts.probes == {}
+
+
+def test_circuitbreaker_decorator_max_probes(circuitbreaker, clock):
+    @circuitbreaker("my", threshold=1, ttl=10, max_probes=1)
+    def call(func):
+        return func()
+
+    def boom():
+        raise RuntimeError("Boom")
+
+    def rejected():
+        with pytest.raises(OpenedState):
+            call(boom)
+        return 42
+
+    with pytest.raises(RuntimeError):
+        call(boom)
+    clock.SyncSleep(11)
+    # the second call is rejected while the first one is probing
+    assert call(rejected) == 42
+    assert circuitbreaker.uow.contexts.probes == {}
+    brk = circuitbreaker.get_breaker("my")
+    assert brk.context.state == "closed"
+
+    with pytest.raises(RuntimeError):
+        call(boom)
+    clock.SyncSleep(11)
+    with pytest.raises(RuntimeError):
+        call(boom)
+    assert brk.context.state == "opened"
+    assert circuitbreaker.uow.contexts.probes == {}
+
+
+def test_redis_circuitbreaker_max_probes(circuitbreaker_redis, fake_redis):
+    circuitbreaker_redis.initialize()
+    circuitbreaker_redis.get_breaker("my", threshold=1, ttl=10)
+    fake_redis.storage["cbrh::my"]["state"] = "half-opened"
+
+    with circuitbreaker_redis.get_breaker("my", max_probes=1):
+        assert fake_redis.storage["cbrh::my"]["probes"] == "1"
+        with pytest.raises(OpenedState):
+            with circuitbreaker_redis.get_breaker("my", max_probes=1):
+                raise AssertionError("Unexpected call")  # coverage: ignore
+
+    assert fake_redis.storage["cbrh::my"]["probes"] == "0"
+    assert fake_redis.storage["cbrh::my"]["state"] == "closed"
+
+
+def test_redis_circuitbreaker_write_behind(fake_redis):
+    uow = SyncRedisUnitOfWork(
+        "redis://localhost", write_behind=True, flush_interval=60, flush_size=10
+    )
+    uow.contexts.redis = fake_redis
+    circuitbreaker = SyncCircuitBreakerFactory(default_threshold=3, uow=uow)
+    circuitbreaker.initialize()
+
+    @circuitbreaker("my")
+    def boom():
+        raise RuntimeError("Boom")
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            boom()
+    assert fake_redis.storage["cbrh::my"]["failure_count"] == "0"
+
+    with pytest.raises(RuntimeError):
+        boom()
+    assert fake_redis.storage["cbrh::my"]["state"] == "opened"
+    assert fake_redis.storage["cbrh::my"]["failure_count"] == "3"
+
+
+def test_circuitbreaker_factory_get_breakers(
+    circuitbreaker: SyncCircuitBreakerFactory,
+):
+    circuitbreaker.get_breaker("foo", threshold=2)
+    breakers = circuitbreaker.get_breakers(["foo", "bar"], threshold=10, max_probes=1)
+    assert list(breakers) == ["foo", "bar"]
+    assert breakers["foo"].context.threshold == 2
+    assert breakers["bar"].context.threshold == 10
+    assert breakers["bar"].context.max_probes == 1
+    assert breakers["bar"].context.clock == circuitbreaker.clock
+
+    with breakers["bar"]:
+        pass
+    assert circuitbreaker.uow.contexts.get("bar") is breakers["bar"].context
+
+
+def test_redis_circuitbreaker_factory_get_breakers(fake_redis):
+    uow = SyncRedisUnitOfWork(client=fake_redis)
+    circuitbreaker = SyncCircuitBreakerFactory(uow=uow)
+    evts = []
+
+    def hook(name, evt_type, payload):
+        assert evt_type == "circuit_breaker_created"
+        evts.append(name)
+
+    circuitbreaker.add_listener(hook)
+    names = [f"circuit{idx}" for idx in range(50)]
+    circuitbreaker.get_breakers(names)
+    # the hashes, the legacy layout, and the registration of the circuits
+    assert fake_redis.round_trips == 3
+    assert set(fake_redis.storage) == {f"cbrh::{name}" for name in names}
+    assert evts == names
+
+
+def test_circuitbreaker_factory_preload(
+    circuitbreaker: SyncCircuitBreakerFactory,
+):
+    circuitbreaker.initialize(preload=["foo", "bar"])
+    contexts = circuitbreaker.uow.contexts.get_all()
+    assert set(contexts) == {"foo", "bar"}
+
+    contexts = circuitbreaker.preload()
+    assert set(contexts) == {"foo", "bar"}
+
+
+def test_circuitbreaker_factory_preload_unlisted():
+    class UnlistedRepository(SyncInMemoryRepository):
+        get_all = SyncAbstractRepository.get_all
+
+    uow = SyncInMemoryUnitOfWork()
+    uow.contexts = UnlistedRepository()
+    circuitbreaker = SyncCircuitBreakerFactory(uow=uow)
+    circuitbreaker.get_breaker("foo")
+    circuitbreaker.initialize(preload=True)
+    assert circuitbreaker.preload() == {}
+
+
+def test_redis_circuitbreaker_factory_preload(fake_redis):
+    uow = SyncRedisUnitOfWork(client=fake_redis)
+    circuitbreaker = SyncCircuitBreakerFactory(uow=uow)
+    circuitbreaker.initialize(preload=["foo", "bar"])
+    assert set(fake_redis.storage) == {"cbrh::foo", "cbrh::bar"}
+
+    uow = SyncCachedUnitOfWork(SyncRedisUnitOfWork(client=fake_redis), 60)
+    circuitbreaker = SyncCircuitBreakerFactory(uow=uow)
+    circuitbreaker.initialize(preload=True)
+    round_trips = fake_redis.round_trips
+    circuitbreaker.get_breaker("foo")
+    circuitbreaker.get_breaker("bar")
+    assert fake_redis.round_trips == round_trips
+
+
+def test_circuitbreaker_factory_bounded_inmemory(clock):
+    circuitbreaker = SyncCircuitBreakerFactory(
+        default_threshold=1,
+        uow=SyncInMemoryUnitOfWork(max_size=1, clock=clock.monotonic),
+        clock=clock.monotonic,
+        wall_clock=clock.time,
+    )
+
+    @circuitbreaker("foo")
+    def foo(fail=False):
+        if fail:
+            raise RuntimeError("Boom")
+
+    foo()
+    circuitbreaker.get_breaker("bar")
+    assert circuitbreaker.uow.contexts.evictions == 1
+    with pytest.raises(RuntimeError):
+        foo(fail=True)
+    assert circuitbreaker.uow.contexts.breakers["foo"].state == "opened"
+    circuitbreaker.get_breaker("baz")
+    assert set(circuitbreaker.uow.contexts.breakers) == {"foo", "baz"}
+    with pytest.raises(OpenedState):
+        foo()
+
+
+def test_shm_circuitbreaker_share_failures(shm_path):
+    circuitbreaker = SyncCircuitBreakerFactory(
+        default_threshold=2, uow=SyncSharedMemoryUnitOfWork(shm_path)
+    )
+    other = SyncCircuitBreakerFactory(
+        default_threshold=2, uow=SyncSharedMemoryUnitOfWork(shm_path)
+    )
+    with pytest.raises(RuntimeError):
+        with circuitbreaker.get_breaker("my"):
+            raise RuntimeError("Boom")
+    with pytest.raises(RuntimeError):
+        with other.get_breaker("my"):
+            raise RuntimeError("Boom")
+    with pytest.raises(OpenedState):
+        with circuitbreaker.get_breaker("my"):
+            raise AssertionError("Unexpected call")  # coverage: ignore
+
+
+def test_sqlite_circuitbreaker_survives_restarts(sqlite_path):
+    circuitbreaker = SyncCircuitBreakerFactory(
+        default_threshold=2, uow=SyncSqliteUnitOfWork(sqlite_path)
+    )
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            with circuitbreaker.get_breaker("my"):
+                raise RuntimeError("Boom")
+
+    restarted = SyncCircuitBreakerFactory(uow=SyncSqliteUnitOfWork(sqlite_path))
+    restarted.initialize()
+    with pytest.raises(OpenedState):
+        with restarted.get_breaker("my"):
+            raise AssertionError("Unexpected call")  # coverage: ignore
+
+
+def test_circuitbreaker_thread_safe(clock):
+    evts = []
+
+    def hook(name, evt_name, evt):
+        evts.append((name, evt_name))
+
+    circuitbreaker = SyncCircuitBreakerFactory(
+        default_threshold=2,
+        default_ttl=10,
+        clock=clock.monotonic,
+        wall_clock=clock.time,
+        thread_safe=True,
+        lock_stripes=4,
+    )
+    assert circuitbreaker.locks is not None and len(circuitbreaker.locks) == 4
+    assert circuitbreaker.get_lock("my") is circuitbreaker.get_lock("my")
+    circuitbreaker.add_listener(hook)
+
+    @circuitbreaker("my", max_probes=1)
+    def call(fail=False):
+        if fail:
+            raise RuntimeError("Boom")
+        return 42
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            call(fail=True)
+    with pytest.raises(OpenedState):
+        call()
+    brk = circuitbreaker.get_breaker("my", max_probes=1)
+    assert brk.lock is circuitbreaker.get_lock("my")
+    with pytest.raises(OpenedState):
+        with brk:
+            raise AssertionError("Unexpected call")  # coverage: ignore
+
+    clock.SyncSleep(11)
+    with brk:
+        with pytest.raises(OpenedState):
+            with circuitbreaker.get_breaker("my", max_probes=1):
+                raise AssertionError("Unexpected call")  # coverage: ignore
+    assert call() == 42
+    assert brk.context.state == "closed"
+    assert evts == [
+        ("my", "circuit_breaker_created"),
+        ("my", "failed"),
+        ("my", "failed"),
+        ("my", "state_changed"),
+        ("my", "state_changed"),
+        ("my", "recovered"),
+        ("my", "state_changed"),
+    ]
+
+
+def test_circuitbreaker_thread_safe_context_manager(clock):
+    circuitbreaker = SyncCircuitBreakerFactory(
+        default_threshold=1,
+        default_ttl=10,
+        clock=clock.monotonic,
+        wall_clock=clock.time,
+        thread_safe=True,
+    )
+    brk = circuitbreaker.get_breaker("my", slow_call_duration=1)
+    with brk:
+        clock.SyncSleep(2)
+    assert brk.context.state == "opened"
+    with pytest.raises(OpenedState):
+        with brk:
+            raise AssertionError("Unexpected call")  # coverage: ignore
+
+
+def test_circuitbreaker_decorator_dispatch_events_before_call(circuitbreaker, clock):
+    evts = []
+
+    def hook(name, evt_name, evt):
+        evts.append(getattr(evt, "state", evt_name))
+
+    circuitbreaker.add_listener(hook)
+
+    @circuitbreaker("my", threshold=1, ttl=10)
+    def call(fail=False):
+        seen = list(evts)
+        if fail:
+            raise RuntimeError("Boom")
+        return seen
+
+    with pytest.raises(RuntimeError):
+        call(fail=True)
+    clock.SyncSleep(11)
+    # the half opened transition is dispatched by the call that produced it,
+    # before the call, it is not left in the context for the next calls.
+    assert call() == [
+        "circuit_breaker_created",
+        "failed",
+        "opened",
+        "half-opened",
+    ]
+    assert evts[-2:] == ["recovered", "closed"]
+
+
+def test_circuitbreaker_bulkhead(circuitbreaker):
+    evts = []
+
+    def hook(name, evt_name, evt):
+        evts.append((name, evt_name, evt))
+
+    circuitbreaker.add_listener(hook)
+    brk = circuitbreaker.get_breaker("my", bulkhead=Bulkhead(1))
+    with brk:
+        with pytest.raises(BulkheadFullError) as ctx:
+            # the limiter of the circuit is shared by its breakers
+            other = circuitbreaker.get_breaker("my", bulkhead=Bulkhead(5))
+            with other:
+                raise AssertionError("Unexpected call")  # coverage: ignore
+        assert ctx.value.circuit_name == "my"
+        # other circuits are not limited
+        with circuitbreaker.get_breaker("other"):
+            pass
+    assert circuitbreaker.bulkheads["my"].in_flight == 0
+    assert "other" not in circuitbreaker.bulkheads
+
+    with pytest.raises(RuntimeError):
+        with brk:
+            raise RuntimeError("Boom")
+    assert circuitbreaker.bulkheads["my"].in_flight == 0
+    assert evts[1] == ("my", "bulkhead_full", BulkheadFull("my", 1))
+    # a rejection is not a failure of the circuit
+    assert brk.context.failure_count == 1
+
+
+def test_circuitbreaker_bulkhead_queue_timeout(clock):
+    circuitbreaker = SyncCircuitBreakerFactory(
+        clock=clock.monotonic,
+        wall_clock=clock.time,
+        default_bulkhead=Bulkhead(1, max_queued=1, max_wait=0),
+    )
+    with circuitbreaker.get_breaker("my"):
+        with pytest.raises(BulkheadFullError):
+            with circuitbreaker.get_breaker("my"):
+                raise AssertionError("Unexpected call")  # coverage: ignore
+    bulkhead = circuitbreaker.bulkheads["my"]
+    assert bulkhead.in_flight == 0
+    with circuitbreaker.get_breaker("my"):
+        assert bulkhead.in_flight == 1
+
+
+def test_circuitbreaker_bulkhead_opened(circuitbreaker, clock):
+    brk = circuitbreaker.get_breaker(
+        "my", threshold=1, ttl=10, max_probes=1, bulkhead=Bulkhead(2)
+    )
+    bulkhead = circuitbreaker.bulkheads["my"]
+    with pytest.raises(RuntimeError):
+        with brk:
+            raise RuntimeError("Boom")
+    with pytest.raises(OpenedState):
+        with brk:
+            raise AssertionError("Unexpected call")  # coverage: ignore
+    assert bulkhead.in_flight == 0
+
+    clock.SyncSleep(11)
+    with brk:
+        with pytest.raises(OpenedState):
+            with circuitbreaker.get_breaker("my", max_probes=1):
+                raise AssertionError("Unexpected call")  # coverage: ignore
+        assert bulkhead.in_flight == 1
+    assert bulkhead.in_flight == 0
+
+
+def test_circuitbreaker_bulkhead_probe_error(circuitbreaker, clock):
+    brk = circuitbreaker.get_breaker(
+        "my", threshold=1, ttl=10, max_probes=1, bulkhead=Bulkhead(1)
+    )
+    bulkhead = circuitbreaker.bulkheads["my"]
+    with pytest.raises(RuntimeError):
+        with brk:
+            raise RuntimeError("Boom")
+    clock.SyncSleep(11)
+
+    def acquire_probe(name, max_probes, lease):
+        raise ConnectionError("Storage unavailable")
+
+    circuitbreaker.uow.contexts.acquire_probe = acquire_probe
+    with pytest.raises(ConnectionError):
+        with brk:
+            raise AssertionError("Unexpected call")  # coverage: ignore
+    assert bulkhead.in_flight == 0
+
+
+def test_circuitbreaker_decorator_bulkhead(circuitbreaker, clock):
+    evts = []
+
+    def hook(name, evt_name, evt):
+        evts.append(evt_name)
+
+    circuitbreaker.add_listener(hook)
+
+    @circuitbreaker("my", threshold=1, ttl=10, max_probes=1, bulkhead=Bulkhead(1))
+    def call(func):
+        return func()
+
+    def nested():
+        with pytest.raises(BulkheadFullError):
+            call(nested)  # coverage: ignore
+        return 42
+
+    def boom():
+        raise RuntimeError("Boom")
+
+    assert call(nested) == 42
+    bulkhead = circuitbreaker.bulkheads["my"]
+    assert bulkhead.in_flight == 0
+    assert evts == ["circuit_breaker_created", "bulkhead_full"]
+
+    with pytest.raises(RuntimeError):
+        call(boom)
+    assert bulkhead.in_flight == 0
+    with pytest.raises(OpenedState):
+        call(boom)
+    assert bulkhead.in_flight == 0
+    clock.SyncSleep(11)
+    assert call(nested) == 42
+    assert bulkhead.in_flight == 0
+
+
+def test_circuitbreaker_timeout_not_reached(circuitbreaker):
+    @circuitbreaker("my", timeout=60)
+    def call():
+        return 42
+
+    assert call() == 42
+    brk = circuitbreaker.get_breaker("my", timeout=60)
+    # the calls of the same timeout share their deadlines
+    assert brk.deadlines is circuitbreaker.deadlines[60]
+    with brk:
+        assert len(brk.calls) == 1
+    assert brk.calls == {}
+    assert brk.context.failure_count == 0
@@ -1,25 +1,37 @@
+import json
 import time
+from typing import cast
 
 import pytest
 
-from purgatory.domain.model import Context
+from purgatory.domain.model import ClosedState, Context
+from purgatory.service._shm import SEQ
 from purgatory.service._sync.repository import (
+    ConfigurationError,
+    SyncCachedRepository,
     SyncInMemoryRepository,
     SyncRedisRepository,
+    SyncSharedMemoryRepository,
+    SyncSqliteRepository,
 )
 
 
-@pytest.mark.parametrize("repository", ["inmemory", "redis"])
+@pytest.mark.parametrize("repository", ["inmemory", "redis", "shm", "sqlite"])
 @pytest.mark.parametrize("state", ["half-opened", "opened", "closed"])
 def test_redis_respository_state_recovery(
     state,
     repository,
     inmemory_repository: SyncInMemoryRepository,
     redis_repository: SyncRedisRepository,
+    shm_repository: SyncSharedMemoryRepository,
+    sqlite_repository: SyncSqliteRepository,
 ):
-    repository = {"inmemory": inmemory_repository, "redis": redis_repository}[
-        repository
-    ]
+    repository = {
+        "inmemory": inmemory_repository,
+        "redis": redis_repository,
+        "shm": shm_repository,
+        "sqlite": sqlite_repository,
+    }[repository]
     context = Context("foo", 40, 10, state)
     repository.initialize()
     repository.register(context)
@@ -27,15 +39,21 @@ def test_redis_respository_state_recovery(
     assert context2 == context
 
 
-@pytest.mark.parametrize("repository", ["redis"])
+@pytest.mark.parametrize("repository", ["redis", "shm", "sqlite"])
 def test_redis_respository_workflow(
     repository,
     # the in memory repository works update its state in the model,
     # and does not affect the repository
     # inmemory_repository: AsyncInMemoryRepository,
     redis_repository: SyncRedisRepository,
+    shm_repository: SyncSharedMemoryRepository,
+    sqlite_repository: SyncSqliteRepository,
 ):
-    repository = {"redis": redis_repository}[repository]
+    repository = {
+        "redis": redis_repository,
+        "shm": shm_repository,
+        "sqlite": sqlite_repository,
+    }[repository]
 
     breaker = Context("foo", 40, 10)
     repository.initialize()
@@ -66,3 +84,769 @@ def test_redis_respository_workflow(
     repository.update_state("foo", state="closed", opened_at=None)
     breaker = repository.get("foo")
     assert breaker.opened_at is None
+
+
+def test_cached_repository_read_through(
+    fake_redis, cached_redis_repository: SyncCachedRepository
+):
+    repository = cached_redis_repository
+    repository.initialize()
+    assert repository.get("foo") is None
+
+    repository.register(Context("foo", 40, 10))
+    breaker = repository.get("foo")
+    assert breaker is not None
+    fake_redis.storage.clear()
+    assert repository.get("foo") is breaker
+
+    repository.invalidate("foo")
+    assert repository.get("foo") is None
+
+
+def test_cached_repository_expires(redis_repository: SyncRedisRepository, clock):
+    repository = SyncCachedRepository(
+        redis_repository, max_age=10, clock=clock.monotonic
+    )
+    repository.initialize()
+    repository.register(Context("foo", 40, 10))
+    breaker = repository.get("foo")
+    clock.SyncSleep(9)
+    assert repository.get("foo") is breaker
+    assert repository.get_many(["foo"]) == {"foo": breaker}
+    clock.SyncSleep(2)
+    breaker2 = repository.get("foo")
+    assert breaker == breaker2
+    assert breaker is not breaker2
+
+
+def test_cached_repository_invalidate_on_state_change(
+    cached_redis_repository: SyncCachedRepository,
+):
+    repository = cached_redis_repository
+    repository.initialize()
+    repository.register(Context("foo", 40, 10))
+    repository.register(Context("bar", 40, 10))
+
+    repository.inc_failures("foo", 1)
+    breaker = repository.get("foo")
+    assert breaker.failure_count == 0
+
+    opened_at = time.time()
+    repository.update_state("foo", state="opened", opened_at=opened_at)
+    breaker = repository.get("foo")
+    assert breaker.state == "opened"
+    assert breaker.opened_at == opened_at
+    assert breaker.failure_count == 1
+
+    repository.reset_failure("foo")
+    assert (repository.get("foo")).failure_count == 1
+
+    repository.invalidate()
+    assert repository.cache == {}
+    assert (repository.get("foo")).failure_count == 0
+
+
+def test_redis_repository_single_round_trips(
+    fake_redis, redis_repository: SyncRedisRepository
+):
+    redis_repository.initialize()
+    redis_repository.register(Context("foo", 40, 10))
+    assert fake_redis.round_trips == 1
+
+    redis_repository.get("foo")
+    assert fake_redis.round_trips == 2
+
+    redis_repository.update_state("foo", state="opened", opened_at=42.0)
+    assert fake_redis.round_trips == 3
+
+    redis_repository.inc_failures("foo", 1)
+    assert fake_redis.round_trips == 4
+
+    assert fake_redis.storage == {
+        "cbrh::foo": {
+            "name": "foo",
+            "threshold": "40",
+            "ttl": "10",
+            "state": "opened",
+            "opened_at": "42.0",
+            "failure_count": "1",
+            "open_count": "1",
+        }
+    }
+
+
+def test_redis_repository_migrate_legacy_layout(
+    fake_redis, redis_repository: SyncRedisRepository
+):
+    redis_repository.initialize()
+    fake_redis.storage["cbr::foo"] = json.dumps(
+        {
+            "name": "foo",
+            "threshold": 40,
+            "ttl": 10,
+            "state": "opened",
+            "opened_at": 42.0,
+        }
+    )
+    fake_redis.storage["cbr::foo::failure_count"] = 3
+
+    breaker = redis_repository.get("foo")
+    assert breaker == Context("foo", 40, 10)
+    assert breaker.state == "opened"
+    assert breaker.opened_at == 42.0
+    assert breaker.failure_count == 3
+    assert fake_redis.storage["cbrh::foo"] == {
+        "name": "foo",
+        "threshold": "40",
+        "ttl": "10",
+        "state": "opened",
+        "opened_at": "42.0",
+        "failure_count": "3",
+        "open_count": "0",
+    }
+
+    round_trips = fake_redis.round_trips
+    assert redis_repository.get("foo") == breaker
+    assert fake_redis.round_trips == round_trips + 1
+
+    assert redis_repository.get("bar") is None
+    redis_repository.legacy_prefix = None
+    fake_redis.storage.pop("cbrh::foo")
+    assert redis_repository.get("foo") is None
+
+
+def test_redis_repository_migrate_legacy_layout_at_once(
+    fake_redis, redis_repository: SyncRedisRepository
+):
+    redis_repository.initialize()
+    for name in ("foo", "bar"):
+        fake_redis.storage[f"cbr::{name}"] = json.dumps(
+            {"name": name, "threshold": 40, "ttl": 10, "state": "closed"}
+        )
+    fake_redis.storage["cbr::bar::failure_count"] = 2
+
+    round_trips = fake_redis.round_trips
+    breakers = redis_repository.get_many(["foo", "bar", "baz"])
+    # the hashes, the legacy layout, and the migrated hashes
+    assert fake_redis.round_trips == round_trips + 3
+    assert set(breakers) == {"foo", "bar"}
+    assert breakers["bar"].failure_count == 2
+    assert fake_redis.storage["cbrh::bar"]["failure_count"] == "2"
+    assert "cbrh::baz" not in fake_redis.storage
+
+
+def test_atomic_redis_repository_record_failure(
+    fake_redis, atomic_redis_repository: SyncRedisRepository
+):
+    repository = atomic_redis_repository
+    repository.initialize()
+    assert repository.record_failure("foo") is None
+
+    repository.register(Context("foo", 3, 10))
+    assert repository.record_failure("foo") == "closed"
+    assert repository.record_failure("foo") == "closed"
+    round_trips = fake_redis.round_trips
+    assert repository.record_failure("foo") == "opened"
+    assert fake_redis.round_trips == round_trips + 1
+
+    breaker = repository.get("foo")
+    assert breaker.state == "opened"
+    assert breaker.failure_count == 3
+    assert breaker.opened_at == pytest.approx(time.time(), abs=1)
+
+    assert repository.record_success("foo") == "opened"
+
+
+def test_atomic_redis_repository_open(
+    atomic_redis_repository: SyncRedisRepository,
+):
+    repository = atomic_redis_repository
+    repository.initialize()
+    repository.register(Context("foo", 2, 10))
+    assert repository.open("foo", 42.0) == "closed"
+
+    repository.register(Context("foo", 2, 10, failure_count=2))
+    assert repository.open("foo", 42.0) == "opened"
+    assert (repository.get("foo")).opened_at == 42.0
+    assert repository.open("foo", 43.0) == "opened"
+    assert (repository.get("foo")).opened_at == 42.0
+
+    repository.register(Context("foo", 2, 10, state="half-opened"))
+    assert repository.open("foo", 44.0) == "opened"
+    assert (repository.get("foo")).opened_at == 44.0
+
+
+def test_atomic_redis_repository_try_half_open(
+    atomic_redis_repository: SyncRedisRepository,
+):
+    repository = atomic_redis_repository
+    repository.initialize()
+    repository.register(Context("foo", 2, 10, state="opened", opened_at=time.time()))
+    assert repository.try_half_open("foo") == "opened"
+
+    repository.register(
+        Context("foo", 2, 10, state="opened", opened_at=time.time() - 11)
+    )
+    assert repository.try_half_open("foo") == "half-opened"
+    breaker = repository.get("foo")
+    assert breaker.state == "half-opened"
+    assert breaker.opened_at is None
+    assert repository.try_half_open("foo") == "half-opened"
+
+    assert repository.record_success("foo") == "closed"
+    breaker = repository.get("foo")
+    assert breaker.state == "closed"
+    assert breaker.failure_count == 0
+
+
+def test_atomic_redis_repository_workflow(
+    fake_redis, atomic_redis_repository: SyncRedisRepository
+):
+    repository = atomic_redis_repository
+    repository.initialize()
+    repository.register(Context("foo", 2, 0.1))
+    round_trips = fake_redis.round_trips
+
+    repository.inc_failures("foo", 1)
+    repository.update_state("foo", state="opened", opened_at=time.time())
+    assert (repository.get("foo")).state == "closed"
+
+    repository.inc_failures("foo", 2)
+    repository.update_state("foo", state="opened", opened_at=time.time())
+    assert (repository.get("foo")).state == "opened"
+
+    repository.update_state("foo", state="half-opened", opened_at=None)
+    assert (repository.get("foo")).state == "opened"
+
+    fake_redis.storage["cbrh::foo"]["opened_at"] = str(time.time() - 1)
+    repository.update_state("foo", state="half-opened", opened_at=None)
+    assert (repository.get("foo")).state == "half-opened"
+
+    repository.reset_failure("foo")
+    repository.update_state("foo", state="closed", opened_at=None)
+    breaker = repository.get("foo")
+    assert breaker.state == "closed"
+    assert breaker.failure_count == 0
+    assert fake_redis.round_trips == round_trips + 13
+
+
+@pytest.mark.parametrize("repository", ["inmemory", "redis", "cached"])
+def test_repository_probes(
+    repository,
+    inmemory_repository: SyncInMemoryRepository,
+    redis_repository: SyncRedisRepository,
+    cached_redis_repository: SyncCachedRepository,
+):
+    repository = {
+        "inmemory": inmemory_repository,
+        "redis": redis_repository,
+        "cached": cached_redis_repository,
+    }[repository]
+    repository.initialize()
+    repository.register(Context("foo", 2, 10, "half-opened"))
+    assert repository.acquire_probe("foo", 2, 10) is True
+    assert repository.acquire_probe("foo", 2, 10) is True
+    assert repository.acquire_probe("foo", 2, 10) is False
+    repository.release_probe("foo")
+    assert repository.acquire_probe("foo", 2, 10) is True
+    repository.release_probe("foo")
+    repository.release_probe("foo")
+    repository.release_probe("foo")
+    assert repository.acquire_probe("foo", 1, 10) is True
+    assert repository.acquire_probe("foo", 1, 10) is False
+
+
+def test_redis_repository_probes_lease(
+    fake_redis, redis_repository: SyncRedisRepository
+):
+    repository = redis_repository
+    repository.initialize()
+    repository.register(Context("foo", 2, 10, "half-opened"))
+    assert repository.acquire_probe("foo", 1, 10) is True
+    assert fake_redis.storage["cbrh::foo"]["probes"] == "1"
+    assert repository.acquire_probe("foo", 1, 10) is False
+
+    # the process of the probe died without releasing it
+    fake_redis.storage["cbrh::foo"]["probed_at"] = str(time.time() - 11)
+    assert repository.acquire_probe("foo", 1, 10) is True
+    assert fake_redis.storage["cbrh::foo"]["probes"] == "1"
+
+
+def test_inmemory_repository_probes_lease(clock):
+    repository = SyncInMemoryRepository(clock=clock.monotonic)
+    repository.register(Context("foo", 2, 10, "half-opened"))
+    assert repository.acquire_probe("foo", 1, 10) is True
+    assert repository.acquire_probe("foo", 1, 10) is False
+
+    # the call of the probe never released it
+    clock.SyncSleep(11)
+    assert repository.acquire_probe("foo", 1, 10) is True
+    assert repository.probes == {"foo": 1}
+    repository.release_probe("foo")
+    assert repository.probes == {}
+    assert repository.probed_at == {}
+
+
+@pytest.mark.parametrize("atomic", [False, True])
+def test_redis_repository_open_count(
+    atomic,
+    fake_redis,
+    redis_repository: SyncRedisRepository,
+    atomic_redis_repository: SyncRedisRepository,
+):
+    repository = atomic_redis_repository if atomic else redis_repository
+    repository.initialize()
+    repository.register(Context("foo", 1, 0.1))
+
+    repository.inc_failures("foo", 1)
+    repository.update_state("foo", state="opened", opened_at=time.time())
+    assert (repository.get("foo")).open_count == 1
+
+    fake_redis.storage["cbrh::foo"]["opened_at"] = str(time.time() - 1)
+    repository.update_state("foo", state="half-opened", opened_at=None)
+    repository.update_state("foo", state="opened", opened_at=time.time())
+    assert (repository.get("foo")).open_count == 2
+
+    fake_redis.storage["cbrh::foo"]["opened_at"] = str(time.time() - 1)
+    repository.update_state("foo", state="half-opened", opened_at=None)
+    repository.update_state("foo", state="closed", opened_at=None)
+    breaker = repository.get("foo")
+    assert breaker.state == "closed"
+    assert breaker.open_count == 0
+
+
+def test_redis_repository_write_behind(
+    fake_redis, write_behind_redis_repository: SyncRedisRepository
+):
+    repository = write_behind_redis_repository
+    repository.initialize()
+    repository.register(Context("foo", 10, 10))
+    round_trips = fake_redis.round_trips
+
+    repository.inc_failures("foo", 1)
+    repository.inc_failures("foo", 2)
+    assert fake_redis.round_trips == round_trips
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "0"
+    # the pending failures of the process are loaded with the context
+    assert (repository.get("foo")).failure_count == 2
+
+    repository.reset_failure("foo")
+    repository.inc_failures("foo", 1)
+    assert repository.pending == {"foo": (True, 1)}
+    assert (repository.get("foo")).failure_count == 1
+    round_trips = fake_redis.round_trips
+
+    repository.flush()
+    assert fake_redis.round_trips == round_trips + 1
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "1"
+    assert repository.pending == {}
+    repository.flush()
+    assert fake_redis.round_trips == round_trips + 1
+
+
+def test_redis_repository_write_behind_flush_size(
+    fake_redis, write_behind_redis_repository: SyncRedisRepository
+):
+    repository = write_behind_redis_repository
+    repository.initialize()
+    repository.register(Context("foo", 10, 10))
+    repository.register(Context("bar", 10, 10))
+    round_trips = fake_redis.round_trips
+    for _ in range(2):
+        repository.inc_failures("foo", 1)
+        repository.inc_failures("bar", 1)
+    assert fake_redis.round_trips == round_trips
+    repository.inc_failures("foo", 1)
+    assert fake_redis.round_trips == round_trips + 1
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "3"
+    assert fake_redis.storage["cbrh::bar"]["failure_count"] == "2"
+
+
+def test_redis_repository_write_behind_flush_interval(
+    fake_redis, write_behind_redis_repository: SyncRedisRepository
+):
+    repository = write_behind_redis_repository
+    repository.initialize()
+    repository.register(Context("foo", 10, 10))
+    repository.inc_failures("foo", 1)
+    assert repository.pending == {"foo": (False, 1)}
+    # the timer is armed by the first pending update
+    timer = repository.timer.timer
+    assert timer is not None
+    repository.inc_failures("foo", 1)
+    assert repository.timer.timer is timer
+    repository.flush()
+    assert repository.timer.timer is None
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "2"
+
+
+def test_redis_repository_write_behind_state_transition(
+    fake_redis, write_behind_redis_repository: SyncRedisRepository
+):
+    repository = write_behind_redis_repository
+    repository.initialize()
+    repository.register(Context("foo", 2, 10))
+    repository.register(Context("bar", 2, 10))
+    repository.inc_failures("bar", 1)
+    repository.inc_failures("foo", 1)
+    repository.inc_failures("foo", 2)
+    round_trips = fake_redis.round_trips
+
+    repository.update_state("foo", "opened", 42.0)
+    assert fake_redis.round_trips == round_trips + 1
+    assert fake_redis.storage["cbrh::foo"]["state"] == "opened"
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "2"
+    assert fake_redis.storage["cbrh::bar"]["failure_count"] == "1"
+
+    repository.reset_failure("foo")
+    repository.update_state("foo", "closed", None)
+    assert fake_redis.round_trips == round_trips + 2
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "0"
+
+
+def test_redis_repository_write_behind_is_not_atomic():
+    with pytest.raises(ConfigurationError):
+        SyncRedisRepository("redis://localhost", atomic=True, write_behind=True)
+
+
+def test_redis_repository_requires_a_client():
+    with pytest.raises(ConfigurationError):
+        SyncRedisRepository()
+
+
+def test_redis_repository_client_is_lazy():
+    repository = SyncRedisRepository("redis://localhost/1")
+    assert repository._redis is None
+    client = repository.redis
+    assert repository.redis is client
+
+
+def test_redis_repository_share_the_pool_of_the_url():
+    repository = SyncRedisRepository("redis://localhost/2")
+    other = SyncRedisRepository("redis://localhost/2")
+    assert repository.redis is other.redis
+    assert repository._redis is None
+
+    sized = SyncRedisRepository("redis://localhost/2", max_connections=4)
+    assert sized.redis.connection_pool is not repository.redis.connection_pool
+    assert sized.redis.connection_pool.max_connections == 4
+
+    another_db = SyncRedisRepository("redis://localhost/3")
+    assert another_db.redis.connection_pool is not repository.redis.connection_pool
+
+
+def test_redis_repository_use_the_given_pool():
+    pool = SyncRedisRepository("redis://localhost/4").redis.connection_pool
+    repository = SyncRedisRepository(connection_pool=pool)
+    assert repository.redis.connection_pool is pool
+
+
+def test_redis_repository_use_the_given_client(fake_redis):
+    repository = SyncRedisRepository(client=fake_redis)
+    assert repository.redis is fake_redis
+
+
+def test_inmemory_repository_get_many(
+    inmemory_repository: SyncInMemoryRepository,
+):
+    foo = Context("foo", 40, 10)
+    bar = Context("bar", 40, 10)
+    inmemory_repository.register(foo)
+    inmemory_repository.register(bar)
+    assert inmemory_repository.get_many(["foo", "baz"]) == {"foo": foo}
+    assert inmemory_repository.get_all() == {"foo": foo, "bar": bar}
+
+
+def test_redis_repository_get_many_single_round_trip(
+    fake_redis, redis_repository: SyncRedisRepository
+):
+    redis_repository.legacy_prefix = None
+    redis_repository.register(Context("foo", 40, 10))
+    redis_repository.register(Context("bar", 5, 30, open_count=2))
+    round_trips = fake_redis.round_trips
+
+    contexts = redis_repository.get_many(["foo", "bar", "baz"])
+    assert fake_redis.round_trips == round_trips + 1
+    assert contexts == {
+        "foo": Context("foo", 40, 10),
+        "bar": Context("bar", 5, 30, open_count=2),
+    }
+    assert redis_repository.get_many([]) == {}
+    assert fake_redis.round_trips == round_trips + 1
+
+
+def test_redis_repository_get_many_migrate_legacy_layout(
+    fake_redis, redis_repository: SyncRedisRepository
+):
+    fake_redis.storage["cbr::foo"] = json.dumps(
+        {"name": "foo", "threshold": 7, "ttl": 42, "state": "closed"}
+    )
+    contexts = redis_repository.get_many(["foo"])
+    assert contexts == {"foo": Context("foo", 7, 42)}
+    assert fake_redis.storage["cbrh::foo"]["threshold"] == "7"
+
+
+def test_redis_repository_get_all(
+    fake_redis, write_behind_redis_repository: SyncRedisRepository
+):
+    repository = write_behind_redis_repository
+    repository.register(Context("foo", 40, 10))
+    repository.register(Context("bar", 5, 30))
+    fake_redis.storage["cbr::legacy"] = "{}"
+    repository.inc_failures("bar", 1)
+    round_trips = fake_redis.round_trips
+
+    contexts = repository.get_all()
+    assert fake_redis.round_trips == round_trips + 2
+    assert contexts == {
+        "foo": Context("foo", 40, 10),
+        "bar": Context("bar", 5, 30, failure_count=1),
+    }
+
+
+def test_cached_repository_get_many(
+    fake_redis, cached_redis_repository: SyncCachedRepository
+):
+    repository = cached_redis_repository
+    repository.repository.legacy_prefix = None  # type: ignore
+    repository.register(Context("foo", 40, 10))
+    repository.repository.register(Context("bar", 5, 30))
+    round_trips = fake_redis.round_trips
+
+    contexts = repository.get_many(["foo", "bar", "baz"])
+    assert fake_redis.round_trips == round_trips + 1
+    assert set(contexts) == {"foo", "bar"}
+    assert repository.get_many(["foo", "bar"]) == contexts
+    assert fake_redis.round_trips == round_trips + 1
+
+    repository.invalidate()
+    assert repository.get_all() == contexts
+    assert fake_redis.round_trips == round_trips + 3
+    assert set(repository.cache) == {"foo", "bar"}
+
+
+def test_inmemory_repository_evict_least_recently_used():
+    repository = SyncInMemoryRepository(max_size=2)
+    assert repository.live_contexts is False
+    repository.register(Context("foo", 40, 10))
+    repository.register(Context("bar", 40, 10))
+    repository.get("foo")
+    repository.register(Context("baz", 40, 10))
+    assert set(repository.breakers) == {"foo", "baz"}
+    assert repository.size == 2
+    assert repository.evictions == 1
+
+    repository.get_many(["foo"])
+    repository.register(Context("qux", 40, 10))
+    assert set(repository.breakers) == {"foo", "qux"}
+    assert repository.evictions == 2
+
+
+def test_inmemory_repository_never_evict_opened_circuits():
+    repository = SyncInMemoryRepository(max_size=1)
+    opened = Context("foo", 40, 10, state="opened", opened_at=time.time())
+    half_opened = Context("bar", 40, 10, state="half-opened")
+    repository.register(opened)
+    repository.register(half_opened)
+    repository.register(Context("baz", 40, 10))
+    assert set(repository.breakers) == {"foo", "bar", "baz"}
+    assert repository.evictions == 0
+
+    opened.set_state(ClosedState(0))
+    repository.register(Context("qux", 40, 10))
+    assert set(repository.breakers) == {"bar", "qux"}
+    assert repository.evictions == 2
+
+
+def test_inmemory_repository_evict_idle_circuits(clock):
+    repository = SyncInMemoryRepository(idle_ttl=60, clock=clock.monotonic)
+    repository.register(Context("foo", 40, 10))
+    repository.register(Context("bar", 40, 10))
+    clock.SyncSleep(30)
+    repository.get("bar")
+    clock.SyncSleep(30)
+    repository.register(Context("baz", 40, 10))
+    assert set(repository.breakers) == {"bar", "baz"}
+    assert repository.evictions == 1
+
+
+def test_inmemory_repository_max_size():
+    with pytest.raises(ValueError):
+        SyncInMemoryRepository(max_size=0)
+    assert SyncInMemoryRepository().live_contexts is True
+
+
+def test_shm_repository_shared_by_processes(
+    shm_path, shm_repository: SyncSharedMemoryRepository
+):
+    other = SyncSharedMemoryRepository(shm_path)
+    assert other.table.capacity == 8
+    shm_repository.register(Context("foo", 40, 10))
+    assert other.get("foo") == Context("foo", 40, 10)
+
+    other.inc_failures("foo", 1)
+    shm_repository.inc_failures("foo", 2)
+    opened_at = time.time()
+    other.update_state("foo", "opened", opened_at)
+    assert shm_repository.get("foo") == Context(
+        "foo", 40, 10, "opened", 2, opened_at, open_count=1
+    )
+
+    other.register(Context("foo", 5, 30))
+    assert shm_repository.get("foo") == Context("foo", 5, 30)
+    assert shm_repository.get("bar") is None
+    other.update_state("bar", "opened", opened_at)
+    assert other.get("bar") is None
+    other.table.close()
+
+
+def test_shm_repository_get_all(shm_repository: SyncSharedMemoryRepository):
+    shm_repository.register(Context("foo", 40, 10))
+    shm_repository.register(Context("bar", 5, 30))
+    assert shm_repository.get_all() == {
+        "foo": Context("foo", 40, 10),
+        "bar": Context("bar", 5, 30),
+    }
+    assert shm_repository.get_many(["bar", "baz"]) == {
+        "bar": Context("bar", 5, 30),
+    }
+
+
+def test_shm_repository_full(shm_repository: SyncSharedMemoryRepository):
+    for i in range(8):
+        shm_repository.register(Context(f"circuit{i}", 40, 10))
+    with pytest.raises(ConfigurationError):
+        shm_repository.register(Context("foo", 40, 10))
+    shm_repository.register(Context("circuit0", 5, 10))
+    assert len(shm_repository.get_all()) == 8
+
+    with pytest.raises(ValueError):
+        shm_repository.register(Context("x" * 256, 40, 10))
+
+
+def test_shm_repository_invalid_record(
+    shm_repository: SyncSharedMemoryRepository,
+):
+    with pytest.raises(ValueError):
+        shm_repository.register(Context("big", 2**31, 30))
+    # the slot is left untouched
+    assert shm_repository.get("big") is None
+    shm_repository.register(Context("big", 40, 30))
+    with pytest.raises(ValueError):
+        shm_repository.register(Context("big", 40, 30, failure_count=2**31))
+    assert shm_repository.get("big") == Context("big", 40, 30)
+
+
+def test_shm_repository_stale_write(shm_repository: SyncSharedMemoryRepository):
+    shm_repository.register(Context("foo", 40, 10))
+    shm_repository.register(Context("bar", 40, 10))
+    table = shm_repository.table
+    for name in ("foo", "bar"):
+        # a writer died while writing the record
+        offset = table.offset(cast(int, table.find(name)))
+        SEQ.pack_into(table.buf, offset, SEQ.unpack_from(table.buf, offset)[0] + 1)
+
+    # repaired by the reader
+    assert shm_repository.get("foo") == Context("foo", 40, 10)
+    # repaired by the writer
+    shm_repository.inc_failures("bar", 1)
+    assert (shm_repository.get("bar")).failure_count == 1
+    for name in ("foo", "bar"):
+        offset = table.offset(cast(int, table.find(name)))
+        assert SEQ.unpack_from(table.buf, offset)[0] % 2 == 0
+
+
+def test_shm_repository_invalid_file(tmp_path):
+    path = tmp_path / "purgatory"
+    path.write_bytes(b"x" * 1024)
+    with pytest.raises(ValueError):
+        SyncSharedMemoryRepository(str(path))
+    with pytest.raises(ValueError):
+        SyncSharedMemoryRepository(str(tmp_path / "empty"), capacity=0)
+
+
+def test_shm_repository_probes(shm_repository: SyncSharedMemoryRepository):
+    shm_repository.register(Context("foo", 40, 10, "half-opened"))
+    assert shm_repository.acquire_probe("foo", 1, 10) is True
+    assert shm_repository.acquire_probe("foo", 1, 10) is False
+    shm_repository.release_probe("foo")
+    assert shm_repository.acquire_probe("foo", 1, 10) is True
+    # the lease of the probe expires
+    assert shm_repository.acquire_probe("foo", 1, -1) is True
+    shm_repository.release_probe("foo")
+    shm_repository.release_probe("foo")
+    assert (shm_repository.table.get("foo")).probes == 0
+    assert shm_repository.acquire_probe("bar", 1, 10) is False
+
+
+def test_sqlite_repository_batch_failures(
+    sqlite_path, sqlite_repository: SyncSqliteRepository
+):
+    repository = sqlite_repository
+    other = SyncSqliteRepository(sqlite_path)
+    repository.initialize()
+    repository.register(Context("foo", 40, 10))
+    repository.register(Context("bar", 40, 10, failure_count=3))
+    repository.inc_failures("foo", 1)
+    repository.inc_failures("foo", 2)
+    repository.reset_failure("bar")
+    repository.inc_failures("bar", 1)
+    assert (repository.get("foo")).failure_count == 2
+    assert (other.get("foo")).failure_count == 0
+    assert (other.get("bar")).failure_count == 3
+
+    repository.inc_failures("foo", 3)
+    assert repository.pending == {}
+    assert (other.get("foo")).failure_count == 3
+    assert (other.get("bar")).failure_count == 1
+
+    repository.inc_failures("foo", 4)
+    opened_at = time.time()
+    repository.update_state("foo", "opened", opened_at)
+    assert other.get("foo") == Context(
+        "foo", 40, 10, "opened", 4, opened_at, open_count=1
+    )
+    repository.update_state("foo", "closed", None)
+    assert (other.get("foo")).open_count == 0
+
+    repository.inc_failures("bar", 1)
+    repository.flush()
+    repository.flush()
+    assert (other.get("bar")).failure_count == 2
+    other.connection.close()
+
+
+def test_sqlite_repository_get_many(sqlite_repository: SyncSqliteRepository):
+    repository = sqlite_repository
+    repository.register(Context("foo", 40, 10))
+    repository.register(Context("bar", 5, 30))
+    repository.inc_failures("bar", 1)
+    assert repository.get_many(["foo", "bar", "baz"]) == {
+        "foo": Context("foo", 40, 10),
+        "bar": Context("bar", 5, 30, failure_count=1),
+    }
+    assert repository.get_all() == {
+        "foo": Context("foo", 40, 10),
+        "bar": Context("bar", 5, 30, failure_count=1),
+    }
+    names = [f"circuit{i}" for i in range(1200)]
+    for name in names:
+        repository.register(Context(name, 40, 10))
+    assert len(repository.get_many(names)) == 1200
+
+
+def test_sqlite_repository_probes(sqlite_repository: SyncSqliteRepository):
+    repository = sqlite_repository
+    repository.register(Context("foo", 40, 10, "half-opened"))
+    assert repository.acquire_probe("foo", 1, 10) is True
+    assert repository.acquire_probe("foo", 1, 10) is False
+    repository.release_probe("foo")
+    assert repository.acquire_probe("foo", 2, 10) is True
+    assert repository.acquire_probe("foo", 2, 10) is True
+    assert repository.acquire_probe("foo", 2, 10) is False
+    # the lease of the probes expires
+    assert repository.acquire_probe("foo", 2, -1) is True
+    repository.release_probe("foo")
+    repository.release_probe("foo")
+    assert repository.acquire_probe("foo", 1, 10) is True
+    assert repository.acquire_probe("bar", 1, 10) is False
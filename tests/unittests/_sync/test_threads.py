@@ -0,0 +1,151 @@
+"""
+Circuit breakers shared by threads, in thread safe mode.
+
+This module is not generated from the async tests.
+"""
+
+import threading
+import time
+
+import pytest
+
+from purgatory.domain.messages.events import CircuitBreakerFailed
+from purgatory.domain.model import OpenedState
+from purgatory.service._sync.circuitbreaker import SyncCircuitBreakerFactory
+from purgatory.service._sync.unit_of_work import SyncSqliteUnitOfWork
+
+THREADS = 8
+CALLS = 200
+
+
+def run_threads(target):
+    barrier = threading.Barrier(THREADS)
+    errors = []
+
+    def run():
+        barrier.wait()
+        try:
+            target()
+        except BaseException as exc:  # coverage: ignore
+            errors.append(exc)
+
+    threads = [threading.Thread(target=run) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+@pytest.mark.parametrize("decorator", [True, False])
+def test_failures_are_counted_once(decorator):
+    circuitbreaker = SyncCircuitBreakerFactory(
+        default_threshold=THREADS * CALLS + 1, thread_safe=True
+    )
+    failures = []
+    circuitbreaker.messagebus.add_listener(
+        CircuitBreakerFailed, lambda evt, uow: failures.append(evt.failure_count)
+    )
+
+    @circuitbreaker("shared")
+    def boom():
+        raise RuntimeError("Boom")
+
+    def fail():
+        for _ in range(CALLS):
+            with pytest.raises(RuntimeError):
+                if decorator:
+                    boom()
+                else:
+                    with circuitbreaker.get_breaker("shared"):
+                        raise RuntimeError("Boom")
+
+    run_threads(fail)
+
+    brk = circuitbreaker.get_breaker("shared")
+    assert brk.context.failure_count == THREADS * CALLS
+    assert sorted(failures) == list(range(1, THREADS * CALLS + 1))
+    ctx = circuitbreaker.uow.contexts.breakers["shared"]
+    assert ctx.failure_count == THREADS * CALLS
+
+
+def test_circuit_opens_once():
+    circuitbreaker = SyncCircuitBreakerFactory(
+        default_threshold=CALLS, default_ttl=60, thread_safe=True
+    )
+    opened = []
+
+    def hook(name, evt_name, evt):
+        if evt_name == "state_changed" and evt.state == "opened":
+            opened.append(name)
+
+    circuitbreaker.add_listener(hook)
+
+    @circuitbreaker("shared")
+    def boom():
+        raise RuntimeError("Boom")
+
+    def fail():
+        for _ in range(CALLS):
+            try:
+                boom()
+            except (RuntimeError, OpenedState):
+                pass
+
+    run_threads(fail)
+    assert opened == ["shared"]
+
+
+def test_circuits_are_registered_once():
+    circuitbreaker = SyncCircuitBreakerFactory(thread_safe=True)
+    repository = circuitbreaker.uow.contexts
+    register = repository.register
+    collect_new_events = circuitbreaker.uow.collect_new_events
+    registered = {}
+    created = []
+
+    def register_once(context):
+        registered[context.name] = threading.get_ident()
+        register(context)
+
+    def collect_late():
+        # let another thread run before the events are collected
+        time.sleep(0.0001)
+        return collect_new_events()
+
+    def hook(name, evt_name, evt):
+        if evt_name == "circuit_breaker_created":
+            created.append((name, threading.get_ident()))
+
+    repository.register = register_once
+    circuitbreaker.uow.collect_new_events = collect_late
+    circuitbreaker.add_listener(hook)
+
+    def get():
+        for i in range(CALLS):
+            circuitbreaker.get_breaker(f"circuit-{i}")
+
+    run_threads(get)
+    assert len(registered) == CALLS
+    # the hook runs once per circuit, by the thread that registered it
+    assert sorted(created) == sorted(registered.items())
+
+
+def test_sqlite_writes_are_serialized(tmp_path):
+    uow = SyncSqliteUnitOfWork(str(tmp_path / "purgatory.sqlite"), flush_size=1)
+    circuitbreaker = SyncCircuitBreakerFactory(
+        default_threshold=THREADS * CALLS + 1, thread_safe=True, uow=uow
+    )
+
+    @circuitbreaker("shared")
+    def boom():
+        raise RuntimeError("Boom")
+
+    def fail():
+        for _ in range(CALLS):
+            with pytest.raises(RuntimeError):
+                boom()
+
+    run_threads(fail)
+    ctx = uow.contexts.get("shared")
+    assert ctx.failure_count == THREADS * CALLS
@@ -1,9 +1,17 @@
 from purgatory.domain.messages.base import Message
-from purgatory.service._sync.repository import SyncInMemoryRepository
+from purgatory.domain.model import Context
+from purgatory.service._sync.repository import (
+    SyncCachedRepository,
+    SyncInMemoryRepository,
+)
 from purgatory.service._sync.unit_of_work import (
     SyncAbstractUnitOfWork,
+    SyncCachedUnitOfWork,
     SyncInMemoryUnitOfWork,
+    SyncRedisUnitOfWork,
+    SyncSqliteUnitOfWork,
 )
+from tests.unittests.time import VirtualClock
 
 
 class TrackableUnitOfWork(SyncAbstractUnitOfWork):
@@ -47,3 +55,69 @@ def test_uow_is_collecting_events():
     uow.contexts.messages = [a, b, c]
     events = list(uow.collect_new_events())
     assert events == [a, b, c]
+
+
+def test_cached_uow_delegates_transaction():
+    tracked = TrackableUnitOfWork()
+    clock = VirtualClock()
+    uow = SyncCachedUnitOfWork(tracked, max_age=5, clock=clock.monotonic)
+    assert isinstance(uow.contexts, SyncCachedRepository)
+    assert uow.contexts.repository is tracked.contexts
+    assert uow.contexts.max_age == 5
+    assert uow.contexts.clock == clock.monotonic
+    uow.initialize()
+    try:
+        with uow:
+            raise RuntimeError("Boom")
+    except RuntimeError:
+        pass
+    assert tracked.rollbacked is True
+    uow.commit()
+    assert tracked.commited is True
+
+
+def test_uow_is_collecting_events_raised_while_collecting():
+    uow = SyncInMemoryUnitOfWork()
+    a = Message()
+    b = Message()
+    uow.contexts.messages = [a]
+    events = []
+    for event in uow.collect_new_events():
+        events.append(event)
+        if event is a:
+            uow.contexts.messages.append(b)
+    assert events == [a, b]
+    assert uow.contexts.messages == []
+
+
+def test_redis_uow_commit_flush(fake_redis):
+    uow = SyncRedisUnitOfWork(client=fake_redis, write_behind=True)
+    assert uow.contexts.write_behind is True
+    assert uow.contexts.redis is fake_redis
+    uow.initialize()
+    uow.contexts.register(Context("foo", 10, 10))
+    uow.contexts.inc_failures("foo", 1)
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "0"
+    uow.commit()
+    assert fake_redis.storage["cbrh::foo"]["failure_count"] == "1"
+
+
+def test_bounded_inmemory_uow(clock):
+    uow = SyncInMemoryUnitOfWork(max_size=10, idle_ttl=60, clock=clock.monotonic)
+    assert uow.contexts.max_size == 10
+    assert uow.contexts.idle_ttl == 60
+    assert uow.contexts.clock == clock.monotonic
+
+
+def test_sqlite_uow(sqlite_path):
+    uow = SyncSqliteUnitOfWork(sqlite_path, flush_interval=60)
+    uow.initialize()
+    uow.contexts.register(Context("foo", 10, 10))
+    uow.contexts.inc_failures("foo", 1)
+    other = SyncSqliteUnitOfWork(sqlite_path, max_age=60)
+    assert (other.contexts.get("foo")).failure_count == 0
+    uow.commit()
+    assert (other.contexts.get("foo")).failure_count == 0
+    other.contexts.invalidate()
+    assert (other.contexts.get("foo")).failure_count == 1
+    other.rollback()
@@ -0,0 +1,128 @@
+"""
+Limiters of the calls in flight, with waiting calls.
+
+This module is not generated, the waiting calls are tasks or threads.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from purgatory.domain.model import Bulkhead
+from purgatory.service._bulkhead import AsyncBulkhead, SyncBulkhead
+
+
+async def test_async_bulkhead_queue():
+    bulkhead = AsyncBulkhead(Bulkhead(1, max_queued=2))
+    assert await bulkhead.acquire() is True
+    waiting = [asyncio.ensure_future(bulkhead.acquire()) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert len(bulkhead.waiters) == 2
+    # the queue is full
+    assert await bulkhead.acquire() is False
+
+    bulkhead.release()
+    assert await waiting[0] is True
+    assert not waiting[1].done()
+    assert bulkhead.in_flight == 1
+    bulkhead.release()
+    assert await waiting[1] is True
+    bulkhead.release()
+    assert bulkhead.in_flight == 0
+    assert not bulkhead.waiters
+
+
+async def test_async_bulkhead_timeout():
+    bulkhead = AsyncBulkhead(Bulkhead(1, max_queued=1, max_wait=0.01))
+    assert await bulkhead.acquire() is True
+    assert await bulkhead.acquire() is False
+    assert not bulkhead.waiters
+    bulkhead.release()
+    assert bulkhead.in_flight == 0
+
+
+async def test_async_bulkhead_cancelled():
+    bulkhead = AsyncBulkhead(Bulkhead(1, max_queued=2))
+    assert await bulkhead.acquire() is True
+    cancelled = asyncio.ensure_future(bulkhead.acquire())
+    waiting = asyncio.ensure_future(bulkhead.acquire())
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert len(bulkhead.waiters) == 1
+
+    bulkhead.release()
+    assert await waiting is True
+    assert bulkhead.in_flight == 1
+
+
+async def test_async_bulkhead_cancelled_after_release():
+    bulkhead = AsyncBulkhead(Bulkhead(1, max_queued=1))
+    assert await bulkhead.acquire() is True
+    waiting = asyncio.ensure_future(bulkhead.acquire())
+    await asyncio.sleep(0)
+    # the slot is given to the waiting call, that is cancelled before it runs
+    bulkhead.release()
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert bulkhead.in_flight == 0
+    assert not bulkhead.waiters
+
+
+async def test_async_bulkhead_released_on_timeout(monkeypatch):
+    bulkhead = AsyncBulkhead(Bulkhead(1, max_queued=1, max_wait=0.01))
+    assert await bulkhead.acquire() is True
+
+    async def wait_for(waiter, timeout):
+        # the slot is given in the loop iteration of the timeout
+        bulkhead.release()
+        raise asyncio.TimeoutError
+
+    monkeypatch.setattr(asyncio, "wait_for", wait_for)
+    assert await bulkhead.acquire() is True
+    assert bulkhead.in_flight == 1
+    assert not bulkhead.waiters
+    bulkhead.release()
+    assert bulkhead.in_flight == 0
+
+
+def test_sync_bulkhead():
+    bulkhead = SyncBulkhead(Bulkhead(2))
+    assert bulkhead.acquire() is True
+    assert bulkhead.acquire() is True
+    assert bulkhead.acquire() is False
+    bulkhead.release()
+    assert bulkhead.acquire() is True
+    assert bulkhead.in_flight == 2
+
+
+def test_sync_bulkhead_timeout():
+    bulkhead = SyncBulkhead(Bulkhead(1, max_queued=1, max_wait=0.01))
+    assert bulkhead.acquire() is True
+    assert bulkhead.acquire() is False
+    assert bulkhead.queued == 0
+
+
+def test_sync_bulkhead_queue():
+    bulkhead = SyncBulkhead(Bulkhead(1, max_queued=4, max_wait=10))
+    assert bulkhead.acquire() is True
+    acquired = []
+
+    def run():
+        acquired.append(bulkhead.acquire())
+        bulkhead.release()
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while bulkhead.queued < 4:
+        pass
+    assert bulkhead.acquire() is False
+    bulkhead.release()
+    for thread in threads:
+        thread.join()
+    assert acquired == [True] * 4
+    assert bulkhead.in_flight == 0
@@ -0,0 +1,33 @@
+"""
+Redis clients shared by the repositories.
+
+This module is not generated, the asyncio clients are shared per event loop.
+"""
+
+import asyncio
+
+from purgatory.service._async.repository import AsyncRedisRepository
+from purgatory.service._redis import ASYNC_CLIENTS
+from purgatory.service._sync.repository import SyncRedisRepository
+
+
+def test_async_clients_are_shared_per_loop():
+    repository = AsyncRedisRepository("redis://localhost/5")
+
+    async def get_client():
+        client = repository.redis
+        assert AsyncRedisRepository("redis://localhost/5").redis is client
+        return client
+
+    first = asyncio.run(get_client())
+    second = asyncio.run(get_client())
+    assert second is not first
+    assert second.connection_pool is not first.connection_pool
+    # the client of the closed loop has been dropped
+    assert first not in ASYNC_CLIENTS.values()
+    assert second in ASYNC_CLIENTS.values()
+
+
+def test_sync_clients_are_shared_per_process():
+    repository = SyncRedisRepository("redis://localhost/5")
+    assert SyncRedisRepository("redis://localhost/5").redis is repository.redis
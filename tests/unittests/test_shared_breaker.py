@@ -0,0 +1,85 @@
+"""
+Breakers reused by concurrent calls.
+
+This module is not generated, the concurrent calls are tasks.
+"""
+
+import asyncio
+
+import pytest
+
+from purgatory import AsyncCircuitBreakerFactory, CallTimeoutError
+from tests.unittests.time import VirtualClock
+
+
+async def in_flight(brk):
+    """Start a call of the breaker, return a function that finishes it."""
+    started = asyncio.Event()
+    finished = asyncio.Event()
+
+    async def call():
+        async with brk:
+            started.set()
+            await finished.wait()
+
+    task = asyncio.ensure_future(call())
+    await started.wait()
+
+    async def finish():
+        finished.set()
+        await task
+
+    return finish
+
+
+async def test_slow_calls_of_a_shared_breaker():
+    clock = VirtualClock()
+    circuitbreaker = AsyncCircuitBreakerFactory(
+        default_threshold=1, clock=clock.monotonic, wall_clock=clock.time
+    )
+    brk = await circuitbreaker.get_breaker("my", slow_call_duration=5)
+    finish = await in_flight(brk)
+    await clock.AsyncSleep(6)
+    # a fast call, while the slow one is in flight
+    async with brk:
+        pass
+    assert brk.context.state == "closed"
+    await finish()
+    assert brk.context.state == "opened"
+    assert brk.calls == {}
+
+
+async def test_probes_of_a_shared_breaker():
+    clock = VirtualClock()
+    circuitbreaker = AsyncCircuitBreakerFactory(
+        default_threshold=1, default_ttl=10, clock=clock.monotonic
+    )
+    brk = await circuitbreaker.get_breaker("my", max_probes=2)
+    with pytest.raises(RuntimeError):
+        async with brk:
+            raise RuntimeError("Boom")
+    await clock.AsyncSleep(11)
+
+    first = await in_flight(brk)
+    second = await in_flight(brk)
+    assert circuitbreaker.uow.contexts.probes == {"my": 2}
+    await first()
+    await second()
+    assert brk.context.state == "closed"
+    assert circuitbreaker.uow.contexts.probes == {}
+    assert brk.calls == {}
+
+
+async def test_timeouts_of_a_shared_breaker():
+    circuitbreaker = AsyncCircuitBreakerFactory()
+    brk = await circuitbreaker.get_breaker("my", timeout=0.05)
+    first = await in_flight(brk)
+    await asyncio.sleep(0.02)
+    second = await in_flight(brk)
+    # the first call returns in time, the second one reaches its timeout
+    await first()
+    await asyncio.sleep(0.1)
+    with pytest.raises(CallTimeoutError):
+        await second()
+    assert brk.context.failure_count == 1
+    assert brk.calls == {}
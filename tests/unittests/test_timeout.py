@@ -0,0 +1,240 @@
+"""
+Timeouts of the calls.
+
+This module is not generated, the async calls are cancelled by the event
+loop, while the sync calls are measured with the clock of the factory.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from purgatory import (
+    AsyncCircuitBreakerFactory,
+    CallTimeoutError,
+    SyncCircuitBreakerFactory,
+)
+from purgatory.domain.model import OpenedState
+from tests.unittests.time import VirtualClock
+
+
+async def test_async_decorator_timeout():
+    circuitbreaker = AsyncCircuitBreakerFactory(default_threshold=2)
+    cancelled = []
+
+    @circuitbreaker("my", timeout=0.01)
+    async def call(delay):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    assert await call(0) == 0
+    with pytest.raises(CallTimeoutError) as ctx:
+        await call(10)
+    assert ctx.value.circuit_name == "my"
+    assert ctx.value.timeout == 0.01
+    assert isinstance(ctx.value.__cause__, asyncio.CancelledError)
+    assert cancelled == [10]
+
+    brk = await circuitbreaker.get_breaker("my")
+    assert brk.context.failure_count == 1
+    with pytest.raises(TimeoutError):
+        await call(10)
+    assert brk.context.state == "opened"
+    with pytest.raises(OpenedState):
+        await call(0)
+
+
+async def test_async_default_timeout():
+    circuitbreaker = AsyncCircuitBreakerFactory(default_timeout=0.01)
+
+    @circuitbreaker("my")
+    async def call():
+        await asyncio.sleep(10)
+
+    with pytest.raises(CallTimeoutError):
+        await call()
+
+    @circuitbreaker("other", timeout=10)
+    async def slow():
+        await asyncio.sleep(0.02)
+        return 42
+
+    assert await slow() == 42
+
+
+async def test_async_timeout_excluded():
+    circuitbreaker = AsyncCircuitBreakerFactory(exclude=[CallTimeoutError])
+
+    @circuitbreaker("my", timeout=0.01)
+    async def call():
+        await asyncio.sleep(10)
+
+    with pytest.raises(CallTimeoutError):
+        await call()
+    brk = await circuitbreaker.get_breaker("my")
+    assert brk.context.failure_count == 0
+
+
+async def test_async_timeout_swallowed():
+    circuitbreaker = AsyncCircuitBreakerFactory()
+
+    @circuitbreaker("my", timeout=0.01)
+    async def call():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            pass
+        return 42
+
+    with pytest.raises(CallTimeoutError):
+        await call()
+    brk = await circuitbreaker.get_breaker("my")
+    assert brk.context.failure_count == 1
+
+
+async def test_async_context_manager_timeout():
+    circuitbreaker = AsyncCircuitBreakerFactory()
+    brk = await circuitbreaker.get_breaker("my", timeout=0.01)
+    with pytest.raises(CallTimeoutError):
+        async with brk:
+            await asyncio.sleep(10)
+    assert brk.context.failure_count == 1
+    # the task is not cancelled anymore
+    await asyncio.sleep(0)
+    async with brk:
+        await asyncio.sleep(0)
+    assert brk.context.failure_count == 0
+
+
+async def test_async_timeout_outer_cancel():
+    circuitbreaker = AsyncCircuitBreakerFactory()
+
+    @circuitbreaker("my", timeout=10)
+    async def call():
+        await asyncio.sleep(10)
+
+    task = asyncio.ensure_future(call())
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    brk = await circuitbreaker.get_breaker("my")
+    assert brk.context.failure_count == 1
+
+
+async def test_async_deadlines():
+    circuitbreaker = AsyncCircuitBreakerFactory(default_timeout=0.02)
+    deadlines = circuitbreaker.get_deadlines()
+    assert circuitbreaker.get_deadlines(0.02) is deadlines
+    assert circuitbreaker.get_deadlines(1) is not deadlines
+
+    @circuitbreaker("my")
+    async def call(delay):
+        await asyncio.sleep(delay)
+        return delay
+
+    # a single timer is armed for the calls in flight
+    calls = [asyncio.ensure_future(call(delay)) for delay in (0, 0.01, 0.2, 0.2)]
+    await asyncio.sleep(0)
+    loop_deadlines = deadlines.current()
+    assert len(loop_deadlines.calls) == 4
+    timer = loop_deadlines.timer
+    assert timer is not None
+    assert await calls[0] == 0
+    assert await calls[1] == 0.01
+    assert len(loop_deadlines.calls) == 2
+    assert loop_deadlines.timer is timer
+    for task in calls[2:]:
+        with pytest.raises(CallTimeoutError):
+            await task
+    assert not loop_deadlines.calls
+    assert not loop_deadlines.expired
+    assert loop_deadlines.timer is None
+
+
+def test_async_deadlines_new_loop():
+    circuitbreaker = AsyncCircuitBreakerFactory(default_timeout=0.01)
+
+    @circuitbreaker("my")
+    async def call():
+        await asyncio.sleep(1)
+
+    for _ in range(2):
+        with pytest.raises(CallTimeoutError):
+            asyncio.run(call())
+    # the deadlines of the closed loop are dropped
+    assert len(circuitbreaker.get_deadlines().loops) == 1
+
+
+def test_async_deadlines_threads():
+    circuitbreaker = AsyncCircuitBreakerFactory(default_timeout=0.05, thread_safe=True)
+    started = threading.Event()
+    errors = []
+
+    @circuitbreaker("my")
+    async def call():
+        started.set()
+        await asyncio.sleep(1)
+
+    def run():
+        try:
+            asyncio.run(call())
+        except BaseException as exc:
+            errors.append(exc)
+
+    # the loop of the thread keeps its calls while the other loop starts
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    with pytest.raises(CallTimeoutError):
+        asyncio.run(call())
+    thread.join()
+    assert [type(exc) for exc in errors] == [CallTimeoutError]
+
+
+def test_sync_decorator_timeout():
+    clock = VirtualClock()
+    circuitbreaker = SyncCircuitBreakerFactory(
+        default_threshold=2, clock=clock.monotonic, wall_clock=clock.time
+    )
+
+    @circuitbreaker("my", timeout=1)
+    def call(delay, fail=False):
+        clock.SyncSleep(delay)
+        if fail:
+            raise RuntimeError("Boom")
+        return delay
+
+    assert call(0.5) == 0.5
+    # the call can not be interrupted, it is a failure, its result is kept
+    assert call(2) == 2
+    brk = circuitbreaker.get_breaker("my")
+    assert brk.context.failure_count == 1
+    # late errors are raised as is
+    with pytest.raises(RuntimeError):
+        call(2, fail=True)
+    assert brk.context.state == "opened"
+
+
+def test_sync_context_manager_timeout():
+    clock = VirtualClock()
+    circuitbreaker = SyncCircuitBreakerFactory(
+        default_timeout=1, clock=clock.monotonic, wall_clock=clock.time
+    )
+    brk = circuitbreaker.get_breaker("my")
+    with brk:
+        clock.SyncSleep(0.5)
+    assert brk.context.failure_count == 0
+    with brk:
+        clock.SyncSleep(2)
+    assert brk.context.failure_count == 1
+    with pytest.raises(ValueError):
+        with brk:
+            clock.SyncSleep(2)
+            raise ValueError("Boom")
+    assert brk.context.failure_count == 2
@@ -0,0 +1,98 @@
+"""
+Pending updates of the write behind repositories, written by a timer.
+
+This module is not generated, the async timer runs in the event loop while
+the sync timer runs in a thread.
+"""
+
+import asyncio
+
+import pytest
+
+from purgatory import (
+    AsyncCircuitBreakerFactory,
+    AsyncRedisUnitOfWork,
+    AsyncSqliteUnitOfWork,
+    SyncCircuitBreakerFactory,
+    SyncRedisUnitOfWork,
+    SyncSqliteUnitOfWork,
+)
+from tests.unittests._async.fake_redis import FakeRedis as AsyncFakeRedis
+from tests.unittests._sync.fake_redis import FakeRedis as SyncFakeRedis
+
+
+async def test_async_redis_flush_interval():
+    fake_redis = AsyncFakeRedis()
+    uow = AsyncRedisUnitOfWork(
+        client=fake_redis, write_behind=True, flush_interval=0.05
+    )
+    circuitbreaker = AsyncCircuitBreakerFactory(uow=uow)
+
+    @circuitbreaker("my")
+    async def boom():
+        raise RuntimeError("Boom")
+
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            await boom()
+    assert fake_redis.storage["cbrh::my"]["failure_count"] == "0"
+    # no other update comes
+    await asyncio.sleep(0.1)
+    assert fake_redis.storage["cbrh::my"]["failure_count"] == "3"
+    assert uow.contexts.pending == {}
+
+
+def test_sync_redis_flush_interval():
+    fake_redis = SyncFakeRedis()
+    uow = SyncRedisUnitOfWork(client=fake_redis, write_behind=True, flush_interval=0.05)
+    circuitbreaker = SyncCircuitBreakerFactory(uow=uow)
+
+    @circuitbreaker("my")
+    def boom():
+        raise RuntimeError("Boom")
+
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            boom()
+    timer = uow.contexts.timer.timer
+    assert timer is not None
+    timer.join()
+    assert fake_redis.storage["cbrh::my"]["failure_count"] == "3"
+    assert uow.contexts.pending == {}
+
+
+async def test_async_sqlite_flush_interval(tmp_path):
+    path = str(tmp_path / "purgatory.sqlite")
+    uow = AsyncSqliteUnitOfWork(path, flush_interval=0.05)
+    circuitbreaker = AsyncCircuitBreakerFactory(uow=uow)
+
+    @circuitbreaker("my")
+    async def boom():
+        raise RuntimeError("Boom")
+
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            await boom()
+    other = AsyncSqliteUnitOfWork(path)
+    assert (await other.contexts.get("my")).failure_count == 0
+    await asyncio.sleep(0.1)
+    assert (await other.contexts.get("my")).failure_count == 3
+
+
+def test_sync_sqlite_flush_interval(tmp_path):
+    path = str(tmp_path / "purgatory.sqlite")
+    uow = SyncSqliteUnitOfWork(path, flush_interval=0.05)
+    circuitbreaker = SyncCircuitBreakerFactory(uow=uow)
+
+    @circuitbreaker("my")
+    def boom():
+        raise RuntimeError("Boom")
+
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            boom()
+    timer = uow.repository.timer.timer
+    assert timer is not None
+    timer.join()
+    other = SyncSqliteUnitOfWork(path)
+    assert other.contexts.get("my").failure_count == 3
@@ -1,10 +1,21 @@
-import asyncio
 import time
 
 
-async def AsyncSleep(ttl: float):
-    await asyncio.sleep(ttl)
+class VirtualClock:
+    """A clock that only moves when the tests are sleeping."""
 
+    def __init__(self) -> None:
+        self.elapsed = 0.0
+        self.started_at = time.time()
 
-def SyncSleep(ttl: float):
-    time.sleep(ttl)
+    def monotonic(self) -> float:
+        return 1000.0 + self.elapsed
+
+    def time(self) -> float:
+        return self.started_at + self.elapsed
+
+    async def AsyncSleep(self, duration: float) -> None:
+        self.elapsed += duration
+
+    def SyncSleep(self, duration: float) -> None:
+        self.elapsed += duration